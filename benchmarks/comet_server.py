@@ -0,0 +1,48 @@
+"""Comet with every hardcoded upstream pointed at benchmarks.fake_upstreams, started by
+benchmarks.stream_load. Scrapers already take their URLs from the settings, the rest
+(IMDb, Kitsu, Trakt, the debrid APIs) is redirected here.
+
+    FAKE_UPSTREAMS_URL=http://127.0.0.1:18080 python -m benchmarks.comet_server --port 18000
+"""
+
+import argparse
+import os
+
+import aiohttp
+import uvicorn
+
+fake_upstreams_url = os.environ["FAKE_UPSTREAMS_URL"]
+redirects = {
+    "https://v3.sg.media-imdb.com/": f"{fake_upstreams_url}/imdb/",
+    "https://kitsu.io/": f"{fake_upstreams_url}/kitsu/",
+    "https://api.trakt.tv/": f"{fake_upstreams_url}/trakt/",
+    "https://real-debrid.com/": f"{fake_upstreams_url}/realdebrid/",
+}
+request = aiohttp.ClientSession._request
+
+
+async def redirected_request(self, method, url, *args, **kwargs):
+    url = str(url)
+    for prefix, fake_prefix in redirects.items():
+        if url.startswith(prefix):
+            url = fake_prefix + url[len(prefix) :]
+            break
+
+    return await request(self, method, url, *args, **kwargs)
+
+
+aiohttp.ClientSession._request = redirected_request
+
+from comet.debrid.manager import debrid_services  # noqa: E402
+from comet.main import app  # noqa: E402
+
+for name, debrid in debrid_services.items():
+    debrid.api_url = f"{fake_upstreams_url}/{name}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=18000)
+    args = parser.parse_args()
+
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
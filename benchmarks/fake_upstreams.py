@@ -0,0 +1,594 @@
+"""Local stand-ins for every upstream Comet talks to: IMDb suggestions, Kitsu, Trakt,
+Jackett, Prowlarr, Zilean, Torrentio, MediaFusion, the debrid APIs and the files
+they unrestrict. Results are generated from the searched title so every scraper and
+debrid service agree on the same torrents.
+
+    python -m benchmarks.fake_upstreams --port 18080 --latency 0.05 --latency-of zilean=0.3 --results 100 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import random
+import re
+
+import bencodepy
+from aiohttp import web
+
+words = [
+    "Silent", "Harbor", "Crimson", "Valley", "Iron", "Garden", "Hidden", "Empire",
+    "Broken", "Arrow", "Winter", "Signal", "Golden", "Circuit", "Paper", "Moon",
+    "Northern", "Tide", "Glass", "Orchard", "Velvet", "Storm", "Distant", "Shore",
+]  # fmt: skip
+resolutions = ["2160p", "1080p", "1080p", "720p", "480p"]
+sources = ["BluRay", "WEB-DL", "WEBRip", "HDTV", "BluRay REMUX"]
+codecs = ["x264", "x265", "HEVC", "AVC"]
+languages = ["", "", "MULTi", "FRENCH", "iTA", "GERMAN"]
+groups = ["GRP", "NTb", "FLUX", "SPARKS", "RARBG", "YTS", "TEPES"]
+episode_pattern = re.compile(r"\s+[sS](\d+)[eE](\d+)$")
+compact_json = functools.partial(json.dumps, separators=(",", ":"))
+
+
+def media_title(media_id: str):
+    digest = hashlib.sha1(media_id.encode()).digest()
+    return f"{words[digest[0] % len(words)]} {words[digest[1] % len(words)]}"
+
+
+def title_year(title: str):
+    return 1990 + hashlib.sha1(title.encode()).digest()[0] % 35
+
+
+class Upstreams:
+    def __init__(
+        self,
+        results: int,
+        cached_ratio: float,
+        torrent_file_ratio: float,
+        file_size: int,
+        seed: int,
+    ):
+        self.results = results
+        self.cached_ratio = cached_ratio
+        self.torrent_file_ratio = torrent_file_ratio
+        self.file_size = file_size
+        self.seed = seed
+        self.base_url = None
+
+        self.torrents = {}  # info hash -> torrent, for the debrid APIs
+        self.torrent_files = {}  # name -> bencoded .torrent
+        self.magnets = {}  # debrid side ids -> info hash
+
+    def search(self, name: str, season: int = None, episode: int = None):
+        rng = random.Random(f"{self.seed}:{name}:{season}:{episode}")
+        year = title_year(name)
+        torrents = []
+        for i in range(self.results):
+            resolution = rng.choice(resolutions)
+            release = f"{rng.choice(languages)} {resolution} {rng.choice(sources)} {rng.choice(codecs)}-{rng.choice(groups)}".strip()
+            pack = season is not None and i % 5 == 0
+            if season is None:
+                title = f"{name} {year} {release}"
+            elif pack:
+                title = f"{name} S{season:02d} {release}"
+            else:
+                title = f"{name} S{season:02d}E{episode:02d} {release}"
+
+            info_hash = hashlib.sha1(f"{title}:{i}".encode()).hexdigest()
+            torrent = {
+                "title": title.replace("  ", " "),
+                "info_hash": info_hash,
+                "size": rng.randrange(700, 60000) * 1048576,
+                "season": season,
+                "episode": None if pack else episode,
+                "cached": rng.random() < self.cached_ratio,
+                "link": None,
+            }
+            if rng.random() < self.torrent_file_ratio:
+                self.add_torrent_file(torrent)
+
+            self.torrents[torrent["info_hash"]] = torrent
+            torrents.append(torrent)
+
+        return torrents
+
+    def add_torrent_file(self, torrent: dict):
+        # the hash is then computed by get_torrent_hash from the bencoded file
+        info = {
+            b"name": torrent["title"].encode(),
+            b"length": torrent["size"],
+            b"piece length": 262144,
+            b"pieces": hashlib.sha1(torrent["title"].encode()).digest() * 4,
+        }
+        torrent["info_hash"] = hashlib.sha1(bencodepy.encode(info)).hexdigest()
+        self.torrent_files[f"{torrent['info_hash']}.torrent"] = bencodepy.encode(
+            {b"announce": b"udp://tracker.invalid:1337", b"info": info}
+        )
+        torrent["link"] = f"{self.base_url}/jackett/dl/{torrent['info_hash']}.torrent"
+
+    def files(self, info_hash: str):
+        torrent = self.torrents.get(info_hash.lower())
+        if torrent is None or not torrent["cached"]:
+            return []
+
+        files = [{"name": "sample.mkv", "size": 20971520}]
+        if torrent["season"] is not None and torrent["episode"] is None:
+            name = torrent["title"].split(f" S{torrent['season']:02d}")[0]
+            files.extend(
+                {
+                    "name": f"{name} S{torrent['season']:02d}E{episode:02d} 1080p.mkv",
+                    "size": torrent["size"] // 10,
+                }
+                for episode in range(1, 11)
+            )
+        else:
+            files.append({"name": f"{torrent['title']}.mkv", "size": torrent["size"]})
+
+        return files
+
+    def link(self, info_hash: str, index):
+        return f"{self.base_url}/file/{info_hash}/{index}.mkv"
+
+    def magnet_id(self, info_hash: str):
+        magnet_id = len(self.magnets) + 1
+        self.magnets[magnet_id] = info_hash
+        return magnet_id
+
+
+def parse_query(query: str):
+    match = episode_pattern.search(query)
+    if match:
+        return query[: match.start()], int(match.group(1)), int(match.group(2))
+
+    return query, None, None
+
+
+def parse_full_id(full_id: str):
+    parts = full_id.split(":")
+    if len(parts) == 3:
+        return media_title(parts[0]), int(parts[1]), int(parts[2])
+
+    return media_title(full_id), None, None
+
+
+def create_app(
+    upstreams: Upstreams, latency: float, latencies: dict, error_rate: float
+):
+    rng = random.Random(upstreams.seed)
+
+    @web.middleware
+    async def simulate_network(request: web.Request, handler):
+        service = request.path.split("/")[1]
+        if service != "file":
+            await asyncio.sleep(latencies.get(service, latency))
+            if rng.random() < error_rate:
+                raise web.HTTPServiceUnavailable()
+
+        return await handler(request)
+
+    # metadata
+    async def imdb(request: web.Request):
+        media_id = request.match_info["id"]
+        return web.json_response(
+            {
+                "d": [
+                    {
+                        "id": media_id,
+                        "l": media_title(media_id),
+                        "y": title_year(media_title(media_id)),
+                    }
+                ]
+            }
+        )
+
+    async def kitsu(request: web.Request):
+        return web.json_response(
+            {
+                "data": {
+                    "attributes": {
+                        "canonicalTitle": media_title(f"kitsu:{request.match_info['id']}")
+                    }
+                }
+            }
+        )
+
+    async def trakt(request: web.Request):
+        return web.json_response([])
+
+    # scrapers
+    async def jackett(request: web.Request):
+        name, season, episode = parse_query(request.query["Query"])
+        return web.json_response(
+            {
+                "Results": [
+                    {
+                        "Title": torrent["title"],
+                        "InfoHash": None if torrent["link"] else torrent["info_hash"],
+                        "Size": torrent["size"],
+                        "Tracker": request.query.get("Tracker[]", "bench"),
+                        "Link": torrent["link"],
+                    }
+                    for torrent in upstreams.search(name, season, episode)
+                ]
+            }
+        )
+
+    async def torrent_file(request: web.Request):
+        torrent_file = upstreams.torrent_files.get(request.match_info["name"])
+        if torrent_file is None:
+            raise web.HTTPNotFound()
+
+        return web.Response(body=torrent_file, content_type="application/x-bittorrent")
+
+    async def prowlarr_indexers(request: web.Request):
+        return web.json_response(
+            [
+                {"id": i, "name": f"Bench{i}", "definitionName": f"bench{i}"}
+                for i in range(1, 5)
+            ]
+        )
+
+    async def prowlarr_search(request: web.Request):
+        name, season, episode = parse_query(request.query["query"])
+        return web.json_response(
+            [
+                {
+                    "title": torrent["title"],
+                    "infoHash": torrent["info_hash"],
+                    "size": torrent["size"],
+                    "indexer": "Bench1",
+                }
+                for torrent in upstreams.search(name, season, episode)
+            ]
+        )
+
+    async def zilean(request: web.Request):
+        season = request.query.get("season")
+        episode = request.query.get("episode")
+        torrents = upstreams.search(
+            request.query["query"],
+            int(season) if season else None,
+            int(episode) if episode else None,
+        )
+        return web.json_response(
+            [
+                {
+                    "raw_title": torrent["title"],
+                    "info_hash": torrent["info_hash"],
+                    "size": torrent["size"],
+                }
+                for torrent in torrents
+            ]
+        )
+
+    async def torrentio(request: web.Request):
+        torrents = upstreams.search(*parse_full_id(request.match_info["id"]))
+        return web.json_response(
+            {
+                "streams": [
+                    {
+                        "title": f"{torrent['title']}\n👤 42 💾 {torrent['size'] / 1073741824:.2f} GB ⚙️ BenchTracker",
+                        "infoHash": torrent["info_hash"],
+                    }
+                    for torrent in torrents
+                ]
+            }
+        )
+
+    async def mediafusion(request: web.Request):
+        torrents = upstreams.search(*parse_full_id(request.match_info["id"]))
+        return web.json_response(
+            {
+                "streams": [
+                    {
+                        "description": f"📂 {torrent['title']}\n💾 {torrent['size'] / 1073741824:.2f} GB\n🔗 BenchTracker",
+                        "infoHash": torrent["info_hash"],
+                        "behaviorHints": {"videoSize": torrent["size"]},
+                    }
+                    for torrent in torrents
+                ]
+            }
+        )
+
+    # Real-Debrid
+    async def realdebrid_user(request: web.Request):
+        return web.Response(text='{"id": 1, "type": "premium"}')
+
+    async def realdebrid_vpn(request: web.Request):
+        return web.Response(text="ok")
+
+    async def realdebrid_add_magnet(request: web.Request):
+        data = await request.post()
+        info_hash = data["magnet"].split("btih:")[1]
+        return web.json_response({"id": str(upstreams.magnet_id(info_hash))})
+
+    async def realdebrid_info(request: web.Request):
+        info_hash = upstreams.magnets[int(request.match_info["id"])]
+        files = upstreams.files(info_hash)
+        return web.json_response(
+            {
+                "files": [
+                    {"id": index, "path": f"/{file['name']}", "bytes": file["size"]}
+                    for index, file in enumerate(files, 1)
+                ],
+                "links": [f"{upstreams.base_url}/realdebrid/link/{info_hash}"],
+            }
+        )
+
+    async def realdebrid_unrestrict(request: web.Request):
+        data = await request.post()
+        info_hash = data["link"].rsplit("/", 1)[1]
+        return web.json_response({"download": upstreams.link(info_hash, 1)})
+
+    async def no_content(request: web.Request):
+        return web.Response(status=204)
+
+    # All-Debrid
+    async def alldebrid_user(request: web.Request):
+        return web.json_response(
+            {"status": "success", "data": {"user": {"isPremium": True}}},
+            dumps=compact_json,
+        )
+
+    async def alldebrid_upload(request: web.Request):
+        info_hash = request.query["magnets[]"]
+        return web.json_response(
+            {
+                "status": "success",
+                "data": {
+                    "magnets": [
+                        {"id": upstreams.magnet_id(info_hash), "hash": info_hash}
+                    ]
+                },
+            }
+        )
+
+    async def alldebrid_status(request: web.Request):
+        magnet_id = int(request.query["id"])
+        info_hash = upstreams.magnets[magnet_id]
+        return web.json_response(
+            {
+                "status": "success",
+                "data": {
+                    "magnets": {
+                        "id": magnet_id,
+                        "hash": info_hash,
+                        "links": [
+                            {
+                                "filename": file["name"],
+                                "size": file["size"],
+                                "link": f"{info_hash}:{index}",
+                            }
+                            for index, file in enumerate(upstreams.files(info_hash))
+                        ],
+                    }
+                },
+            }
+        )
+
+    async def alldebrid_delete(request: web.Request):
+        return web.json_response({"status": "success", "data": {}})
+
+    async def alldebrid_unlock(request: web.Request):
+        info_hash, index = request.query["link"].split(":")
+        return web.json_response(
+            {"status": "success", "data": {"link": upstreams.link(info_hash, index)}}
+        )
+
+    # Premiumize
+    async def premiumize_account(request: web.Request):
+        return web.json_response(
+            {"status": "success", "premium_until": 4102444800}, dumps=compact_json
+        )
+
+    async def premiumize_cache_check(request: web.Request):
+        files = [upstreams.files(info_hash) for info_hash in request.query.getall("items[]")]
+        return web.json_response(
+            {
+                "status": "success",
+                "response": [len(file) != 0 for file in files],
+                "filename": [file[-1]["name"] if file else None for file in files],
+                "filesize": [str(file[-1]["size"]) if file else None for file in files],
+            }
+        )
+
+    async def premiumize_directdl(request: web.Request):
+        info_hash = request.query["src"].split("btih:")[1]
+        return web.json_response(
+            {
+                "status": "success",
+                "content": [
+                    {
+                        "path": f"{info_hash}/{file['name']}",
+                        "size": file["size"],
+                        "link": upstreams.link(info_hash, index),
+                    }
+                    for index, file in enumerate(upstreams.files(info_hash))
+                ],
+            }
+        )
+
+    # TorBox
+    async def torbox_user(request: web.Request):
+        return web.json_response(
+            {"success": True, "data": {"plan": 2}}, dumps=compact_json
+        )
+
+    async def torbox_check_cached(request: web.Request):
+        data = []
+        for info_hash in request.query["hash"].split(","):
+            files = upstreams.files(info_hash)
+            if files:
+                data.append({"hash": info_hash, "files": files})
+
+        return web.json_response({"success": True, "data": data})
+
+    async def torbox_mylist(request: web.Request):
+        return web.json_response({"success": True, "data": []})
+
+    async def torbox_create(request: web.Request):
+        data = await request.post()
+        info_hash = data["magnet"].split("btih:")[1]
+        return web.json_response(
+            {"success": True, "data": {"torrent_id": upstreams.magnet_id(info_hash)}}
+        )
+
+    async def torbox_request_download(request: web.Request):
+        info_hash = upstreams.magnets[int(request.query["torrent_id"])]
+        return web.json_response(
+            {"success": True, "data": upstreams.link(info_hash, request.query["file_id"])}
+        )
+
+    # Debrid-Link
+    async def debridlink_account(request: web.Request):
+        return web.json_response({"success": True, "value": {"accountType": 1}})
+
+    async def debridlink_add(request: web.Request):
+        data = await request.post()
+        return web.json_response(
+            {"success": True, "value": {"id": str(upstreams.magnet_id(data["url"]))}}
+        )
+
+    async def debridlink_list(request: web.Request):
+        info_hash = upstreams.magnets[int(request.query["ids"])]
+        return web.json_response(
+            {
+                "success": True,
+                "value": [
+                    {
+                        "status": 100,
+                        "files": [
+                            {
+                                **file,
+                                "downloadUrl": upstreams.link(info_hash, index),
+                            }
+                            for index, file in enumerate(upstreams.files(info_hash))
+                        ],
+                    }
+                ],
+            }
+        )
+
+    # unrestricted files, served with range support like a debrid CDN
+    async def file(request: web.Request):
+        size = upstreams.file_size
+        start = 0
+        match = re.match(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+        if match:
+            start = min(int(match.group(1)), size - 1)
+        end = size - 1
+        if match and match.group(2):
+            end = min(int(match.group(2)), end)
+
+        response = web.StreamResponse(
+            status=206,
+            headers={
+                "Content-Range": f"bytes {start}-{end}/{size}",
+                "Content-Length": str(end - start + 1),
+                "Accept-Ranges": "bytes",
+                "Content-Type": "video/x-matroska",
+            },
+        )
+        await response.prepare(request)
+        if request.method == "HEAD":
+            return response
+
+        chunk = b"\0" * 65536
+        remaining = end - start + 1
+        while remaining > 0:
+            await response.write(chunk[: min(remaining, len(chunk))])
+            remaining -= len(chunk)
+
+        return response
+
+    app = web.Application(middlewares=[simulate_network])
+    app.router.add_get("/imdb/suggestion/a/{id}.json", imdb)
+    app.router.add_get("/kitsu/api/edge/anime/{id}", kitsu)
+    app.router.add_get("/trakt/{type}/{id}/aliases", trakt)
+    app.router.add_get("/jackett/api/v2.0/indexers/all/results", jackett)
+    app.router.add_get("/jackett/dl/{name}", torrent_file)
+    app.router.add_get("/prowlarr/api/v1/indexer", prowlarr_indexers)
+    app.router.add_get("/prowlarr/api/v1/search", prowlarr_search)
+    app.router.add_get("/zilean/dmm/filtered", zilean)
+    app.router.add_get("/torrentio/stream/{type}/{id}.json", torrentio)
+    app.router.add_get("/mediafusion/stream/{type}/{id}.json", mediafusion)
+    app.router.add_get("/realdebrid/user", realdebrid_user)
+    app.router.add_get("/realdebrid/vpn", realdebrid_vpn)
+    app.router.add_post("/realdebrid/torrents/addMagnet", realdebrid_add_magnet)
+    app.router.add_get("/realdebrid/torrents/info/{id}", realdebrid_info)
+    app.router.add_post("/realdebrid/torrents/selectFiles/{id}", no_content)
+    app.router.add_delete("/realdebrid/torrents/delete/{id}", no_content)
+    app.router.add_post("/realdebrid/unrestrict/link", realdebrid_unrestrict)
+    app.router.add_get("/alldebrid/user", alldebrid_user)
+    app.router.add_get("/alldebrid/magnet/upload", alldebrid_upload)
+    app.router.add_get("/alldebrid/magnet/status", alldebrid_status)
+    app.router.add_get("/alldebrid/magnet/delete", alldebrid_delete)
+    app.router.add_get("/alldebrid/link/unlock", alldebrid_unlock)
+    app.router.add_get("/premiumize/account/info", premiumize_account)
+    app.router.add_get("/premiumize/cache/check", premiumize_cache_check)
+    app.router.add_post("/premiumize/transfer/directdl", premiumize_directdl)
+    app.router.add_get("/torbox/user/me", torbox_user)
+    app.router.add_get("/torbox/torrents/checkcached", torbox_check_cached)
+    app.router.add_get("/torbox/torrents/mylist", torbox_mylist)
+    app.router.add_post("/torbox/torrents/createtorrent", torbox_create)
+    app.router.add_get("/torbox/torrents/requestdl", torbox_request_download)
+    app.router.add_get("/debridlink/account/infos", debridlink_account)
+    app.router.add_post("/debridlink/seedbox/add", debridlink_add)
+    app.router.add_get("/debridlink/seedbox/list", debridlink_list)
+    app.router.add_delete("/debridlink/seedbox/{id}/remove", no_content)
+    app.router.add_get("/file/{hash}/{name}", file)
+    return app
+
+
+def parse_latencies(values: list):
+    return {
+        service: float(latency)
+        for service, latency in (value.split("=") for value in values or [])
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per upstream call")
+    parser.add_argument(
+        "--latency-of",
+        action="append",
+        metavar="SERVICE=SECONDS",
+        help="per service latency, ex: zilean=0.3 realdebrid=0.2",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls answered with a 503")
+    parser.add_argument("--results", type=int, default=100, help="torrents returned by each scraper")
+    parser.add_argument("--cached-ratio", type=float, default=0.7, help="share of torrents cached on the debrid service")
+    parser.add_argument("--torrent-file-ratio", type=float, default=0.1, help="share of Jackett results only given as a .torrent link")
+    parser.add_argument("--file-size", type=int, default=64, help="MB served by every unrestricted link")
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def create_upstreams(args: argparse.Namespace, base_url: str):
+    upstreams = Upstreams(
+        args.results,
+        args.cached_ratio,
+        args.torrent_file_ratio,
+        args.file_size * 1048576,
+        args.seed,
+    )
+    upstreams.base_url = base_url
+    return create_app(
+        upstreams, args.latency, parse_latencies(args.latency_of), args.error_rate
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    web.run_app(
+        create_upstreams(args, f"http://{args.host}:{args.port}"),
+        host=args.host,
+        port=args.port,
+        print=None,
+        access_log=None,
+    )
@@ -0,0 +1,300 @@
+"""Micro-benchmarks of the general.py functions that run per result of every /stream
+request, on synthetic torrents from benchmarks.fake_upstreams. Runs are appended to a
+JSON history, and compared against the previous one to catch regressions.
+
+    python -m benchmarks.hot_functions --sizes 1000,10000,50000 --save
+    python -m benchmarks.hot_functions --compare --threshold 0.1
+    python -m benchmarks.hot_functions --only get_balanced_hashes,format_title --repeat 10
+"""
+
+import argparse
+import asyncio
+import base64
+import copy
+import gc
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import orjson
+from RTN import parse
+
+from benchmarks.fake_upstreams import Upstreams, words
+from comet.utils.general import (
+    config_check,
+    filter,
+    format_title,
+    get_balanced_hashes,
+    get_torrent_hash,
+    is_video,
+    translate,
+    validate_config,
+)
+from comet.utils.results import ResultSet
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+trackers = ["Zilean|DMM", "Torrentio|1337x", "Jackett|YTS", "Prowlarr|Nyaa", "MediaFusion"]
+configs = {
+    "default": {},
+    "filtered": {
+        "resolutions": ["2160p", "1080p", "720p"],
+        "languages": ["English", "French", "Unknown"],
+        "maxResults": 30,
+        "maxResultsPerResolution": 10,
+        "maxSize": 40 * 1073741824,
+        "resultFormat": ["Title", "Metadata", "Size", "Languages"],
+    },
+}
+
+
+def b64(config: dict):
+    return base64.b64encode(orjson.dumps(config)).decode()
+
+
+def generate_torrents(size: int, seed: int):
+    # a few hundred distinct media, the titles Comet really parses look like these
+    upstreams = Upstreams(
+        results=50, cached_ratio=1, torrent_file_ratio=1, file_size=1, seed=seed
+    )
+    upstreams.base_url = "http://bench"
+
+    torrents = []
+    media = 0
+    while len(torrents) < size:
+        name = f"{words[media % len(words)]} {words[media // len(words) % len(words)]}"
+        if media % 3 == 0:
+            torrents.extend(upstreams.search(name))
+        else:
+            torrents.extend(upstreams.search(name, 1 + media % 4, 1 + media % 10))
+        media += 1
+
+    return upstreams, torrents[:size]
+
+
+def ranked_files(torrents: list, parse_limit: int):
+    # parsing is the slow part of building the dataset, distinct titles are capped and reused
+    parsed = [parse(torrent["title"]).model_dump() for torrent in torrents[:parse_limit]]
+
+    files = {}
+    for i, torrent in enumerate(torrents):
+        data = copy.copy(parsed[i % len(parsed)])
+        data["languages"] = list(data["languages"])
+        data["title"] = f"{torrent['title']}.mkv"
+        data["size"] = torrent["size"]
+        data["tracker"] = trackers[i % len(trackers)]
+        data["index"] = "1"
+        files[torrent["info_hash"]] = {
+            "infohash": torrent["info_hash"],
+            "rank": len(torrents) - i,
+            "fetch": not data["trash"] and i % 7 != 0,
+            "data": data,
+        }
+
+    return files
+
+
+class TorrentFileResponse:
+    status = 200
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def read(self):
+        return self.body
+
+
+class TorrentFileSession:
+    # serves the .torrent files from memory, only the bencode path is measured
+    def __init__(self, torrent_files: dict):
+        self.torrent_files = torrent_files
+
+    async def get(self, url: str, **kwargs):
+        return TorrentFileResponse(self.torrent_files[url.rsplit("/", 1)[1]])
+
+
+def create_benchmarks(size: int, args: argparse.Namespace):
+    upstreams, torrents = generate_torrents(size, args.seed)
+    titles = [torrent["title"] for torrent in torrents]
+    filenames = [
+        f"{title}.mkv" if i % 4 else f"{title}.nfo" for i, title in enumerate(titles)
+    ]
+    files = ranked_files(torrents, args.parse_limit)
+    validated_configs = {name: config_check(b64(config)) for name, config in configs.items()}
+    b64configs = [
+        b64({**configs["filtered" if i % 2 else "default"], "debridApiKey": f"key{i}"})
+        for i in range(100)
+    ]
+    loop = asyncio.new_event_loop()
+
+    results = ResultSet.from_cached(files)
+
+    def balanced(config: dict):
+        return lambda: get_balanced_hashes(results, config)
+
+    def formatted(config: dict):
+        # format_title inserts "multi" into the languages it is given, each run gets fresh ones
+        def setup():
+            for file in files.values():
+                file["data"]["languages"] = list(file["data"]["languages"])
+                if "multi" in file["data"]["languages"]:
+                    file["data"]["languages"].remove("multi")
+
+        def run():
+            for file in files.values():
+                format_title(file["data"], config)
+
+        return setup, run
+
+    filter_torrents = [(i, title) for i, title in enumerate(titles[: args.parse_limit])]
+
+    def filtered():
+        loop.run_until_complete(
+            filter(filter_torrents, "Silent Harbor", 2010, None, {}, True)
+        )
+
+    session = TorrentFileSession(upstreams.torrent_files)
+    jackett_torrents = [
+        (i, {"InfoHash": None, "Link": torrent["link"]}) for i, torrent in enumerate(torrents)
+    ]
+
+    async def hash_all():
+        for torrent in jackett_torrents:
+            await get_torrent_hash(session, torrent)
+
+    def checked():
+        for i in range(size):
+            config_check(b64configs[i % len(b64configs)])
+
+    def validated():
+        for i in range(size):
+            validate_config(b64configs[i % len(b64configs)])
+
+    def translated():
+        for title in titles:
+            translate(title)
+
+    def videos():
+        for filename in filenames:
+            is_video(filename)
+
+    return loop, {
+        # name: (setup, run, items)
+        "get_balanced_hashes/default": (None, balanced(validated_configs["default"]), size),
+        "get_balanced_hashes/filtered": (None, balanced(validated_configs["filtered"]), size),
+        "ResultSet.from_cached": (None, lambda: ResultSet.from_cached(files), size),
+        "format_title/default": (*formatted(validated_configs["default"]), size),
+        "format_title/filtered": (*formatted(validated_configs["filtered"]), size),
+        "filter": (None, filtered, len(filter_torrents)),
+        "get_torrent_hash/bencode": (None, lambda: loop.run_until_complete(hash_all()), size),
+        "config_check": (None, checked, size),
+        "validate_config": (None, validated, size),
+        "translate": (None, translated, size),
+        "is_video": (None, videos, size),
+    }
+
+
+def measure(setup, run, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+
+        gc.collect()
+        start_time = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start_time)
+
+    return min(timings), statistics.median(timings)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=repository,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def load_history(path: str):
+    if not os.path.exists(path):
+        return []
+
+    with open(path, "rb") as file:
+        return orjson.loads(file.read())
+
+
+def main(args: argparse.Namespace):
+    only = set(args.only.split(",")) if args.only else None
+    history = load_history(args.history)
+    baseline = history[-1]["results"] if args.compare and history else {}
+    if args.compare and not baseline:
+        print(f"No previous run in {args.history}, nothing to compare against")
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<36} {'items':>7} {'best/item':>12} {'median/item':>12} {'vs previous':>12}")
+    for size in args.sizes:
+        loop, benchmarks = create_benchmarks(size, args)
+        for name, (setup, run, items) in benchmarks.items():
+            if only and name.split("/")[0] not in only and name not in only:
+                continue
+
+            key = f"{name}[{size}]"
+            best, median = measure(setup, run, args.repeat)
+            results[key] = best / items
+
+            change = ""
+            if key in baseline:
+                ratio = results[key] / baseline[key] - 1
+                change = f"{ratio:+.1%}"
+                if ratio > args.threshold:
+                    regressions.append((key, ratio))
+
+            print(
+                f"{key:<36} {items:>7} {best / items * 1e6:>10.2f}us {median / items * 1e6:>10.2f}us {change:>12}"
+            )
+        loop.close()
+
+    if args.save:
+        history.append(
+            {
+                "timestamp": int(time.time()),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "machine": platform.node(),
+                "results": results,
+            }
+        )
+        with open(args.history, "wb") as file:
+            file.write(orjson.dumps(history, option=orjson.OPT_INDENT_2))
+
+    if regressions:
+        for key, ratio in regressions:
+            print(f"REGRESSION {key}: {ratio:+.1%} slower than the previous run")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        type=lambda sizes: [int(size) for size in sizes.split(",")],
+        default=[1000, 10000, 50000],
+        help="torrents per dataset",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark, the best one is kept")
+    parser.add_argument("--parse-limit", type=int, default=2000, help="distinct titles parsed by RTN, also the filter() dataset size")
+    parser.add_argument("--only", help="comma separated benchmark names")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--history", default=os.path.join(repository, "benchmarks", "hot_functions.json"))
+    parser.add_argument("--save", action="store_true", help="append this run to the history")
+    parser.add_argument("--compare", action="store_true", help="compare with the last saved run, exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown per item before failing, 0.2 = 20%%")
+    main(parser.parse_args())
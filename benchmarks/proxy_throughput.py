@@ -0,0 +1,126 @@
+"""Streaming throughput of a proxied response through the old BaseHTTPMiddleware
+LoguruMiddleware and the pure ASGI one, driven in-process without a server.
+
+    python -m benchmarks.proxy_throughput --size 512 --chunk 65536
+"""
+
+import argparse
+import asyncio
+import time
+
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+
+from comet.utils.logger import logger
+from comet.utils.middleware import LoguruMiddleware
+
+
+class BaseHTTPLoguruMiddleware(BaseHTTPMiddleware):
+    # the previous implementation
+    async def dispatch(self, request: Request, call_next):
+        start_time = time.time()
+        try:
+            response = await call_next(request)
+        except Exception as e:
+            logger.exception(f"Exception during request processing: {e}")
+            raise
+        finally:
+            process_time = time.time() - start_time
+            logger.log(
+                "API",
+                f"{request.method} {request.url.path} - {response.status_code if 'response' in locals() else '500'} - {process_time:.2f}s",
+            )
+        return response
+
+
+def create_app(size: int, chunk_size: int, middleware):
+    chunk = b"\0" * chunk_size
+
+    async def playback(request: Request):
+        async def stream_content():
+            for _ in range(size // chunk_size):
+                yield chunk
+
+        return StreamingResponse(stream_content(), status_code=206)
+
+    app = Starlette(routes=[Route("/playback", playback)])
+    if middleware is not None:
+        app.add_middleware(middleware)
+    return app
+
+
+async def run_request(app):
+    received = 0
+    first_byte = None
+    start_time = time.perf_counter()
+
+    request_sent = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal received, first_byte
+        if message["type"] == "http.response.body":
+            if first_byte is None:
+                first_byte = time.perf_counter() - start_time
+            received += len(message.get("body", b""))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/playback",
+        "raw_path": b"/playback",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"range", b"bytes=0-")],
+        "client": ("127.0.0.1", 12345),
+        "server": ("127.0.0.1", 8000),
+    }
+    await app(scope, receive, send)
+    disconnected.set()
+    return received, first_byte, time.perf_counter() - start_time
+
+
+async def main(size: int, chunk_size: int, rounds: int):
+    logger.remove()  # measure the middleware, not the log sink
+
+    for name, middleware in (
+        ("none", None),
+        ("BaseHTTPMiddleware", BaseHTTPLoguruMiddleware),
+        ("pure ASGI", LoguruMiddleware),
+    ):
+        app = create_app(size, chunk_size, middleware)
+        best = None
+        for _ in range(rounds):
+            result = await run_request(app)
+            if best is None or result[2] < best[2]:
+                best = result
+
+        received, first_byte, elapsed = best
+        print(
+            f"{name:<20} {received / elapsed / 1048576:10.1f}MB/s  TTFB {first_byte * 1000:6.2f}ms  total {elapsed:6.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=512, help="MB streamed per request")
+    parser.add_argument("--chunk", type=int, default=65536, help="bytes per chunk")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.size * 1048576, args.chunk, args.rounds))
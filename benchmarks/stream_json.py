@@ -0,0 +1,118 @@
+"""Checks that the streamed /stream JSON is byte-identical to the buffered one, then
+compares time to first byte and peak memory of both on synthetic results rendered
+by stream()'s renderer.
+
+    python -m benchmarks.stream_json --results 100,1000,5000
+"""
+
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+import orjson
+
+from benchmarks.hot_functions import b64, generate_torrents, ranked_files
+from comet.api.stream import render_cached_streams
+from comet.utils.general import config_check, get_balanced_hashes
+from comet.utils.response_cache import iter_streams_json
+from comet.utils.results import ResultSet
+
+warning = {
+    "name": "[⚠️] Comet",
+    "description": "Debrid Stream Proxy Password incorrect.\nStreams will not be proxied.",
+    "url": "https://comet.fast",
+}
+
+
+def render_streams(results: ResultSet, balanced_hashes: dict, config: dict):
+    return render_cached_streams(
+        results,
+        balanced_hashes,
+        config,
+        f"http://127.0.0.1:8000/{'e' * 200}/playback",
+        "TB",
+        "⚡",
+    )
+
+
+async def collect(streams, on_complete=None):
+    start_time = time.perf_counter()
+    first_byte = None
+    chunks = []
+    async for chunk in iter_streams_json(streams, on_complete):
+        if first_byte is None:
+            first_byte = time.perf_counter() - start_time
+        chunks.append(chunk)
+
+    return b"".join(chunks), first_byte, time.perf_counter() - start_time
+
+
+def check(streams: list):
+    buffered = orjson.dumps({"streams": streams})
+    completed = []
+    streamed, _, _ = asyncio.run(collect(iter(streams), completed.append))
+    assert streamed == buffered, f"streamed body differs for {len(streams)} streams"
+    assert completed == [buffered], "on_complete body differs"
+
+
+def measure(results: ResultSet, balanced_hashes: dict, config: dict, streamed: bool):
+    tracemalloc.start()
+    if streamed:
+        body, first_byte, total = asyncio.run(
+            collect(render_streams(results, balanced_hashes, config))
+        )
+    else:
+        start_time = time.perf_counter()
+        body = orjson.dumps(
+            {"streams": list(render_streams(results, balanced_hashes, config))}
+        )
+        first_byte = total = time.perf_counter() - start_time
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return body, first_byte, total, peak
+
+
+def main(args: argparse.Namespace):
+    config = config_check(b64({"debridService": "torbox", "debridApiKey": "bench"}))
+    for size in args.results:
+        _, torrents = generate_torrents(size, args.seed)
+        files = ranked_files(torrents, args.parse_limit)
+
+        def fresh_results():
+            # format_title inserts "multi" into the rows it renders, like the
+            # rows stream() loads from the database, every run gets its own
+            results = ResultSet.from_cached(orjson.loads(orjson.dumps(files)))
+            return results, get_balanced_hashes(results, config)
+
+        # every prefix length crosses the chunk boundary somewhere
+        streams = [warning, *render_streams(*fresh_results(), config)]
+        for length in sorted({0, 1, 2, len(streams) // 3, len(streams)}):
+            check(streams[:length])
+
+        buffered, buffered_ttfb, buffered_total, buffered_peak = measure(
+            *fresh_results(), config, False
+        )
+        streamed, streamed_ttfb, streamed_total, streamed_peak = measure(
+            *fresh_results(), config, True
+        )
+        assert streamed == buffered
+
+        print(
+            f"{len(streams) - 1:6d} streams {len(buffered) / 1024:8.0f}KB"
+            f"  buffered TTFB {buffered_ttfb * 1000:7.1f}ms total {buffered_total * 1000:7.1f}ms peak {buffered_peak / 1048576:6.1f}MB"
+            f"  streamed TTFB {streamed_ttfb * 1000:7.1f}ms total {streamed_total * 1000:7.1f}ms peak {streamed_peak / 1048576:6.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--results",
+        type=lambda sizes: [int(size) for size in sizes.split(",")],
+        default=[100, 1000, 5000],
+    )
+    parser.add_argument("--parse-limit", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
@@ -0,0 +1,257 @@
+"""End to end load test of /stream and /playback against fake upstreams, no network needed.
+Starts benchmarks.fake_upstreams and benchmarks.comet_server on a fresh SQLite database,
+then reports p50/p95/p99 latency and throughput for:
+
+    cold   first search of every media: metadata, scrapers, title filter, debrid availability
+    warm   the same requests again, answered from the cache
+    hot    and once more, answered from the rendered response cache
+    proxy  playback of the returned streams through the debrid stream proxy
+
+    python -m benchmarks.stream_load --requests 200 --concurrency 20 --debrid torbox --latency 0.05
+    python -m benchmarks.stream_load --type series --indexer-manager prowlarr --scrapers zilean,torrentio --error-rate 0.02
+"""
+
+import argparse
+import asyncio
+import base64
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import orjson
+
+from benchmarks.fake_upstreams import add_arguments
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values: list, percent: float):
+    if not values:
+        return float("nan")
+
+    values = sorted(values)
+    return values[max(math.ceil(len(values) * percent / 100) - 1, 0)]
+
+
+def report(phase: str, latencies: list, errors: int, elapsed: float, extra: str = ""):
+    print(
+        f"{phase:<6} {len(latencies):6d} ok {errors:4d} errors"
+        f"  p50 {percentile(latencies, 50) * 1000:8.1f}ms"
+        f"  p95 {percentile(latencies, 95) * 1000:8.1f}ms"
+        f"  p99 {percentile(latencies, 99) * 1000:8.1f}ms"
+        f"  {len(latencies) / elapsed:8.1f} req/s{extra}"
+    )
+
+
+async def run_phase(urls: list, concurrency: int, fetch):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    results = []
+
+    async def run(url: str):
+        nonlocal errors
+        async with semaphore:
+            start_time = time.perf_counter()
+            try:
+                results.append(await fetch(url))
+                latencies.append(time.perf_counter() - start_time)
+            except Exception as e:
+                errors += 1
+                if errors <= 3:
+                    print(f"  {url}: {e!r}")
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[run(url) for url in urls])
+    return latencies, errors, time.perf_counter() - start_time, results
+
+
+def media_ids(args: argparse.Namespace):
+    if args.type == "movie":
+        return [f"tt{9000000 + i:07d}" for i in range(args.requests)]
+
+    return [
+        f"tt{9000000 + i // 8:07d}:{1 + i // 4 % 2}:{1 + i % 4}"
+        for i in range(args.requests)
+    ]
+
+
+def start_servers(args: argparse.Namespace, data_directory: str):
+    fake_upstreams_url = f"http://127.0.0.1:{args.upstreams_port}"
+    upstreams = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.fake_upstreams",
+            "--port",
+            str(args.upstreams_port),
+            *args.upstream_arguments,
+        ],
+        cwd=repository,
+    )
+
+    scrapers = set(args.scrapers.split(",")) if args.scrapers else set()
+    environment = {
+        **os.environ,
+        "FAKE_UPSTREAMS_URL": fake_upstreams_url,
+        "DATABASE_TYPE": "sqlite",
+        "DATABASE_PATH": os.path.join(data_directory, "comet.db"),
+        "INDEXER_MANAGER_TYPE": args.indexer_manager,
+        "INDEXER_MANAGER_URL": f"{fake_upstreams_url}/{args.indexer_manager}",
+        "INDEXER_MANAGER_API_KEY": "bench",
+        "ZILEAN_URL": f"{fake_upstreams_url}/zilean" if "zilean" in scrapers else "",
+        "SCRAPE_TORRENTIO": str("torrentio" in scrapers),
+        "TORRENTIO_URL": f"{fake_upstreams_url}/torrentio",
+        "SCRAPE_MEDIAFUSION": str("mediafusion" in scrapers),
+        "MEDIAFUSION_URL": f"{fake_upstreams_url}/mediafusion",
+        "TITLE_MATCH_CHECK": str(not args.no_title_match),
+        "PROXY_DEBRID_STREAM": "True",
+        "PROXY_DEBRID_STREAM_PASSWORD": "bench",
+        "CACHE_WRITE_FLUSH_INTERVAL": "0.5",
+    }
+    comet = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.comet_server", "--port", str(args.port)],
+        cwd=repository,
+        env=environment,
+        stdout=None if args.verbose else subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+    return upstreams, comet
+
+
+async def wait_until_ready(session: aiohttp.ClientSession, url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+
+        await asyncio.sleep(0.2)
+
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+async def main(args: argparse.Namespace):
+    comet_url = f"http://127.0.0.1:{args.port}"
+    config = {
+        "indexers": ["bench1", "bench2"] if args.indexer_manager != "none" else [],
+        "debridService": args.debrid,
+        "debridApiKey": "bench",
+        "debridStreamProxyPassword": "bench",
+    }
+    b64config = base64.b64encode(orjson.dumps(config)).decode()
+    stream_type = "movie" if args.type == "movie" else "series"
+    stream_urls = [
+        f"{comet_url}/{b64config}/stream/{stream_type}/{media_id}.json"
+        for media_id in media_ids(args)
+    ]
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await wait_until_ready(session, f"http://127.0.0.1:{args.upstreams_port}/imdb/suggestion/a/tt0.json")
+        await wait_until_ready(session, f"{comet_url}/health")
+
+        async def fetch_streams(url: str):
+            async with session.get(url) as response:
+                response.raise_for_status()
+                return (await response.json())["streams"]
+
+        latencies, errors, elapsed, results = await run_phase(
+            stream_urls, args.concurrency, fetch_streams
+        )
+        streams = sum(len(result) for result in results)
+        report("cold", latencies, errors, elapsed, f"  {streams / max(len(results), 1):.1f} streams/response")
+
+        await asyncio.sleep(2)  # let the write-behind cache flush
+        latencies, errors, elapsed, results = await run_phase(
+            stream_urls, args.concurrency, fetch_streams
+        )
+        report("warm", latencies, errors, elapsed)
+
+        latencies, errors, elapsed, _ = await run_phase(
+            stream_urls, args.concurrency, fetch_streams
+        )
+        report("hot", latencies, errors, elapsed)
+
+        playback_urls = [
+            result[0]["url"]
+            for result in results
+            if result and "playback" in result[0].get("url", "")
+        ][: args.streams]
+        if not playback_urls:
+            print("proxy  no playable stream returned")
+            return
+
+        ttfbs = []
+        received = 0
+
+        async def fetch_playback(url: str):
+            nonlocal received
+            start_time = time.perf_counter()
+            async with session.get(url, headers={"Range": "bytes=0-"}) as response:
+                response.raise_for_status()
+                first_byte = None
+                async for chunk in response.content.iter_chunked(65536):
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - start_time
+                    received += len(chunk)
+
+            ttfbs.append(first_byte or 0)
+
+        latencies, errors, elapsed, _ = await run_phase(
+            playback_urls, args.concurrency, fetch_playback
+        )
+        report(
+            "proxy",
+            latencies,
+            errors,
+            elapsed,
+            f"  TTFB p50 {percentile(ttfbs, 50) * 1000:.1f}ms p99 {percentile(ttfbs, 99) * 1000:.1f}ms  {received / elapsed / 1048576:.1f}MB/s",
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100, help="distinct media searched")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--streams", type=int, default=20, help="streams played in the proxy phase")
+    parser.add_argument("--type", choices=["movie", "series"], default="movie")
+    parser.add_argument("--debrid", choices=["realdebrid", "alldebrid", "premiumize", "torbox", "debridlink"], default="torbox")
+    parser.add_argument("--indexer-manager", choices=["jackett", "prowlarr", "none"], default="jackett")
+    parser.add_argument("--scrapers", default="zilean", help="comma separated: zilean,torrentio,mediafusion")
+    parser.add_argument("--no-title-match", action="store_true")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--upstreams-port", type=int, default=18080)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--verbose", action="store_true", help="show Comet's logs")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    # everything fake_upstreams understands is passed through
+    args.upstream_arguments = [
+        f"--latency={args.latency}",
+        f"--error-rate={args.error_rate}",
+        f"--results={args.results}",
+        f"--cached-ratio={args.cached_ratio}",
+        f"--torrent-file-ratio={args.torrent_file_ratio}",
+        f"--file-size={args.file_size}",
+        f"--seed={args.seed}",
+        *(f"--latency-of={latency}" for latency in args.latency_of or []),
+    ]
+
+    with tempfile.TemporaryDirectory() as data_directory:
+        upstreams, comet = start_servers(args, data_directory)
+        try:
+            asyncio.run(main(args))
+        finally:
+            for process in (comet, upstreams):
+                process.terminate()
+                process.wait(10)
@@ -1,12 +1,15 @@
+import orjson
 import PTT
 import RTN
 
 from fastapi import APIRouter, Request
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 
 from comet.utils.models import settings
 from comet.utils.general import config_check, get_debrid_extension
+from comet.utils.metrics import registry
+from comet.utils.response_cache import cache_control, compute_etag, json_response
 
 templates = Jinja2Templates("comet/templates")
 main = APIRouter()
@@ -22,6 +25,13 @@ async def health():
     return {"status": "ok"}
 
 
+@main.get("/metrics", status_code=200)
+async def metrics():
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 indexers = settings.INDEXER_MANAGER_INDEXERS
 languages = [language for language in PTT.parse.LANGUAGES_TRANSLATION_TABLE.values()]
 languages.insert(0, "Unknown")
@@ -53,14 +63,14 @@ async def configure(request: Request):
 
 @main.get("/manifest.json")
 @main.get("/{b64config}/manifest.json")
-async def manifest(b64config: str = None):
+async def manifest(request: Request, b64config: str = None):
     config = config_check(b64config)
     if not config:
         config = {"debridService": None}
 
     debrid_extension = get_debrid_extension(config["debridService"])
 
-    return {
+    manifest = {
         "id": settings.ADDON_ID,
         "name": f"{settings.ADDON_NAME}{(' | ' + debrid_extension) if debrid_extension is not None else ''}",
         "description": "Stremio's fastest torrent/debrid search add-on.",
@@ -78,3 +88,11 @@ async def manifest(b64config: str = None):
         "background": "https://i.imgur.com/WwnXB3k.jpeg",
         "behaviorHints": {"configurable": True, "configurationRequired": False},
     }
+    body = orjson.dumps(manifest)
+
+    return json_response(
+        request,
+        body,
+        compute_etag(body),
+        cache_control(settings.MANIFEST_CACHE_MAX_AGE),
+    )
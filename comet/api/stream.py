@@ -1,4 +1,5 @@
 import asyncio
+import itertools
 import time
 import aiohttp
 import httpx
@@ -7,15 +8,17 @@ import orjson
 
 from fastapi import APIRouter, Request, BackgroundTasks
 from fastapi.responses import (
+    ORJSONResponse,
+    PlainTextResponse,
     RedirectResponse,
     StreamingResponse,
     FileResponse,
     Response,
 )
 from starlette.background import BackgroundTask
-from RTN import Torrent, sort_torrents
+from RTN import sort_torrents
 
-from comet.debrid.manager import getDebrid
+from comet.debrid.manager import debrid_services, getDebrid
 from comet.utils.general import (
     config_check,
     get_debrid_extension,
@@ -31,14 +34,145 @@ from comet.utils.general import (
     get_client_ip,
     get_aliases,
     add_torrent_to_cache,
+    get_cached_torrents,
+    get_season_packs,
+    cache_torrents,
+    get_nullable_filter,
+    wait_for_cached_torrents,
+    get_search_indexers,
+    get_search_id,
+    get_search_sources,
 )
+from comet.utils.cache_backend import shared_cache
+from comet.utils.db import get_pool_stats, read_database
 from comet.utils.logger import logger
+from comet.utils.metrics import (
+    cache_requests,
+    debrid_request_seconds,
+    proxy_bytes,
+    proxy_connections,
+)
 from comet.utils.models import database, rtn, settings, trackers
+from comet.utils.profiler import profile_event_loop, profile_lock
+from comet.utils.response_cache import (
+    compute_stream_etag,
+    etag_matches,
+    not_modified_response,
+    stream_cache_control,
+    stream_json_response,
+    stream_response_cache,
+    streaming_json_response,
+)
+from comet.utils.results import ResultSet
+from comet.utils.tracing import (
+    http_trace_configs,
+    slow_requests,
+    start_span,
+    start_stage,
+)
 
 streams = APIRouter()
 
 
-@streams.get("/stream/{type}/{id}.json")
+def is_streamed(balanced_hashes: dict):
+    # long result lists are sent as they are rendered instead of all at once
+    min_results = settings.STREAMING_RESPONSE_MIN_RESULTS
+    return min_results > 0 and (
+        sum(len(hashes) for hashes in balanced_hashes.values()) >= min_results
+    )
+
+
+def render_cached_streams(
+    results: ResultSet,
+    balanced_hashes: dict,
+    config: dict,
+    playback_url: str,
+    debrid_extension: str,
+    debrid_emoji: str,
+):
+    for resolution in balanced_hashes:
+        for i in balanced_hashes[resolution]:
+            hash = results.hashes[i]
+            data = results.data(i)
+            the_stream = {
+                "name": f"[{debrid_extension}{debrid_emoji}] Comet {data['resolution']}",
+                "description": format_title(data, config),
+                "torrentTitle": (
+                    data["torrent_title"] if "torrent_title" in data else None
+                ),
+                "torrentSize": (
+                    data["torrent_size"] if "torrent_size" in data else None
+                ),
+                "behaviorHints": {
+                    "filename": data["raw_title"],
+                    "bingeGroup": "comet|" + hash,
+                },
+            }
+
+            if config["debridApiKey"] != "":
+                the_stream["url"] = f"{playback_url}/{hash}/{data['index']}"
+            else:
+                the_stream["infoHash"] = hash
+                index = data["index"]
+                the_stream["fileIdx"] = (
+                    1 if "|" in index else int(index)
+                )  # 1 because for Premiumize it's impossible to get the file index
+                the_stream["sources"] = trackers
+
+            yield the_stream
+
+
+def render_ranked_streams(
+    results: ResultSet,
+    balanced_hashes: dict,
+    config: dict,
+    playback_url: str,
+    debrid_extension: str,
+):
+    for resolution in balanced_hashes:
+        for i in balanced_hashes[resolution]:
+            hash = results.hashes[i]
+            data = results.data(i)
+            yield {
+                "name": f"[{debrid_extension}⚡] Comet {data['resolution']}",
+                "description": format_title(data, config),
+                "torrentTitle": data["torrent_title"],
+                "torrentSize": data["torrent_size"],
+                "url": f"{playback_url}/{hash}/{data['index']}",
+                "behaviorHints": {
+                    "filename": data["raw_title"],
+                    "bingeGroup": "comet|" + hash,
+                },
+            }
+
+
+def stream_results_response(
+    request: Request,
+    results: list,
+    streams,
+    balanced_hashes: dict,
+    etag: str,
+    results_expires_at: float,
+    on_complete=None,
+):
+    # the same body and headers whether the streams are buffered or sent while
+    # being rendered, the etag is known first so a revalidation renders nothing
+    if etag_matches(request, etag):
+        return not_modified_response(etag, stream_cache_control(results_expires_at))
+
+    if is_streamed(balanced_hashes):
+        return streaming_json_response(
+            itertools.chain(results, streams), etag, results_expires_at, on_complete
+        )
+
+    response_body = orjson.dumps({"streams": [*results, *streams]})
+    if on_complete is not None:
+        on_complete(response_body)
+
+    return stream_json_response(request, response_body, etag, results_expires_at)
+
+
+@streams.get("/stream/{type}/{id}.json", response_class=ORJSONResponse)
 async def stream_noconfig(request: Request, type: str, id: str):
     return {
         "streams": [
@@ -51,7 +185,7 @@ async def stream_noconfig(request: Request, type: str, id: str):
     }
 
 
-@streams.get("/{b64config}/stream/{type}/{id}.json")
+@streams.get("/{b64config}/stream/{type}/{id}.json", response_class=ORJSONResponse)
 async def stream(
     request: Request,
     b64config: str,
@@ -71,21 +205,32 @@ async def stream(
             ]
         }
 
+    response_key = stream_response_cache.key(
+        b64config, f"{request.url.scheme}://{request.url.netloc}", type, id
+    )
+    response_version = await stream_response_cache.version(id)
+    cached_response = stream_response_cache.get(response_key, response_version)
+    if cached_response is not None:
+        return stream_json_response(request, *cached_response)
+
     connector = aiohttp.TCPConnector(limit=0)
     async with aiohttp.ClientSession(
-        connector=connector, raise_for_status=True
+        connector=connector, raise_for_status=True, trace_configs=http_trace_configs
     ) as session:
         full_id = id
+        media_id = id
         season = None
         episode = None
         if type == "series":
             info = id.split(":")
             id = info[0]
+            media_id = id
             season = int(info[1])
             episode = int(info[2])
 
         year = None
         year_end = None
+        stage = start_stage("metadata")
         try:
             kitsu = False
             if id == "kitsu":
@@ -95,6 +240,7 @@ async def stream(
                 )
                 metadata = await get_metadata.json()
                 name = metadata["data"]["attributes"]["canonicalTitle"]
+                media_id = f"kitsu:{season}"
                 season = 1
             else:
                 get_metadata = await session.get(
@@ -130,6 +276,8 @@ async def stream(
                 ]
             }
 
+        stage.end()
+
         name = translate(name)
         log_name = name
         if type == "series":
@@ -147,7 +295,7 @@ async def stream(
             config["debridApiKey"] = settings.PROXY_DEBRID_STREAM_DEBRID_DEFAULT_APIKEY
 
         if config["debridApiKey"] == "":
-            services = ["realdebrid", "alldebrid", "premiumize", "torbox", "debridlink"]
+            services = list(debrid_services)
             debrid_emoji = "⬇️"
         else:
             services = [config["debridService"]]
@@ -168,46 +316,43 @@ async def stream(
                 }
             )
 
-        indexers = config["indexers"].copy()
-        if settings.SCRAPE_TORRENTIO:
-            indexers.append("torrentio")
-        if settings.SCRAPE_MEDIAFUSION:
-            indexers.append("mediafusion")
-        if settings.ZILEAN_URL:
-            indexers.append("dmm")
+        indexers = get_search_indexers(config)
         indexers_json = orjson.dumps(indexers).decode("utf-8")
 
         all_sorted_ranked_files = {}
+        results_expires_at = float("inf")
         trackers_found = (
             set()
         )  # we want to check that we have a cache for each of the user's trackers
         the_time = time.time()
-        cache_ttl = settings.CACHE_TTL
+        season_filter, season_values = get_nullable_filter("season", season)
+        episode_filter, episode_values = get_nullable_filter("episode", episode)
 
+        stage = start_stage("cache_lookup")
         for debrid_service in services:
-            cached_results = await database.fetch_all(
+            cached_results = await read_database.fetch_all(
                 f"""
-                    SELECT info_hash, tracker, data
+                    SELECT info_hash, tracker, data, expires_at
                     FROM cache
                     WHERE debridService = :debrid_service
                     AND name = :name
-                    AND ((cast(:season as INTEGER) IS NULL AND season IS NULL) OR season = cast(:season as INTEGER))
-                    AND ((cast(:episode as INTEGER) IS NULL AND episode IS NULL) OR episode = cast(:episode as INTEGER))
+                    AND {season_filter}
+                    AND {episode_filter}
                     AND tracker IN (SELECT cast(value as TEXT) FROM {'json_array_elements_text' if settings.DATABASE_TYPE == 'postgresql' else 'json_each'}(:indexers))
-                    AND timestamp + :cache_ttl >= :current_time
+                    AND expires_at >= :current_time
                 """,
                 {
                     "debrid_service": debrid_service,
                     "name": name,
-                    "season": season,
-                    "episode": episode,
+                    **season_values,
+                    **episode_values,
                     "indexers": indexers_json,
-                    "cache_ttl": cache_ttl,
                     "current_time": the_time,
                 },
             )
             for result in cached_results:
                 trackers_found.add(result["tracker"].lower())
+                results_expires_at = min(results_expires_at, result["expires_at"])
 
                 hash = result["info_hash"]
                 if "searched" in hash:
@@ -217,49 +362,59 @@ async def stream(
                     result["data"]
                 )
 
+        stage.end()
+
         if len(all_sorted_ranked_files) != 0 and set(indexers).issubset(trackers_found):
+            cache_requests.inc(cache="results", result="hit")
+            stage = start_stage("response_build")
             debrid_extension = get_debrid_extension(
                 debrid_service, config["debridApiKey"]
             )
-            balanced_hashes = get_balanced_hashes(all_sorted_ranked_files, config)
-
-            for resolution in balanced_hashes:
-                for hash in balanced_hashes[resolution]:
-                    data = all_sorted_ranked_files[hash]["data"]
-                    the_stream = {
-                        "name": f"[{debrid_extension}{debrid_emoji}] Comet {data['resolution']}",
-                        "description": format_title(data, config),
-                        "torrentTitle": (
-                            data["torrent_title"] if "torrent_title" in data else None
-                        ),
-                        "torrentSize": (
-                            data["torrent_size"] if "torrent_size" in data else None
-                        ),
-                        "behaviorHints": {
-                            "filename": data["raw_title"],
-                            "bingeGroup": "comet|" + hash,
-                        },
-                    }
-
-                    if config["debridApiKey"] != "":
-                        the_stream["url"] = (
-                            f"{request.url.scheme}://{request.url.netloc}/{b64config}/playback/{hash}/{data['index']}"
-                        )
-                    else:
-                        the_stream["infoHash"] = hash
-                        index = data["index"]
-                        the_stream["fileIdx"] = (
-                            1 if "|" in index else int(index)
-                        )  # 1 because for Premiumize it's impossible to get the file index
-                        the_stream["sources"] = trackers
+            cached_results = ResultSet.from_cached(all_sorted_ranked_files)
+            balanced_hashes = get_balanced_hashes(cached_results, config)
+            etag = compute_stream_etag(
+                response_key,
+                results,
+                cached_results,
+                balanced_hashes,
+                debrid_extension,
+                debrid_emoji,
+                config["debridApiKey"] != "",
+            )
 
-                    results.append(the_stream)
+            def cache_response(response_body: bytes):
+                stream_response_cache.set(
+                    response_key,
+                    response_version,
+                    response_body,
+                    etag,
+                    results_expires_at,
+                )
 
             logger.info(
                 f"{len(all_sorted_ranked_files)} cached results found for {log_name}"
             )
+            response = stream_results_response(
+                request,
+                results,
+                render_cached_streams(
+                    cached_results,
+                    balanced_hashes,
+                    config,
+                    f"{request.url.scheme}://{request.url.netloc}/{b64config}/playback",
+                    debrid_extension,
+                    debrid_emoji,
+                ),
+                balanced_hashes,
+                etag,
+                results_expires_at,
+                cache_response,
+            )
+            stage.end()
+
+            return response
 
-            return {"streams": results}
+        cache_requests.inc(cache="results", result="miss")
 
         if config["debridApiKey"] == "":
             return {
@@ -275,7 +430,13 @@ async def stream(
 
         debrid = getDebrid(session, config, get_client_ip(request))
 
-        check_premium = await debrid.check_premium()
+        with start_span(
+            "debrid check_premium",
+            debrid_request_seconds,
+            service=debrid.name,
+            operation="check_premium",
+        ):
+            check_premium = await debrid.check_premium()
         if not check_premium:
             additional_info = ""
             if config["debridService"] == "alldebrid":
@@ -291,142 +452,201 @@ async def stream(
                 ]
             }
 
-        indexer_manager_type = settings.INDEXER_MANAGER_TYPE
-
-        search_indexer = len(config["indexers"]) != 0
-        torrents = []
-        tasks = []
-        if indexer_manager_type and search_indexer:
-            logger.info(
-                f"Start of {indexer_manager_type} search for {log_name} with indexers {config['indexers']}"
+        sources = get_search_sources(indexers)
+        search_id = get_search_id(full_id, indexers)
+        stage = start_stage("torrents_lookup")
+        torrents = await get_cached_torrents(
+            media_id, search_id, sources, season, episode
+        )
+        stage.end()
+        cache_requests.inc(
+            cache="torrents", result="miss" if torrents is None else "hit"
+        )
+        search_lease = None
+        if torrents is None:
+            # single-flight: concurrent requests for the same media and sources, on any node, scrape once.
+            # the lease is left to expire so waiters keep polling until the results are flushed
+            search_lease = await shared_cache.acquire_lease(
+                search_id, settings.SEARCH_LEASE_TTL
             )
-
-            search_terms = [name]
-            if type == "series":
-                search_terms = []
-                if not kitsu:
-                    search_terms.append(f"{name} S{season:02d}E{episode:02d}")
-                    search_terms.append(f"{name} s{season:02d}e{episode:02d}")
-                else:
-                    search_terms.append(f"{name} {episode}")
-            tasks.extend(
-                get_indexer_manager(
-                    session, indexer_manager_type, config["indexers"], term
+            if search_lease is None:
+                logger.info(f"Waiting for the ongoing search of {log_name}")
+                torrents = await wait_for_cached_torrents(
+                    media_id, search_id, sources, season, episode
                 )
-                for term in search_terms
-            )
+
+        if torrents is not None:
+            logger.info(f"{len(torrents)} cached torrents found for {log_name}")
         else:
-            logger.info(
-                f"No indexer {'manager ' if not indexer_manager_type else ''}{'selected by user' if indexer_manager_type else 'defined'} for {log_name}"
-            )
+            indexer_manager_type = settings.INDEXER_MANAGER_TYPE
+
+            search_indexer = len(config["indexers"]) != 0
+            torrents = []
+            tasks = []
+            if indexer_manager_type and search_indexer:
+                logger.info(
+                    f"Start of {indexer_manager_type} search for {log_name} with indexers {config['indexers']}"
+                )
+
+                search_terms = [name]
+                if type == "series":
+                    search_terms = []
+                    if not kitsu:
+                        search_terms.append(f"{name} S{season:02d}E{episode:02d}")
+                        search_terms.append(f"{name} s{season:02d}e{episode:02d}")
+                    else:
+                        search_terms.append(f"{name} {episode}")
+                tasks.extend(
+                    get_indexer_manager(
+                        session, indexer_manager_type, config["indexers"], term
+                    )
+                    for term in search_terms
+                )
+            else:
+                logger.info(
+                    f"No indexer {'manager ' if not indexer_manager_type else ''}{'selected by user' if indexer_manager_type else 'defined'} for {log_name}"
+                )
 
-        if settings.ZILEAN_URL:
-            tasks.append(get_zilean(session, name, log_name, season, episode))
+            if settings.ZILEAN_URL:
+                tasks.append(get_zilean(session, name, log_name, season, episode))
 
-        if settings.SCRAPE_TORRENTIO:
-            tasks.append(get_torrentio(log_name, type, full_id))
+            if settings.SCRAPE_TORRENTIO:
+                tasks.append(get_torrentio(log_name, type, full_id))
 
-        if settings.SCRAPE_MEDIAFUSION:
-            tasks.append(get_mediafusion(log_name, type, full_id))
+            if settings.SCRAPE_MEDIAFUSION:
+                tasks.append(get_mediafusion(log_name, type, full_id))
 
-        search_response = await asyncio.gather(*tasks)
-        for results in search_response:
-            for result in results:
-                torrents.append(result)
+            stage = start_stage("scrape")
+            search_response = await asyncio.gather(*tasks)
+            stage.end()
+            for results in search_response:
+                for result in results:
+                    torrents.append(result)
 
-        logger.info(
-            f"{len(torrents)} unique torrents found for {log_name}"
-            + (
-                " with "
-                + ", ".join(
-                    part
-                    for part in [
-                        indexer_manager_type,
-                        "Zilean" if settings.ZILEAN_URL else None,
-                        "Torrentio" if settings.SCRAPE_TORRENTIO else None,
-                        "MediaFusion" if settings.SCRAPE_MEDIAFUSION else None,
-                    ]
-                    if part
-                )
-                if any(
-                    [
-                        indexer_manager_type,
-                        settings.ZILEAN_URL,
-                        settings.SCRAPE_TORRENTIO,
-                        settings.SCRAPE_MEDIAFUSION,
-                    ]
+            logger.info(
+                f"{len(torrents)} unique torrents found for {log_name}"
+                + (
+                    " with "
+                    + ", ".join(
+                        part
+                        for part in [
+                            indexer_manager_type,
+                            "Zilean" if settings.ZILEAN_URL else None,
+                            "Torrentio" if settings.SCRAPE_TORRENTIO else None,
+                            "MediaFusion" if settings.SCRAPE_MEDIAFUSION else None,
+                        ]
+                        if part
+                    )
+                    if any(
+                        [
+                            indexer_manager_type,
+                            settings.ZILEAN_URL,
+                            settings.SCRAPE_TORRENTIO,
+                            settings.SCRAPE_MEDIAFUSION,
+                        ]
+                    )
+                    else ""
                 )
-                else ""
             )
-        )
 
-        if len(torrents) == 0:
-            return {"streams": []}
+            if len(torrents) == 0:
+                await shared_cache.release_lease(search_id, search_lease)
+                return {"streams": []}
 
-        if settings.TITLE_MATCH_CHECK:
-            aliases = await get_aliases(
-                session, "movies" if type == "movie" else "shows", id
-            )
+            if settings.TITLE_MATCH_CHECK:
+                stage = start_stage("title_filter")
+                aliases = await get_aliases(
+                    session, "movies" if type == "movie" else "shows", id
+                )
 
-            indexed_torrents = [(i, torrents[i]["Title"]) for i in range(len(torrents))]
-            chunk_size = 50
-            chunks = [
-                indexed_torrents[i : i + chunk_size]
-                for i in range(0, len(indexed_torrents), chunk_size)
-            ]
+                indexed_torrents = [(i, torrents[i]["Title"]) for i in range(len(torrents))]
+                chunk_size = 50
+                chunks = [
+                    indexed_torrents[i : i + chunk_size]
+                    for i in range(0, len(indexed_torrents), chunk_size)
+                ]
 
-            remove_adult_content = (
-                settings.REMOVE_ADULT_CONTENT and config["removeTrash"]
-            )
-            tasks = []
-            for chunk in chunks:
-                tasks.append(
-                    filter(chunk, name, year, year_end, aliases, remove_adult_content)
+                remove_adult_content = (
+                    settings.REMOVE_ADULT_CONTENT and config["removeTrash"]
                 )
+                tasks = []
+                for chunk in chunks:
+                    tasks.append(
+                        filter(chunk, name, year, year_end, aliases, remove_adult_content)
+                    )
 
-            filtered_torrents = await asyncio.gather(*tasks)
-            index_less = 0
-            for result in filtered_torrents:
-                for filtered in result:
-                    if not filtered[1]:
-                        del torrents[filtered[0] - index_less]
-                        index_less += 1
-                        continue
+                filtered_torrents = await asyncio.gather(*tasks)
+                index_less = 0
+                for result in filtered_torrents:
+                    for filtered in result:
+                        if not filtered[1]:
+                            del torrents[filtered[0] - index_less]
+                            index_less += 1
+                            continue
+
+                stage.end()
+                logger.info(
+                    f"{len(torrents)} torrents passed title match check for {log_name}"
+                )
 
-            logger.info(
-                f"{len(torrents)} torrents passed title match check for {log_name}"
-            )
+                if len(torrents) == 0:
+                    await shared_cache.release_lease(search_id, search_lease)
+                    return {"streams": []}
 
-            if len(torrents) == 0:
-                return {"streams": []}
+            stage = start_stage("hash_resolution")
+            tasks = []
+            for i in range(len(torrents)):
+                tasks.append(get_torrent_hash(session, (i, torrents[i])))
 
-        tasks = []
-        for i in range(len(torrents)):
-            tasks.append(get_torrent_hash(session, (i, torrents[i])))
+            torrent_hashes = await asyncio.gather(*tasks)
+            index_less = 0
+            for hash in torrent_hashes:
+                if not hash[1]:
+                    del torrents[hash[0] - index_less]
+                    index_less += 1
+                    continue
 
-        torrent_hashes = await asyncio.gather(*tasks)
-        index_less = 0
-        for hash in torrent_hashes:
-            if not hash[1]:
-                del torrents[hash[0] - index_less]
-                index_less += 1
-                continue
+                torrents[hash[0] - index_less]["InfoHash"] = hash[1]
 
-            torrents[hash[0] - index_less]["InfoHash"] = hash[1]
+            stage.end()
+            logger.info(f"{len(torrents)} info hashes found for {log_name}")
 
-        logger.info(f"{len(torrents)} info hashes found for {log_name}")
+            background_tasks.add_task(
+                cache_torrents,
+                media_id,
+                search_id,
+                sources,
+                season,
+                episode,
+                list(torrents),
+            )
+
+            if type == "series":
+                scraped_hashes = {torrent["InfoHash"] for torrent in torrents}
+                season_packs = [
+                    torrent
+                    for torrent in await get_season_packs(media_id, sources, season)
+                    if torrent["InfoHash"] not in scraped_hashes
+                ]
+                if len(season_packs) != 0:
+                    logger.info(
+                        f"{len(season_packs)} cached season packs added for {log_name}"
+                    )
+                    torrents.extend(season_packs)
 
         if len(torrents) == 0:
             return {"streams": []}
 
-        files = await debrid.get_files(
-            list({hash[1] for hash in torrent_hashes if hash[1] is not None}),
-            type,
-            season,
-            episode,
-            kitsu,
-        )
+        with start_stage("debrid_availability"):
+            files = await debrid.get_files(
+                list({torrent["InfoHash"] for torrent in torrents}),
+                type,
+                season,
+                episode,
+                kitsu,
+            )
 
+        stage = start_stage("ranking")
         ranked_files = set()
         torrents_by_hash = {torrent["InfoHash"]: torrent for torrent in torrents}
         for hash in files:
@@ -442,6 +662,7 @@ async def stream(
                 pass
 
         sorted_ranked_files = sort_torrents(ranked_files)
+        stage.end()
 
         len_sorted_ranked_files = len(sorted_ranked_files)
         logger.info(
@@ -462,34 +683,26 @@ async def stream(
 
             return {"streams": []}
 
-        sorted_ranked_files = {
-            key: (value.model_dump() if isinstance(value, Torrent) else value)
-            for key, value in sorted_ranked_files.items()
-        }
-        for hash in sorted_ranked_files:  # needed for caching
-            sorted_ranked_files[hash]["data"]["title"] = files[hash]["title"]
-            sorted_ranked_files[hash]["data"]["torrent_title"] = torrents_by_hash[hash][
-                "Title"
-            ]
-            sorted_ranked_files[hash]["data"]["tracker"] = torrents_by_hash[hash][
-                "Tracker"
-            ]
-            sorted_ranked_files[hash]["data"]["size"] = files[hash]["size"]
-            torrent_size = torrents_by_hash[hash]["Size"]
-            sorted_ranked_files[hash]["data"]["torrent_size"] = (
-                torrent_size if torrent_size else files[hash]["size"]
-            )
-            sorted_ranked_files[hash]["data"]["index"] = files[hash]["index"]
+        ranked_results = ResultSet.from_ranked(
+            sorted_ranked_files, files, torrents_by_hash
+        )
 
         background_tasks.add_task(
-            add_torrent_to_cache, config, name, season, episode, sorted_ranked_files
+            add_torrent_to_cache,
+            config,
+            name,
+            season,
+            episode,
+            ranked_results,
+            full_id,
         )
 
         logger.info(f"Results have been cached for {log_name}")
 
+        stage = start_stage("response_build")
         debrid_extension = get_debrid_extension(config["debridService"])
 
-        balanced_hashes = get_balanced_hashes(sorted_ranked_files, config)
+        balanced_hashes = get_balanced_hashes(ranked_results, config)
 
         results = []
         if (
@@ -506,24 +719,30 @@ async def stream(
                 }
             )
 
-        for resolution in balanced_hashes:
-            for hash in balanced_hashes[resolution]:
-                data = sorted_ranked_files[hash]["data"]
-                results.append(
-                    {
-                        "name": f"[{debrid_extension}⚡] Comet {data['resolution']}",
-                        "description": format_title(data, config),
-                        "torrentTitle": data["torrent_title"],
-                        "torrentSize": data["torrent_size"],
-                        "url": f"{request.url.scheme}://{request.url.netloc}/{b64config}/playback/{hash}/{data['index']}",
-                        "behaviorHints": {
-                            "filename": data["raw_title"],
-                            "bingeGroup": "comet|" + hash,
-                        },
-                    }
-                )
+        results_expires_at = time.time() + settings.CACHE_TTL
+        response = stream_results_response(
+            request,
+            results,
+            render_ranked_streams(
+                ranked_results,
+                balanced_hashes,
+                config,
+                f"{request.url.scheme}://{request.url.netloc}/{b64config}/playback",
+                debrid_extension,
+            ),
+            balanced_hashes,
+            compute_stream_etag(
+                response_key,
+                results,
+                ranked_results,
+                balanced_hashes,
+                debrid_extension,
+            ),
+            results_expires_at,
+        )
+        stage.end()
 
-        return {"streams": results}
+        return response
 
 
 @streams.head("/{b64config}/playback/{hash}/{index}")
@@ -549,9 +768,46 @@ async def active_connections(request: Request, password: str):
     return {
         "total_connections": len(active_connections),
         "active_connections": active_connections,
+        "database_pool": get_pool_stats(),
+        "read_replicas": read_database.stats(),
     }
 
 
+@streams.get("/slow-requests", response_class=CustomORJSONResponse)
+async def get_slow_requests(request: Request, password: str):
+    if password != settings.DASHBOARD_ADMIN_PASSWORD:
+        return "Invalid Password"
+
+    if not settings.TRACING_ENABLED:
+        return "Tracing is disabled, set TRACING_ENABLED=True"
+
+    # most recent first, each with its full span tree
+    return {
+        "threshold": settings.TRACING_SLOW_REQUEST_THRESHOLD,
+        "requests": list(reversed(slow_requests)),
+    }
+
+
+@streams.get("/profile")
+async def profile(
+    request: Request, password: str, seconds: float = 10, interval: float = 0.005
+):
+    if password != settings.DASHBOARD_ADMIN_PASSWORD:
+        return PlainTextResponse("Invalid Password")
+
+    if profile_lock.locked():
+        return PlainTextResponse("A profile is already running", status_code=409)
+
+    # only profiles the worker that received the request
+    async with profile_lock:
+        folded_stacks = await profile_event_loop(
+            min(max(seconds, 0.1), settings.PROFILER_MAX_DURATION),
+            max(interval, 0.001),
+        )
+
+    return PlainTextResponse(folded_stacks)
+
+
 @streams.get("/{b64config}/playback/{hash}/{index}")
 async def playback(request: Request, b64config: str, hash: str, index: str):
     config = config_check(b64config)
@@ -566,24 +822,34 @@ async def playback(request: Request, b64config: str, hash: str, index: str):
         config["debridService"] = settings.PROXY_DEBRID_STREAM_DEBRID_DEFAULT_SERVICE
         config["debridApiKey"] = settings.PROXY_DEBRID_STREAM_DEBRID_DEFAULT_APIKEY
 
-    async with aiohttp.ClientSession(raise_for_status=True) as session:
-        # Check for cached download link
-        cached_link = await database.fetch_one(
-            f"SELECT link, timestamp FROM download_links WHERE debrid_key = '{config['debridApiKey']}' AND hash = '{hash}' AND file_index = '{index}'"
-        )
-
-        current_time = time.time()
-        download_link = None
-        if cached_link:
-            link = cached_link["link"]
-            timestamp = cached_link["timestamp"]
-
-            if current_time - timestamp < 3600:
-                download_link = link
-            else:
-                # Cache expired, remove old entry
-                await database.execute(
-                    f"DELETE FROM download_links WHERE debrid_key = '{config['debridApiKey']}' AND hash = '{hash}' AND file_index = '{index}'"
+    async with aiohttp.ClientSession(
+        raise_for_status=True, trace_configs=http_trace_configs
+    ) as session:
+        # Check for cached download link, shared cache first then the database
+        current_time = int(time.time())
+        download_link_key = f"download-link:{config['debridApiKey']}:{hash}:{index}"
+        download_link = await shared_cache.get(download_link_key)
+        if download_link:
+            cache_requests.inc(cache="download_links", result="hit")
+        else:
+            cached_link = await read_database.fetch_one(
+                "SELECT link, expires_at FROM download_links WHERE debrid_key = :debrid_key AND hash = :hash AND file_index = :file_index AND expires_at >= :current_time",
+                {
+                    "debrid_key": config["debridApiKey"],
+                    "hash": hash,
+                    "file_index": index,
+                    "current_time": current_time,
+                },
+            )
+            cache_requests.inc(
+                cache="download_links", result="hit" if cached_link else "miss"
+            )
+            if cached_link:
+                download_link = cached_link["link"]
+                await shared_cache.set(
+                    download_link_key,
+                    download_link,
+                    max(cached_link["expires_at"] - current_time, 1),
                 )
 
         ip = get_client_ip(request)
@@ -600,37 +866,49 @@ async def playback(request: Request, b64config: str, hash: str, index: str):
                 )
                 else "",
             )
-            download_link = await debrid.generate_download_link(hash, index)
+            with start_span(
+                "debrid generate_download_link",
+                debrid_request_seconds,
+                service=debrid.name,
+                operation="generate_download_link",
+            ):
+                download_link = await debrid.generate_download_link(hash, index)
             if not download_link:
                 return FileResponse("comet/assets/uncached.mp4")
 
-            # Cache the new download link
+            # Cache the new download link, replacing an expired one
             await database.execute(
-                f"INSERT {'OR IGNORE ' if settings.DATABASE_TYPE == 'sqlite' else ''}INTO download_links (debrid_key, hash, file_index, link, timestamp) VALUES (:debrid_key, :hash, :file_index, :link, :timestamp){' ON CONFLICT DO NOTHING' if settings.DATABASE_TYPE == 'postgresql' else ''}",
+                "INSERT INTO download_links (debrid_key, hash, file_index, link, timestamp, expires_at) VALUES (:debrid_key, :hash, :file_index, :link, :timestamp, :expires_at) ON CONFLICT (debrid_key, hash, file_index) DO UPDATE SET link = excluded.link, timestamp = excluded.timestamp, expires_at = excluded.expires_at",
                 {
                     "debrid_key": config["debridApiKey"],
                     "hash": hash,
                     "file_index": index,
                     "link": download_link,
                     "timestamp": current_time,
+                    "expires_at": current_time + settings.DOWNLOAD_LINK_CACHE_TTL,
                 },
             )
+            await shared_cache.set(
+                download_link_key, download_link, settings.DOWNLOAD_LINK_CACHE_TTL
+            )
 
         if (
             settings.PROXY_DEBRID_STREAM
             and settings.PROXY_DEBRID_STREAM_PASSWORD
             == config["debridStreamProxyPassword"]
         ):
+            connections_key = f"connections:{ip}"
             if settings.PROXY_DEBRID_STREAM_MAX_CONNECTIONS != -1:
-                active_ip_connections = await database.fetch_all(
-                    "SELECT ip, COUNT(*) as connections FROM active_connections GROUP BY ip"
-                )
-                if any(
-                    connection["ip"] == ip
-                    and connection["connections"]
-                    >= settings.PROXY_DEBRID_STREAM_MAX_CONNECTIONS
-                    for connection in active_ip_connections
-                ):
+                if shared_cache.shared:
+                    active_ip_connections = int(
+                        await shared_cache.get(connections_key) or 0
+                    )
+                else:  # a per-process counter would allow the limit per worker
+                    active_ip_connections = await database.fetch_val(
+                        "SELECT COUNT(*) FROM active_connections WHERE ip = :ip",
+                        {"ip": ip},
+                    )
+                if active_ip_connections >= settings.PROXY_DEBRID_STREAM_MAX_CONNECTIONS:
                     return FileResponse("comet/assets/proxylimit.mp4")
 
             proxy = None
@@ -647,12 +925,15 @@ async def playback(request: Request, b64config: str, hash: str, index: str):
                         "GET", download_link, headers=headers
                     ) as self.response:
                         async for chunk in self.response.aiter_raw():
+                            proxy_bytes.inc(len(chunk))
                             yield chunk
 
                 async def close(self):
+                    proxy_connections.dec()
                     await database.execute(
                         f"DELETE FROM active_connections WHERE id = '{self.id}'"
                     )
+                    await shared_cache.incr(connections_key, -1, 86400)
 
                     if self.response is not None:
                         await self.response.aclose()
@@ -688,7 +969,10 @@ async def playback(request: Request, b64config: str, hash: str, index: str):
                         "timestamp": current_time,
                     },
                 )
+                # the counter expires if a node dies without closing its streams
+                await shared_cache.incr(connections_key, 1, 86400)
 
+                proxy_connections.inc()
                 streamer = Streamer(id)
 
                 return StreamingResponse(
@@ -1,21 +1,22 @@
 import aiohttp
 import asyncio
 
-from RTN import parse
-from comet.utils.general import is_video
+from comet.debrid.base import DebridService, register_debrid
 from comet.utils.logger import logger
+from comet.utils.metrics import debrid_errors
 from comet.utils.models import settings
 
 
-class AllDebrid:
-    def __init__(self, session: aiohttp.ClientSession, debrid_api_key: str):
-        session.headers["Authorization"] = f"Bearer {debrid_api_key}"
-        self.session = session
-        self.proxy = None
-        self.api_url = "https://api.alldebrid.com/v4"
-        self.agent = "comet"
-        self.max_retries = 3
-        self.retry_delay = 2
+@register_debrid
+class AllDebrid(DebridService):
+    name = "alldebrid"
+    display_name = "All-Debrid"
+    chunk_size = 12
+    max_concurrency = 1
+    api_url = "https://api.alldebrid.com/v4"
+    agent = "comet"
+    max_retries = 3
+    retry_delay = 2
 
     async def check_premium(self):
         try:
@@ -26,6 +27,7 @@ class AllDebrid:
             if '"isPremium":true' in check_premium:
                 return True
         except Exception as e:
+            debrid_errors.inc(service=self.name, operation="check_premium")
             logger.warning(
                 f"Exception while checking premium status on All-Debrid: {e}"
             )
@@ -144,83 +146,30 @@ class AllDebrid:
 
         return magnet_statuses
 
-    def _filter_files(self, links: list, type: str, season: str, episode: str, kitsu: bool) -> dict:
-        """Filtre les fichiers selon les critères demandés"""
-        for file in links:
-            try:
-                filename = file.get("filename")
-                if "e" in file:  # Cas des packs
-                    filename = file["e"][0]["filename"]
-                
-                if not filename or not is_video(filename) or "sample" in filename.lower():
-                    continue
-
-                if type == "series":
-                    parsed = parse(filename)
-                    if episode not in parsed.episodes:
-                        continue
-                        
-                    if kitsu and parsed.seasons:
-                        continue
-                    elif not kitsu and season not in parsed.seasons:
-                        continue
+    async def get_availability(self, chunk: list):
+        availability = {}
 
-                return {
-                    "index": links.index(file),
-                    "title": filename,
-                    "size": file["e"][0]["size"] if "e" in file else file["size"],
-                }
-                
-            except Exception as e:
-                logger.debug(f"Error filtering file {filename}: {str(e)}")
+        statuses = await self.add_and_get_status(chunk)
+        for magnet in statuses:
+            if not magnet or magnet["hash"] in availability:
                 continue
-                
-        return None
 
-    async def get_files(
-        self, torrent_hashes: list, type: str, season: str, episode: str, kitsu: bool
-    ):
-        files = {}
-        processed = set()  # Pour éviter les doublons
-        failed_hashes = []  # Pour tracer les échecs
-
-        chunk_size = 12
-        chunks = [
-            torrent_hashes[i : i + chunk_size]
-            for i in range(0, len(torrent_hashes), chunk_size)
-        ]
+            torrent_files = []
+            for index, file in enumerate(magnet["links"]):
+                if "e" in file:  # Cas des packs
+                    file = file["e"][0]
+
+                torrent_files.append(
+                    {
+                        "index": index,
+                        "title": file.get("filename"),
+                        "size": file["size"],
+                    }
+                )
 
-        for chunk in chunks:
-            try:
-                statuses = await self.add_and_get_status(chunk)
-                
-                for magnet in statuses:
-                    if not magnet or magnet["hash"] in processed:
-                        continue
-                        
-                    processed.add(magnet["hash"])
-                    
-                    valid_files = self._filter_files(
-                        magnet["links"], 
-                        type, 
-                        season, 
-                        episode, 
-                        kitsu
-                    )
-                    
-                    if valid_files:
-                        files[magnet["hash"]] = valid_files
-                    else:
-                        failed_hashes.append(magnet["hash"])
-                        
-            except Exception as e:
-                logger.error(f"Failed to process chunk: {str(e)}")
-                failed_hashes.extend(chunk)
+            availability[magnet["hash"]] = torrent_files
 
-        if failed_hashes:
-            logger.warning(f"Failed to process {len(failed_hashes)} hashes: {failed_hashes}")
-            
-        return files
+        return availability
 
     async def generate_download_link(self, hash: str, index: str):
         try:
@@ -273,6 +222,7 @@ class AllDebrid:
             return unlock_response["data"]["link"]
             
         except Exception as e:
+            debrid_errors.inc(service=self.name, operation="generate_download_link")
             logger.warning(
                 f"Exception while getting download link from All-Debrid for {hash}|{index}: {e}"
             )
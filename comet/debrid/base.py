@@ -0,0 +1,182 @@
+import asyncio
+import aiohttp
+
+from abc import ABC, abstractmethod
+from RTN import parse
+
+from comet.utils.general import (
+    is_video,
+    get_cached_availability,
+    cache_availability,
+)
+from comet.utils.logger import logger
+from comet.utils.metrics import debrid_errors, debrid_request_seconds
+from comet.utils.tracing import start_span
+
+debrid_services = {}
+
+
+def register_debrid(cls):
+    debrid_services[cls.name] = cls
+    return cls
+
+
+class DebridService(ABC):
+    name: str = None
+    display_name: str = None
+    uses_bearer_auth: bool = True
+    supports_bulk_check: bool = False  # many hashes can be checked with one API call
+    supports_file_index: bool = True  # returned files carry a usable index
+    chunk_size: int = 1
+    max_concurrency: int = None  # None = every chunk at once
+
+    def __init__(
+        self, session: aiohttp.ClientSession, debrid_api_key: str, ip: str = None
+    ):
+        if self.uses_bearer_auth:
+            session.headers["Authorization"] = f"Bearer {debrid_api_key}"
+        self.session = session
+        self.debrid_api_key = debrid_api_key
+        self.ip = ip
+        self.proxy = None
+
+    @abstractmethod
+    async def check_premium(self) -> bool: ...
+
+    @abstractmethod
+    async def get_availability(self, chunk: list) -> dict:
+        """Return {hash: [{"index", "title", "size"}, ...]} for every hash of the chunk
+        the service answered for, with an empty list when it is not cached."""
+
+    @abstractmethod
+    async def generate_download_link(self, hash: str, index: str): ...
+
+    async def check_availability(self, torrent_hashes: list):
+        chunks = [
+            torrent_hashes[i : i + self.chunk_size]
+            for i in range(0, len(torrent_hashes), self.chunk_size)
+        ]
+        semaphore = asyncio.Semaphore(self.max_concurrency or len(chunks) or 1)
+
+        async def check(chunk: list):
+            async with semaphore:
+                with start_span(
+                    "debrid availability",
+                    debrid_request_seconds,
+                    service=self.name,
+                    operation="availability",
+                ) as span:
+                    span.set(hashes=len(chunk))
+                    try:
+                        return await self.get_availability(chunk)
+                    except Exception as e:
+                        debrid_errors.inc(service=self.name, operation="availability")
+                        span.fail(e)
+                        logger.warning(
+                            f"Exception while checking availability of {len(chunk)} hashes on {self.display_name}: {e}"
+                        )
+
+        for task in asyncio.as_completed([check(chunk) for chunk in chunks]):
+            availability = await task
+            if not availability:
+                continue
+
+            for torrent_hash, torrent_files in availability.items():
+                yield torrent_hash, torrent_files
+
+    def is_valid_file(self, file: dict):
+        filename = file["title"]
+        return (
+            bool(filename) and is_video(filename) and "sample" not in filename.lower()
+        )
+
+    def format_file(self, file: dict, type: str, season: int, episode: int):
+        index = file["index"]
+        if not self.supports_file_index:
+            index = f"{season}|{episode}" if type == "series" else 0
+
+        return {"index": index, "title": file["title"], "size": file["size"]}
+
+    def map_episodes(self, files: list, kitsu: bool):
+        # parse every file of the torrent once: {(season, episode): (file, parsed)}
+        episodes = {}
+        for file in files:
+            if not self.is_valid_file(file):
+                continue
+
+            filename_parsed = parse(file["title"])
+            if kitsu:
+                if filename_parsed.seasons:
+                    continue
+                seasons = [None]
+            else:
+                seasons = filename_parsed.seasons
+
+            for season in seasons:
+                for episode in filename_parsed.episodes:
+                    if (season, episode) not in episodes:
+                        episodes[(season, episode)] = (file, filename_parsed)
+
+        return episodes
+
+    async def get_files(
+        self, torrent_hashes: list, type: str, season: int, episode: int, kitsu: bool
+    ):
+        files = {}
+
+        cached_availability = await get_cached_availability(
+            self.name, torrent_hashes, season, episode
+        )
+        for torrent_hash, file in cached_availability.items():
+            if file is not None:
+                files[torrent_hash] = file
+
+        unknown_hashes = [
+            torrent_hash
+            for torrent_hash in torrent_hashes
+            if torrent_hash not in cached_availability
+        ]
+        logger.info(
+            f"{len(cached_availability)} hashes availability known for {self.display_name}, checking {len(unknown_hashes)}"
+        )
+        if len(unknown_hashes) == 0:
+            return files
+
+        availability = []
+        async for torrent_hash, torrent_files in self.check_availability(
+            unknown_hashes
+        ):
+            if type != "series":
+                file = next(
+                    (file for file in torrent_files if self.is_valid_file(file)), None
+                )
+                if file is not None:
+                    file = self.format_file(file, type, season, episode)
+                    files[torrent_hash] = file
+
+                availability.append((torrent_hash, season, episode, file, None))
+                continue
+
+            episodes = self.map_episodes(torrent_files, kitsu)
+            requested = (None if kitsu else season, episode)
+            if requested not in episodes:
+                availability.append((torrent_hash, season, episode, None, None))
+            elif kitsu:  # kitsu files carry no season, only keep the requested one
+                episodes = {requested: episodes[requested]}
+
+            # season packs: store every episode mapping so later episodes are local lookups
+            for (file_season, file_episode), (file, parsed) in episodes.items():
+                if kitsu:
+                    file_season = season
+
+                file = self.format_file(file, type, file_season, file_episode)
+                if (file_season, file_episode) == (season, episode):
+                    files[torrent_hash] = file
+
+                availability.append(
+                    (torrent_hash, file_season, file_episode, file, parsed.model_dump())
+                )
+
+        await cache_availability(self.name, availability)
+
+        return files
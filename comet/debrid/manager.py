@@ -1,22 +1,14 @@
 import aiohttp
 
-from .realdebrid import RealDebrid
-from .alldebrid import AllDebrid
-from .premiumize import Premiumize
-from .torbox import TorBox
-from .debridlink import DebridLink
+from .base import debrid_services
+
+# importing the adapters registers them, in the order used for direct torrenting
+from . import realdebrid, alldebrid, premiumize, torbox, debridlink  # noqa: F401
 
 
 def getDebrid(session: aiohttp.ClientSession, config: dict, ip: str):
-    debrid_service = config["debridService"]
-    debrid_api_key = config["debridApiKey"]
-    if debrid_service == "realdebrid":
-        return RealDebrid(session, debrid_api_key, ip)
-    elif debrid_service == "alldebrid":
-        return AllDebrid(session, debrid_api_key)
-    elif debrid_service == "premiumize":
-        return Premiumize(session, debrid_api_key)
-    elif debrid_service == "torbox":
-        return TorBox(session, debrid_api_key)
-    elif debrid_service == "debridlink":
-        return DebridLink(session, debrid_api_key)
+    debrid = debrid_services.get(config["debridService"])
+    if debrid is None:
+        return None
+
+    return debrid(session, config["debridApiKey"], ip)
@@ -1,19 +1,20 @@
-import aiohttp
-import asyncio
-
 from RTN import parse
 
+from comet.debrid.base import DebridService, register_debrid
 from comet.utils.general import is_video
 from comet.utils.logger import logger
+from comet.utils.metrics import debrid_errors
 
 
-class Premiumize:
-    def __init__(self, session: aiohttp.ClientSession, debrid_api_key: str):
-        self.session = session
-        self.proxy = None
-
-        self.api_url = "https://premiumize.me/api"
-        self.debrid_api_key = debrid_api_key
+@register_debrid
+class Premiumize(DebridService):
+    name = "premiumize"
+    display_name = "Premiumize"
+    uses_bearer_auth = False
+    supports_bulk_check = True
+    supports_file_index = False  # cache/check only returns the main file name
+    chunk_size = 100
+    api_url = "https://premiumize.me/api"
 
     async def check_premium(self):
         try:
@@ -27,116 +28,37 @@ class Premiumize:
             ):
                 return True
         except Exception as e:
+            debrid_errors.inc(service=self.name, operation="check_premium")
             logger.warning(
                 f"Exception while checking premium status on Premiumize: {e}"
             )
 
         return False
 
-    async def get_instant(self, chunk: list):
-        try:
-            response = await self.session.get(
-                f"{self.api_url}/cache/check?apikey={self.debrid_api_key}&items[]={'&items[]='.join(chunk)}"
-            )
-
-            response = await response.json()
-            response["hashes"] = chunk
-
-            return response
-        except Exception as e:
-            logger.warning(
-                f"Exception while checking hash instant availability on Premiumize: {e}"
-            )
-
-    async def get_files(
-        self, torrent_hashes: list, type: str, season: str, episode: str, kitsu: bool
-    ):
-        chunk_size = 100
-        chunks = [
-            torrent_hashes[i : i + chunk_size]
-            for i in range(0, len(torrent_hashes), chunk_size)
-        ]
-
-        tasks = []
-        for chunk in chunks:
-            tasks.append(self.get_instant(chunk))
-
-        responses = await asyncio.gather(*tasks)
-
-        availability = []
-        for response in responses:
-            if not response:
+    async def get_availability(self, chunk: list):
+        response = await self.session.get(
+            f"{self.api_url}/cache/check?apikey={self.debrid_api_key}&items[]={'&items[]='.join(chunk)}"
+        )
+        result = await response.json()
+        if result["status"] != "success":
+            return None
+
+        availability = {}
+        for index, torrent_hash in enumerate(chunk):
+            filesize = result["filesize"][index]
+            if not result["response"][index] or not filesize:
+                availability[torrent_hash] = []
                 continue
 
-            availability.append(response)
-
-        files = {}
-
-        if type == "series":
-            for result in availability:
-                if result["status"] != "success":
-                    continue
-
-                responses = result["response"]
-                filenames = result["filename"]
-                filesizes = result["filesize"]
-                hashes = result["hashes"]
-                for index, response in enumerate(responses):
-                    if not response:
-                        continue
-
-                    if not filesizes[index]:
-                        continue
-
-                    filename = filenames[index]
-
-                    if "sample" in filename.lower():
-                        continue
-
-                    filename_parsed = parse(filename)
-                    if episode not in filename_parsed.episodes:
-                        continue
-
-                    if kitsu:
-                        if filename_parsed.seasons:
-                            continue
-                    else:
-                        if season not in filename_parsed.seasons:
-                            continue
-
-                    files[hashes[index]] = {
-                        "index": f"{season}|{episode}",
-                        "title": filename,
-                        "size": int(filesizes[index]),
-                    }
-        else:
-            for result in availability:
-                if result["status"] != "success":
-                    continue
-
-                responses = result["response"]
-                filenames = result["filename"]
-                filesizes = result["filesize"]
-                hashes = result["hashes"]
-                for index, response in enumerate(responses):
-                    if response is False:
-                        continue
-
-                    if not filesizes[index]:
-                        continue
-
-                    filename = filenames[index]
-
-                    if "sample" in filename.lower():
-                        continue
-
-                    files[hashes[index]] = {
-                        "index": 0,
-                        "title": filename,
-                        "size": int(filesizes[index]),
-                    }
+            availability[torrent_hash] = [
+                {
+                    "index": None,
+                    "title": result["filename"][index],
+                    "size": int(filesize),
+                }
+            ]
 
-        return files
+        return availability
 
     async def generate_download_link(self, hash: str, index: str):
         try:
@@ -172,6 +94,7 @@ class Premiumize:
             max_size_item = max(content, key=lambda x: x["size"])
             return max_size_item["link"]
         except Exception as e:
+            debrid_errors.inc(service=self.name, operation="generate_download_link")
             logger.warning(
                 f"Exception while getting download link from Premiumize for {hash}|{index}: {e}"
             )
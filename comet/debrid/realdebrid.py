@@ -1,21 +1,15 @@
-import aiohttp
-import asyncio
-
-from RTN import parse
-
-from comet.utils.general import is_video
+from comet.debrid.base import DebridService, register_debrid
 from comet.utils.logger import logger
+from comet.utils.metrics import debrid_errors
 from comet.utils.models import settings
 
 
-class RealDebrid:
-    def __init__(self, session: aiohttp.ClientSession, debrid_api_key: str, ip: str):
-        session.headers["Authorization"] = f"Bearer {debrid_api_key}"
-        self.session = session
-        self.ip = ip
-        self.proxy = None
-
-        self.api_url = "https://api.real-debrid.com/rest/1.0"
+@register_debrid
+class RealDebrid(DebridService):
+    name = "realdebrid"
+    display_name = "Real-Debrid"
+    max_concurrency = 1
+    api_url = "https://api.real-debrid.com/rest/1.0"
 
     async def check_premium(self):
         try:
@@ -24,73 +18,46 @@ class RealDebrid:
             if '"type": "premium"' in check_premium:
                 return True
         except Exception as e:
+            debrid_errors.inc(service=self.name, operation="check_premium")
             logger.warning(
                 f"Exception while checking premium status on Real-Debrid: {e}"
             )
 
         return False
 
-    async def get_files(
-        self, torrent_hashes: list, type: str, season: str, episode: str, kitsu: bool
-    ):
-        files = {}
-
-        for torrent_hash in torrent_hashes:
-            try:
-                # Add magnet link
-                add_magnet_response = await self.session.post(
-                    f"{self.api_url}/torrents/addMagnet",
-                    data={"magnet": f"magnet:?xt=urn:btih:{torrent_hash}", "ip": self.ip},
-                    proxy=self.proxy,
-                )
-                add_magnet = await add_magnet_response.json()
-
-                # Get torrent info
-                torrent_info_response = await self.session.get(
-                    f"{self.api_url}/torrents/info/{add_magnet['id']}", proxy=self.proxy
-                )
-                torrent_info = await torrent_info_response.json()
-
-                # Parse files
-                for file in torrent_info["files"]:
-                    filename = file["path"].lstrip("/")
-                    if not is_video(filename):
-                        continue
-
-                    if "sample" in filename.lower():
-                        continue
-
-                    filename_parsed = parse(filename)
-
-                    if type == "series":
-                        if episode not in filename_parsed.episodes:
-                            continue
-
-                        if kitsu:
-                            if filename_parsed.seasons:
-                                continue
-                        else:
-                            if season not in filename_parsed.seasons:
-                                continue
-
-                    files[torrent_hash] = {
-                        "index": file["id"],
-                        "title": filename,
-                        "size": file["bytes"],
-                    }
-                    break  # Stop after finding the first matching file
-
-                # Optional: Delete the added torrent to prevent clutter
-                await self.session.delete(
-                    f"{self.api_url}/torrents/delete/{add_magnet['id']}", proxy=self.proxy
-                )
-
-            except Exception as e:
-                logger.warning(
-                    f"Exception while processing torrent {torrent_hash}: {e}"
-                )
-
-        return files
+    async def get_availability(self, chunk: list):
+        availability = {}
+
+        for torrent_hash in chunk:
+            # Add magnet link
+            add_magnet_response = await self.session.post(
+                f"{self.api_url}/torrents/addMagnet",
+                data={"magnet": f"magnet:?xt=urn:btih:{torrent_hash}", "ip": self.ip},
+                proxy=self.proxy,
+            )
+            add_magnet = await add_magnet_response.json()
+
+            # Get torrent info
+            torrent_info_response = await self.session.get(
+                f"{self.api_url}/torrents/info/{add_magnet['id']}", proxy=self.proxy
+            )
+            torrent_info = await torrent_info_response.json()
+
+            availability[torrent_hash] = [
+                {
+                    "index": file["id"],
+                    "title": file["path"].lstrip("/"),
+                    "size": file["bytes"],
+                }
+                for file in torrent_info["files"]
+            ]
+
+            # Optional: Delete the added torrent to prevent clutter
+            await self.session.delete(
+                f"{self.api_url}/torrents/delete/{add_magnet['id']}", proxy=self.proxy
+            )
+
+        return availability
 
     async def generate_download_link(self, hash: str, index: str):
         try:
@@ -152,6 +119,7 @@ class RealDebrid:
 
             return unrestrict_link["download"]
         except Exception as e:
+            debrid_errors.inc(service=self.name, operation="generate_download_link")
             logger.warning(
                 f"Exception while getting download link from Real-Debrid for {hash}|{index}: {e}"
             )
@@ -1,20 +1,15 @@
-import aiohttp
-import asyncio
-
-from RTN import parse
-
-from comet.utils.general import is_video
+from comet.debrid.base import DebridService, register_debrid
 from comet.utils.logger import logger
+from comet.utils.metrics import debrid_errors
 
 
-class TorBox:
-    def __init__(self, session: aiohttp.ClientSession, debrid_api_key: str):
-        session.headers["Authorization"] = f"Bearer {debrid_api_key}"
-        self.session = session
-        self.proxy = None
-
-        self.api_url = "https://api.torbox.app/v1/api"
-        self.debrid_api_key = debrid_api_key
+@register_debrid
+class TorBox(DebridService):
+    name = "torbox"
+    display_name = "TorBox"
+    supports_bulk_check = True
+    chunk_size = 100
+    api_url = "https://api.torbox.app/v1/api"
 
     async def check_premium(self):
         try:
@@ -25,99 +20,31 @@ class TorBox:
             if '"success":true' in check_premium:
                 return True
         except Exception as e:
+            debrid_errors.inc(service=self.name, operation="check_premium")
             logger.warning(f"Exception while checking premium status on TorBox: {e}")
 
         return False
 
-    async def get_instant(self, chunk: list):
-        try:
-            response = await self.session.get(
-                f"{self.api_url}/torrents/checkcached?hash={','.join(chunk)}&format=list&list_files=true"
-            )
-            return await response.json()
-        except Exception as e:
-            logger.warning(
-                f"Exception while checking hash instant availability on TorBox: {e}"
-            )
-
-    async def get_files(
-        self, torrent_hashes: list, type: str, season: str, episode: str, kitsu: bool
-    ):
-        chunk_size = 100
-        chunks = [
-            torrent_hashes[i : i + chunk_size]
-            for i in range(0, len(torrent_hashes), chunk_size)
-        ]
-
-        tasks = []
-        for chunk in chunks:
-            tasks.append(self.get_instant(chunk))
-
-        responses = await asyncio.gather(*tasks)
-
-        availability = [response for response in responses if response is not None]
-
-        files = {}
-
-        if type == "series":
-            for result in availability:
-                if not result["success"] or not result["data"]:
-                    continue
-
-                for torrent in result["data"]:
-                    torrent_files = torrent["files"]
-                    for file in torrent_files:
-                        filename = file["name"].split("/")[1]
-
-                        if not is_video(filename):
-                            continue
-
-                        if "sample" in filename.lower():
-                            continue
-
-                        filename_parsed = parse(filename)
-                        if episode not in filename_parsed.episodes:
-                            continue
-
-                        if kitsu:
-                            if filename_parsed.seasons:
-                                continue
-                        else:
-                            if season not in filename_parsed.seasons:
-                                continue
-
-                        files[torrent["hash"]] = {
-                            "index": torrent_files.index(file),
-                            "title": filename,
-                            "size": file["size"],
-                        }
-
-                        break
-        else:
-            for result in availability:
-                if not result["success"] or not result["data"]:
-                    continue
-
-                for torrent in result["data"]:
-                    torrent_files = torrent["files"]
-                    for file in torrent_files:
-                        filename = file["name"].split("/")[1]
-
-                        if not is_video(filename):
-                            continue
-
-                        if "sample" in filename.lower():
-                            continue
-
-                        files[torrent["hash"]] = {
-                            "index": torrent_files.index(file),
-                            "title": filename,
-                            "size": file["size"],
-                        }
-
-                        break
-
-        return files
+    async def get_availability(self, chunk: list):
+        response = await self.session.get(
+            f"{self.api_url}/torrents/checkcached?hash={','.join(chunk)}&format=list&list_files=true"
+        )
+        result = await response.json()
+        if not result["success"]:
+            return None
+
+        availability = {torrent_hash: [] for torrent_hash in chunk}
+        for torrent in result["data"] or []:
+            availability[torrent["hash"]] = [
+                {
+                    "index": index,
+                    "title": file["name"].split("/")[-1],
+                    "size": file["size"],
+                }
+                for index, file in enumerate(torrent["files"])
+            ]
+
+        return availability
 
     async def generate_download_link(self, hash: str, index: str):
         try:
@@ -156,6 +83,7 @@ class TorBox:
 
             return get_download_link["data"]
         except Exception as e:
+            debrid_errors.inc(service=self.name, operation="generate_download_link")
             logger.warning(
                 f"Exception while getting download link from TorBox for {hash}|{index}: {e}"
             )
@@ -1,46 +1,51 @@
-import contextlib
-import signal
-import sys
-import threading
-import time
-import traceback
+import asyncio
+import os
 from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
 
 from comet.api.core import main
 from comet.api.stream import streams
-from comet.utils.db import setup_database, teardown_database
+from comet.utils.cache_backend import shared_cache
+from comet.utils.cache_writer import cache_writer
+from comet.utils.db import (
+    prepare_database,
+    read_database,
+    setup_database,
+    teardown_database,
+)
 from comet.utils.logger import logger
+from comet.utils.maintenance import maintenance_loop
+from comet.utils.middleware import LoguruMiddleware
+from comet.utils.migrations import run_backfills
 from comet.utils.models import settings
-
-
-class LoguruMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
-        try:
-            response = await call_next(request)
-        except Exception as e:
-            logger.exception(f"Exception during request processing: {e}")
-            raise
-        finally:
-            process_time = time.time() - start_time
-            logger.log(
-                "API",
-                f"{request.method} {request.url.path} - {response.status_code if 'response' in locals() else '500'} - {process_time:.2f}s",
-            )
-        return response
+from comet.utils.profiler import event_loop_monitor
+from comet.utils.tracing import trace_exporter
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await setup_database()
+    await setup_database(
+        initialize=os.environ.get("COMET_DATABASE_INITIALIZED") != "1"
+    )
+    await shared_cache.connect()
+    cache_writer.start()
+    trace_exporter.start()
+    event_loop_monitor.start()
+    backfills = asyncio.create_task(run_backfills())
+    maintenance = asyncio.create_task(maintenance_loop())
+    replica_checks = asyncio.create_task(read_database.health_loop())
     yield
+    replica_checks.cancel()
+    maintenance.cancel()
+    backfills.cancel()
+    await cache_writer.stop()
+    await trace_exporter.stop()
+    await event_loop_monitor.stop()
+    await shared_cache.close()
     await teardown_database()
 
 
@@ -68,53 +73,67 @@ app.include_router(main)
 app.include_router(streams)
 
 
-class Server(uvicorn.Server):
-    def install_signal_handlers(self):
-        pass
-
-    @contextlib.contextmanager
-    def run_in_thread(self):
-        thread = threading.Thread(target=self.run, name="Comet")
-        thread.start()
-        try:
-            while not self.started:
-                time.sleep(1e-3)
-            yield
-        except Exception as e:
-            logger.error(f"Error in server thread: {e}")
-            logger.exception(traceback.format_exc())
-            raise e
-        finally:
-            self.should_exit = True
-            sys.exit(0)
-
-
-def signal_handler(sig, frame):
-    # This will handle kubernetes/docker shutdowns better
-    # Toss anything that needs to be gracefully shutdown here
-    logger.log("COMET", "Exiting Gracefully.")
-    sys.exit(0)
-
-
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
-
-config = uvicorn.Config(
-    app,
-    host=settings.FASTAPI_HOST,
-    port=settings.FASTAPI_PORT,
-    proxy_headers=True,
-    forwarded_allow_ips="*",
-    workers=settings.FASTAPI_WORKERS,
-    log_config=None,
-)
-server = Server(config=config)
+def get_workers():
+    # FASTAPI_WORKERS <= 0 uses every core
+    if settings.FASTAPI_WORKERS < 1:
+        return os.cpu_count() or 1
+    return settings.FASTAPI_WORKERS
+
+
+def run_gunicorn(workers: int):
+    from gunicorn.app.base import BaseApplication  # POSIX only
+
+    class GunicornApplication(BaseApplication):
+        def __init__(self, options: dict):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    GunicornApplication(
+        {
+            "bind": f"{settings.FASTAPI_HOST}:{settings.FASTAPI_PORT}",
+            "workers": workers,
+            "worker_class": "uvicorn.workers.UvicornWorker",
+            "graceful_timeout": settings.GRACEFUL_SHUTDOWN_TIMEOUT,
+            "timeout": 120,
+            "forwarded_allow_ips": "*",
+            "accesslog": None,
+            "errorlog": "-",
+        }
+    ).run()
+
+
+def run_workers(workers: int):
+    # the master initializes the database once, workers only connect in lifespan
+    asyncio.run(prepare_database())
+    os.environ["COMET_DATABASE_INITIALIZED"] = "1"
+
+    if settings.USE_GUNICORN and os.name != "nt":
+        run_gunicorn(workers)
+        return
+
+    uvicorn.run(
+        "comet.main:app",
+        host=settings.FASTAPI_HOST,
+        port=settings.FASTAPI_PORT,
+        proxy_headers=True,
+        forwarded_allow_ips="*",
+        workers=workers,
+        timeout_graceful_shutdown=settings.GRACEFUL_SHUTDOWN_TIMEOUT,
+        log_config=None,
+    )
 
 
-def start_log():
+def start_log(workers: int):
     logger.log(
         "COMET",
-        f"Server started on http://{settings.FASTAPI_HOST}:{settings.FASTAPI_PORT} - {settings.FASTAPI_WORKERS} workers",
+        f"Server started on http://{settings.FASTAPI_HOST}:{settings.FASTAPI_PORT} - {workers} workers",
     )
     logger.log(
         "COMET",
@@ -161,15 +180,22 @@ def start_log():
     logger.log("COMET", f"Custom Header HTML: {bool(settings.CUSTOM_HEADER_HTML)}")
 
 
-with server.run_in_thread():
-    start_log()
-    try:
-        while True:
-            time.sleep(1)  # Keep the main thread alive
-    except KeyboardInterrupt:
-        logger.log("COMET", "Server stopped by user")
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        logger.exception(traceback.format_exc())
-    finally:
-        logger.log("COMET", "Server Shutdown")
+if __name__ == "__main__":
+    workers = get_workers()
+    start_log(workers)
+
+    if workers > 1:
+        run_workers(workers)
+    else:
+        # uvicorn handles SIGINT/SIGTERM and runs the lifespan shutdown
+        uvicorn.run(
+            app,
+            host=settings.FASTAPI_HOST,
+            port=settings.FASTAPI_PORT,
+            proxy_headers=True,
+            forwarded_allow_ips="*",
+            timeout_graceful_shutdown=settings.GRACEFUL_SHUTDOWN_TIMEOUT,
+            log_config=None,
+        )
+
+    logger.log("COMET", "Server Shutdown")
@@ -0,0 +1,167 @@
+import time
+import uuid
+import redis.asyncio as redis
+
+from abc import ABC, abstractmethod
+
+from comet.utils.logger import logger
+from comet.utils.models import settings
+
+
+class CacheBackend(ABC):
+    # hot cross-request state shared by every node, the SQL database stays the durable store
+    shared: bool = True  # seen by every worker and node, required to enforce limits
+
+    async def connect(self): ...
+
+    async def close(self): ...
+
+    @abstractmethod
+    async def get(self, key: str) -> str: ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: int = None): ...
+
+    @abstractmethod
+    async def delete(self, key: str): ...
+
+    @abstractmethod
+    async def incr(self, key: str, amount: int = 1, ttl: int = None) -> int: ...
+
+    @abstractmethod
+    async def set_if_absent(self, key: str, value: str, ttl: int) -> bool: ...
+
+    @abstractmethod
+    async def delete_if_equal(self, key: str, value: str): ...
+
+    async def acquire_lease(self, key: str, ttl: int):
+        # single-flight: only the holder of the lease does the work, returns its token
+        token = uuid.uuid4().hex
+        if await self.set_if_absent(f"lease:{key}", token, ttl):
+            return token
+
+    async def release_lease(self, key: str, token: str):
+        if token is not None:
+            await self.delete_if_equal(f"lease:{key}", token)
+
+    async def is_leased(self, key: str):
+        return await self.get(f"lease:{key}") is not None
+
+
+class MemoryCacheBackend(CacheBackend):
+    # single process only, every worker/node gets its own state
+    shared = False
+    def __init__(self):
+        self.entries = {}  # key -> (value, expires_at or None)
+        self.writes = 0
+
+    def prune(self):
+        current_time = time.time()
+        for key in [
+            key
+            for key, (_, expires_at) in self.entries.items()
+            if expires_at is not None and expires_at <= current_time
+        ]:
+            del self.entries[key]
+
+    def store(self, key: str, value: str, ttl: int):
+        self.entries[key] = (value, time.time() + ttl if ttl else None)
+        self.writes += 1
+        if self.writes % 1000 == 0:
+            self.prune()
+
+    async def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self.entries[key]
+            return None
+
+        return value
+
+    async def set(self, key: str, value: str, ttl: int = None):
+        self.store(key, value, ttl)
+
+    async def delete(self, key: str):
+        self.entries.pop(key, None)
+
+    async def incr(self, key: str, amount: int = 1, ttl: int = None):
+        value = int(await self.get(key) or 0) + amount
+        self.store(key, str(value), ttl)
+        return value
+
+    async def set_if_absent(self, key: str, value: str, ttl: int):
+        if await self.get(key) is not None:
+            return False
+
+        self.store(key, value, ttl)
+        return True
+
+    async def delete_if_equal(self, key: str, value: str):
+        if await self.get(key) == value:
+            del self.entries[key]
+
+
+class RedisCacheBackend(CacheBackend):
+    # anything speaking the Redis protocol: Redis, Valkey, KeyDB, Dragonfly...
+    delete_if_equal_script = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client = None
+
+    async def connect(self):
+        self.client = redis.from_url(self.url, decode_responses=True)
+        await self.client.ping()
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def get(self, key: str):
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: str, ttl: int = None):
+        await self.client.set(key, value, ex=ttl)
+
+    async def delete(self, key: str):
+        await self.client.delete(key)
+
+    async def incr(self, key: str, amount: int = 1, ttl: int = None):
+        async with self.client.pipeline(transaction=True) as pipeline:
+            pipeline.incrby(key, amount)
+            if ttl:
+                pipeline.expire(key, ttl)
+            value, *_ = await pipeline.execute()
+
+        return value
+
+    async def set_if_absent(self, key: str, value: str, ttl: int):
+        return bool(await self.client.set(key, value, ex=ttl, nx=True))
+
+    async def delete_if_equal(self, key: str, value: str):
+        await self.client.eval(self.delete_if_equal_script, 1, key, value)
+
+
+def create_cache_backend():
+    if settings.CACHE_BACKEND == "redis":
+        return RedisCacheBackend(settings.REDIS_URL)
+
+    if settings.CACHE_BACKEND != "memory":
+        logger.warning(
+            f"Unknown CACHE_BACKEND '{settings.CACHE_BACKEND}', using memory"
+        )
+
+    return MemoryCacheBackend()
+
+
+shared_cache = create_cache_backend()
@@ -0,0 +1,184 @@
+import asyncio
+import time
+
+from comet.utils.logger import logger
+from comet.utils.metrics import Gauge
+from comet.utils.models import database, settings
+
+
+class CacheWriter:
+    def __init__(self, max_size: int, batch_size: int, flush_interval: float):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.pending = {}  # query -> list of values, flushed in insertion order
+        self.copy_plans = {}  # query -> (table, columns, on_conflict, key_columns)
+        self.callbacks = []  # (callback, args) awaited once the queued writes are flushed
+        self.queue_depth = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.last_flush_latency = 0.0
+        self.last_flush_size = 0
+
+        self.task = None
+        self.stopping = False
+        self.wake_up = None
+        self.flush_lock = None
+
+    def enqueue(self, query: str, values: list):
+        if len(values) == 0:
+            return
+
+        if self.queue_depth + len(values) > self.max_size:
+            self.dropped += len(values)
+            logger.warning(
+                f"Cache write queue full ({self.queue_depth}/{self.max_size}), dropping {len(values)} rows"
+            )
+            return
+
+        self.pending.setdefault(query, []).extend(values)
+        self.queue_depth += len(values)
+
+        if self.wake_up is not None and self.queue_depth >= self.batch_size:
+            self.wake_up.set()
+
+    def enqueue_upsert(
+        self,
+        table: str,
+        columns: tuple,
+        values: list,
+        on_conflict: str = "ON CONFLICT DO NOTHING",
+        key_columns: tuple = None,
+    ):
+        query = f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            VALUES ({', '.join(f':{column}' for column in columns)})
+            {on_conflict}
+        """
+        self.copy_plans[query] = (table, columns, on_conflict, key_columns)
+        self.enqueue(query, values)
+
+    def after_flush(self, callback, *args):
+        # for work that must only see the rows queued so far once they are readable
+        self.callbacks.append((callback, args))
+
+    async def copy_upsert(
+        self, table: str, columns: tuple, on_conflict: str, key_columns: tuple, values: list
+    ):
+        if key_columns:
+            # one INSERT ... SELECT can't update the same row twice, keep the last write
+            values = list(
+                {tuple(row[column] for column in key_columns): row for row in values}.values()
+            )
+
+        records = [tuple(row[column] for column in columns) for row in values]
+        copy_columns = [column.lower() for column in columns]  # unquoted names are folded
+        column_list = ", ".join(copy_columns)
+        async with database.connection() as connection:
+            raw_connection = connection.raw_connection
+            async with raw_connection.transaction():
+                await raw_connection.execute(
+                    f"CREATE TEMP TABLE {table}_copy (LIKE {table}) ON COMMIT DROP"
+                )
+                await raw_connection.copy_records_to_table(
+                    f"{table}_copy", records=records, columns=copy_columns
+                )
+                await raw_connection.execute(
+                    f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {table}_copy {on_conflict}"
+                )
+
+    async def flush(self):
+        async with self.flush_lock:
+            callbacks = self.callbacks
+            self.callbacks = []
+            if self.queue_depth == 0:
+                await self.run_callbacks(callbacks)
+                return
+
+            pending = self.pending
+            size = self.queue_depth
+            self.pending = {}
+            self.queue_depth = 0
+
+            start_time = time.perf_counter()
+            for query, values in pending.items():
+                try:
+                    copy_plan = self.copy_plans.get(query)
+                    if (
+                        copy_plan is not None
+                        and settings.DATABASE_TYPE == "postgresql"
+                        and len(values) >= settings.DATABASE_COPY_MIN_ROWS
+                    ):
+                        await self.copy_upsert(*copy_plan, values)
+                        continue
+
+                    async with database.transaction():
+                        await database.execute_many(query, values)
+                except Exception as e:
+                    logger.warning(
+                        f"Exception while flushing {len(values)} cache writes: {e}"
+                    )
+
+            self.flushes += 1
+            self.last_flush_size = size
+            self.last_flush_latency = time.perf_counter() - start_time
+            logger.debug(
+                f"Flushed {size} cache writes in {self.last_flush_latency:.3f}s"
+            )
+
+            await self.run_callbacks(callbacks)
+
+    async def run_callbacks(self, callbacks: list):
+        for callback, args in callbacks:
+            try:
+                await callback(*args)
+            except Exception as e:
+                logger.warning(f"Exception in cache writer flush callback: {e}")
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wake_up.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self.wake_up.clear()
+            await self.flush()
+
+    def start(self):
+        self.stopping = False
+        self.wake_up = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+
+        self.stopping = True
+        self.wake_up.set()
+        await self.task
+        self.task = None
+
+        await self.flush()
+
+
+cache_writer = CacheWriter(
+    settings.CACHE_WRITE_QUEUE_MAX_SIZE,
+    settings.CACHE_WRITE_BATCH_SIZE,
+    settings.CACHE_WRITE_FLUSH_INTERVAL,
+)
+
+Gauge(
+    "comet_cache_writer",
+    "Write-behind cache writer queue and flush statistics",
+    ("stat",),
+    collect=lambda: {
+        ("queue_depth",): cache_writer.queue_depth,
+        ("dropped_rows",): cache_writer.dropped,
+        ("flushes",): cache_writer.flushes,
+        ("last_flush_seconds",): cache_writer.last_flush_latency,
+        ("last_flush_rows",): cache_writer.last_flush_size,
+    },
+)
@@ -1,16 +1,14 @@
 import os
-import time
 import traceback
 import asyncio
 import re
 from urllib.parse import urlparse, urlunparse
 from databases import Database
-import asyncpg
 
 from comet.utils.logger import logger
-from comet.utils.models import database, settings
-
-DATABASE_VERSION = "1.0"
+from comet.utils.metrics import Gauge
+from comet.utils.migrations import run_migrations
+from comet.utils.models import database, read_replicas, settings
 
 
 def get_db_url_display(url: str) -> str:
@@ -32,7 +30,125 @@ def get_db_url_display(url: str) -> str:
         return "Could not parse DATABASE_URL for display" # Fallback
 
 
-async def setup_database():
+class ReadDatabase:
+    # read-only queries go round-robin to healthy replicas, the primary is the fallback
+    def __init__(self, replicas: list):
+        self.replicas = replicas
+        self.healthy = []
+        self.lag = {}
+        self.next_replica = 0
+
+    def pick(self):
+        if len(self.healthy) == 0:
+            return database
+
+        replica = self.healthy[self.next_replica % len(self.healthy)]
+        self.next_replica += 1
+        return replica
+
+    async def run(self, method: str, query: str, values: dict = None):
+        replica = self.pick()
+        if replica is not database:
+            try:
+                return await getattr(replica, method)(query, values)
+            except Exception as e:
+                logger.warning(
+                    f"Read replica {get_db_url_display(str(replica.url))} failed, using primary: {e}"
+                )
+                if replica in self.healthy:
+                    self.healthy.remove(replica)
+
+        return await getattr(database, method)(query, values)
+
+    async def fetch_all(self, query: str, values: dict = None):
+        return await self.run("fetch_all", query, values)
+
+    async def fetch_one(self, query: str, values: dict = None):
+        return await self.run("fetch_one", query, values)
+
+    async def fetch_val(self, query: str, values: dict = None):
+        return await self.run("fetch_val", query, values)
+
+    async def check_replicas(self):
+        healthy = []
+        for replica in self.replicas:
+            url = get_db_url_display(str(replica.url))
+            try:
+                if not replica.is_connected:
+                    await replica.connect()
+
+                # no lag while the replica has replayed everything it received
+                lag = await replica.fetch_val(
+                    """
+                        SELECT CASE
+                            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                        END
+                    """
+                )
+                lag = float(lag) if lag is not None else 0.0
+                self.lag[url] = lag
+                if lag <= settings.DATABASE_REPLICA_MAX_LAG:
+                    healthy.append(replica)
+                else:
+                    logger.warning(f"Read replica {url} is {lag:.1f}s behind, skipping it")
+            except Exception as e:
+                self.lag.pop(url, None)
+                logger.warning(f"Read replica {url} unavailable: {e}")
+
+        self.healthy = healthy
+
+    async def health_loop(self):
+        while True:
+            await asyncio.sleep(settings.DATABASE_REPLICA_CHECK_INTERVAL)
+            await self.check_replicas()
+
+    async def disconnect(self):
+        for replica in self.replicas:
+            if replica.is_connected:
+                await replica.disconnect()
+
+    def stats(self):
+        stats = []
+        for replica in self.replicas:
+            url = get_db_url_display(str(replica.url))
+            stats.append(
+                {
+                    "url": url,
+                    "healthy": replica in self.healthy,
+                    "lag": self.lag.get(url),
+                }
+            )
+
+        return stats
+
+
+read_database = ReadDatabase(read_replicas)
+
+Gauge(
+    "comet_database_replica_lag_seconds",
+    "Replication lag of each read replica",
+    ("replica",),
+    collect=lambda: {
+        (replica["url"],): replica["lag"]
+        for replica in read_database.stats()
+        if replica["lag"] is not None
+    },
+)
+
+
+async def initialize_database():
+    # one-time and destructive, runs once per start and never in each worker
+    await run_migrations()
+
+    await database.execute("DELETE FROM ongoing_searches")
+
+    await database.execute("DELETE FROM download_links_cache")
+
+    await database.execute("DELETE FROM active_connections")
+
+
+async def setup_database(initialize: bool = True):
     # Gardons le try...except pour la création de fichiers/tables, mais pas pour connect()
     try:
         if settings.DATABASE_TYPE == "sqlite":
@@ -53,335 +169,56 @@ async def setup_database():
         db_url_for_log = get_db_url_display(settings.DATABASE_URL)
         logger.info(f"Attempting to connect to database: {db_url_for_log}") # Log l'URL utilisée (masquée si nécessaire)
 
-        # --- TEST DIRECT avec asyncpg ---
-        direct_conn_success = False
-        try:
-            logger.info("Attempting direct connection with asyncpg...")
-            conn = await asyncpg.connect(str(settings.DATABASE_URL))
-            logger.info("Direct asyncpg connection SUCCESSFUL!")
-            await conn.close()
-            logger.info("Direct asyncpg connection closed.")
-            direct_conn_success = True
-        except Exception as asyncpg_e:
-            logger.error(f"Direct asyncpg connection FAILED: {asyncpg_e}")
-            logger.error(traceback.format_exc()) # Log la stack trace complète de l'erreur asyncpg
-        # --- FIN TEST DIRECT ---
-
-        # On continue avec la connexion via 'databases' pour voir si l'erreur persiste
-        # même si la connexion directe a échoué (pour obtenir le même log qu'avant)
-        logger.debug(f"Database object URL before connect (via databases lib): {str(database.url)}")
+        logger.debug(f"Database object URL before connect: {str(database.url)}")
         await database.connect()
-        logger.info("Database connection successful via 'databases' library.")
+        logger.info("Database connection successful.")
 
-        await database.execute(
-            """
-                CREATE TABLE IF NOT EXISTS db_version (
-                    id INTEGER PRIMARY KEY CHECK (id = 1),
-                    version TEXT
-                )
-            """
-        )
-
-        current_version = await database.fetch_val(
-            """
-                SELECT version FROM db_version WHERE id = 1
-            """
-        )
-
-        if current_version != DATABASE_VERSION:
-            logger.log(
-                "COMET",
-                f"Database: Migration from {current_version} to {DATABASE_VERSION} version",
+        if initialize:
+            await initialize_database()
+
+        if len(read_replicas) != 0:
+            await read_database.check_replicas()
+            logger.info(
+                f"{len(read_database.healthy)}/{len(read_replicas)} read replicas available"
             )
 
-            if settings.DATABASE_TYPE == "sqlite":
-                tables = await database.fetch_all(
-                    """
-                    SELECT name FROM sqlite_master 
-                    WHERE type='table' AND name != 'db_version' AND name != 'sqlite_sequence'
-                    """
-                )
+    except Exception as e:
+        logger.error(f"CRITICAL: Failed to connect to or setup the database: {e}")
+        logger.exception(traceback.format_exc()) # Log la trace complète
+        raise # Relance l'exception pour arrêter le démarrage de FastAPI
 
-                for table in tables:
-                    await database.execute(f"DROP TABLE IF EXISTS {table['name']}")
-            else:
-                await database.execute(
-                    """
-                    DO $$ DECLARE
-                        r RECORD;
-                    BEGIN
-                        FOR r IN (SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename != 'db_version') LOOP
-                            EXECUTE 'DROP TABLE IF EXISTS ' || quote_ident(r.tablename) || ' CASCADE';
-                        END LOOP;
-                    END $$;
-                    """
-                )
 
-            await database.execute(
-                """
-                    INSERT INTO db_version VALUES (1, :version)
-                    ON CONFLICT (id) DO UPDATE SET version = :version
-                """,
-                {"version": DATABASE_VERSION},
-            )
+async def prepare_database():
+    # used by the multi-worker launcher before the workers are started
+    await setup_database()
+    await teardown_database()
 
-            logger.log(
-                "COMET", f"Database: Migration to version {DATABASE_VERSION} completed"
-            )
 
-        try:
-            await database.execute(
-                """
-                    CREATE TABLE IF NOT EXISTS ongoing_searches (
-                        media_id TEXT PRIMARY KEY, 
-                        timestamp INTEGER
-                    )
-                """
-            )
-        except asyncpg.exceptions.UniqueViolationError:
-            logger.warning("Table 'ongoing_searches' or related type already exists, ignoring.")
-        except Exception as e:
-            logger.error(f"Unexpected error creating ongoing_searches table: {e}")
-            raise # Relance les erreurs inattendues
-
-        await database.execute(
-            """
-                CREATE TABLE IF NOT EXISTS first_searches (
-                    media_id TEXT PRIMARY KEY, 
-                    timestamp INTEGER
-                )
-            """
-        )
-
-        await database.execute(
-            """
-                CREATE TABLE IF NOT EXISTS metadata_cache (
-                    media_id TEXT PRIMARY KEY, 
-                    title TEXT, 
-                    year INTEGER, 
-                    year_end INTEGER, 
-                    aliases TEXT, 
-                    timestamp INTEGER
-                )
-            """
-        )
-
-        await database.execute(
-            """
-                CREATE TABLE IF NOT EXISTS torrents (
-                    media_id TEXT,
-                    info_hash TEXT,
-                    file_index INTEGER,
-                    season INTEGER,
-                    episode INTEGER,
-                    title TEXT,
-                    seeders INTEGER,
-                    size BIGINT,
-                    tracker TEXT,
-                    sources TEXT,
-                    parsed TEXT,
-                    timestamp INTEGER
-                )
-            """
-        )
-
-        await database.execute(
-            """
-            CREATE UNIQUE INDEX IF NOT EXISTS torrents_series_both_idx 
-            ON torrents (media_id, info_hash, season, episode) 
-            WHERE season IS NOT NULL AND episode IS NOT NULL
-            """
-        )
-
-        await database.execute(
-            """
-            CREATE UNIQUE INDEX IF NOT EXISTS torrents_season_only_idx 
-            ON torrents (media_id, info_hash, season) 
-            WHERE season IS NOT NULL AND episode IS NULL
-            """
-        )
-
-        await database.execute(
-            """
-            CREATE UNIQUE INDEX IF NOT EXISTS torrents_episode_only_idx 
-            ON torrents (media_id, info_hash, episode) 
-            WHERE season IS NULL AND episode IS NOT NULL
-            """
-        )
-
-        try:
-            await database.execute(
-                """
-                CREATE UNIQUE INDEX IF NOT EXISTS torrents_no_season_episode_idx 
-                ON torrents (media_id, info_hash) 
-                WHERE season IS NULL AND episode IS NULL
-                """
-            )
-        except asyncpg.exceptions.UniqueViolationError:
-            logger.warning("Index 'torrents_no_season_episode_idx' already exists, ignoring.")
-        except Exception as e:
-            logger.error(f"Unexpected error creating torrents_no_season_episode_idx index: {e}")
-            raise # Relance les erreurs inattendues
-
-        await database.execute(
-            """
-                CREATE TABLE IF NOT EXISTS debrid_availability (
-                    debrid_service TEXT,
-                    info_hash TEXT,
-                    file_index TEXT,
-                    title TEXT,
-                    season INTEGER,
-                    episode INTEGER,
-                    size BIGINT,
-                    parsed TEXT,
-                    timestamp INTEGER
-                )
-            """
-        )
-
-        await database.execute(
-            """
-            CREATE UNIQUE INDEX IF NOT EXISTS debrid_series_both_idx 
-            ON debrid_availability (debrid_service, info_hash, season, episode) 
-            WHERE season IS NOT NULL AND episode IS NOT NULL
-            """
-        )
-
-        await database.execute(
-            """
-            CREATE UNIQUE INDEX IF NOT EXISTS debrid_season_only_idx 
-            ON debrid_availability (debrid_service, info_hash, season) 
-            WHERE season IS NOT NULL AND episode IS NULL
-            """
-        )
-
-        await database.execute(
-            """
-            CREATE UNIQUE INDEX IF NOT EXISTS debrid_episode_only_idx 
-            ON debrid_availability (debrid_service, info_hash, episode) 
-            WHERE season IS NULL AND episode IS NOT NULL
-            """
-        )
-
-        await database.execute(
-            """
-            CREATE UNIQUE INDEX IF NOT EXISTS debrid_no_season_episode_idx 
-            ON debrid_availability (debrid_service, info_hash) 
-            WHERE season IS NULL AND episode IS NULL
-            """
-        )
-
-        await database.execute(
-            """
-                CREATE TABLE IF NOT EXISTS download_links_cache (
-                    debrid_key TEXT, 
-                    info_hash TEXT, 
-                    season INTEGER,
-                    episode INTEGER,
-                    download_url TEXT, 
-                    timestamp INTEGER
-                )
-            """
-        )
-
-        await database.execute(
-            """
-            CREATE UNIQUE INDEX IF NOT EXISTS download_links_series_both_idx 
-            ON download_links_cache (debrid_key, info_hash, season, episode) 
-            WHERE season IS NOT NULL AND episode IS NOT NULL
-            """
-        )
-
-        await database.execute(
-            """
-            CREATE UNIQUE INDEX IF NOT EXISTS download_links_season_only_idx 
-            ON download_links_cache (debrid_key, info_hash, season) 
-            WHERE season IS NOT NULL AND episode IS NULL
-            """
-        )
-
-        await database.execute(
-            """
-            CREATE UNIQUE INDEX IF NOT EXISTS download_links_episode_only_idx 
-            ON download_links_cache (debrid_key, info_hash, episode) 
-            WHERE season IS NULL AND episode IS NOT NULL
-            """
-        )
-
-        await database.execute(
-            """
-            CREATE UNIQUE INDEX IF NOT EXISTS download_links_no_season_episode_idx 
-            ON download_links_cache (debrid_key, info_hash) 
-            WHERE season IS NULL AND episode IS NULL
-            """
-        )
-
-        await database.execute(
-            """
-                CREATE TABLE IF NOT EXISTS active_connections (
-                    id TEXT PRIMARY KEY, 
-                    ip TEXT, 
-                    content TEXT, 
-                    timestamp INTEGER
-                )
-            """
-        )
+def get_pool_stats():
+    if not database.is_connected:
+        return {}
 
-        if settings.DATABASE_TYPE == "sqlite":
-            await database.execute("PRAGMA busy_timeout=30000")  # 30 seconds timeout
-            await database.execute("PRAGMA journal_mode=WAL")
-            await database.execute("PRAGMA synchronous=OFF")
-            await database.execute("PRAGMA temp_store=MEMORY")
-            await database.execute("PRAGMA mmap_size=30000000000")
-            await database.execute("PRAGMA page_size=4096")
-            await database.execute("PRAGMA cache_size=-2000")
-            await database.execute("PRAGMA foreign_keys=OFF")
-            await database.execute("PRAGMA count_changes=OFF")
-            await database.execute("PRAGMA secure_delete=OFF")
-            await database.execute("PRAGMA auto_vacuum=OFF")
-
-        await database.execute("DELETE FROM ongoing_searches")
-
-        await database.execute(
-            """
-            DELETE FROM first_searches 
-            WHERE timestamp + :cache_ttl < :current_time;
-            """,
-            {"cache_ttl": settings.TORRENT_CACHE_TTL, "current_time": time.time()},
-        )
-
-        await database.execute(
-            """
-            DELETE FROM metadata_cache 
-            WHERE timestamp + :cache_ttl < :current_time;
-            """,
-            {"cache_ttl": settings.METADATA_CACHE_TTL, "current_time": time.time()},
-        )
-
-        await database.execute(
-            """
-            DELETE FROM torrents
-            WHERE timestamp + :cache_ttl < :current_time;
-            """,
-            {"cache_ttl": settings.TORRENT_CACHE_TTL, "current_time": time.time()},
-        )
-
-        await database.execute(
-            """
-            DELETE FROM debrid_availability
-            WHERE timestamp + :cache_ttl < :current_time;
-            """,
-            {"cache_ttl": settings.DEBRID_CACHE_TTL, "current_time": time.time()},
-        )
-
-        await database.execute("DELETE FROM download_links_cache")
-
-        await database.execute("DELETE FROM active_connections")
+    if settings.DATABASE_TYPE == "sqlite":
+        return database.get_stats()
 
-    except Exception as e:
-        logger.error(f"CRITICAL: Failed to connect to or setup the database: {e}")
-        logger.exception(traceback.format_exc()) # Log la trace complète
-        raise # Relance l'exception pour arrêter le démarrage de FastAPI
+    pool = database._backend._pool
+    size = pool.get_size()
+    in_use = size - pool.get_idle_size()
+    return {
+        "size": size,
+        "in_use": in_use,
+        "min_size": pool.get_min_size(),
+        "max_size": pool.get_max_size(),
+        "utilization": in_use / pool.get_max_size(),
+    }
+
+
+Gauge(
+    "comet_database_pool",
+    "Database connection pool statistics",
+    ("stat",),
+    collect=lambda: {(stat,): float(value) for stat, value in get_pool_stats().items()},
+)
 
 
 async def teardown_database():
@@ -389,6 +226,7 @@ async def teardown_database():
         if database.is_connected: # Vérifier si la connexion a été établie avant de déconnecter
              logger.info("Disconnecting from database.")
              await database.disconnect()
+             await read_database.disconnect()
         else:
              logger.warning("Database teardown called, but connection was not established.")
     except Exception as e:
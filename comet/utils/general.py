@@ -1,4 +1,5 @@
 import base64
+import collections
 import hashlib
 import re
 import aiohttp
@@ -7,14 +8,28 @@ import PTT
 import asyncio
 import orjson
 import time
-import copy
 
 from RTN import parse, title_match
 from curl_cffi import requests
 from fastapi import Request
 
+from comet.utils.cache_backend import shared_cache
+from comet.utils.cache_writer import cache_writer
+from comet.utils.db import read_database
 from comet.utils.logger import logger
-from comet.utils.models import database, settings, ConfigModel
+from comet.utils.metrics import cache_requests, scraper_errors, scraper_seconds
+from comet.utils.models import settings, ConfigModel
+from comet.utils.response_cache import stream_response_cache
+from comet.utils.results import (
+    DUBBED,
+    FETCH,
+    NO_LANGUAGES,
+    ResultSet,
+    get_language_mask,
+    resolution_codes,
+    resolution_names,
+)
+from comet.utils.tracing import start_span
 
 languages_emojis = {
     "unknown": "❓",  # Unknown
@@ -234,15 +249,118 @@ def bytes_to_size(bytes: int):
     return f"{round(bytes, 2)} {sizes[i]}"
 
 
-def config_check(b64config: str):
+class CompiledConfig:
+    # the filter plan of a config, built once per cached config and applied
+    # by get_balanced_hashes in a single pass over the result set columns
+    def __init__(self, config: dict):
+        self.remove_trash = config["removeTrash"]
+        self.max_size = config["maxSize"]
+
+        resolutions = {resolution.lower() for resolution in config["resolutions"]}
+        self.all_resolutions = "all" in resolutions
+        self.resolution_mask = 0
+        for resolution in resolutions:
+            if resolution in resolution_codes:
+                self.resolution_mask |= 1 << resolution_codes[resolution]
+
+        languages = {language.lower() for language in config["languages"]}
+        self.all_languages = "all" in languages
+        self.language_mask = get_language_mask(
+            code
+            for code, name in PTT.parse.LANGUAGES_TRANSLATION_TABLE.items()
+            if name.lower() in languages
+        )
+        self.language_flags = (DUBBED if "multi" in languages else 0) | (
+            NO_LANGUAGES if "unknown" in languages else 0
+        )
+
+        self.filtered = (
+            self.remove_trash
+            or self.max_size != 0
+            or not self.all_resolutions
+            or not self.all_languages
+        )
+
+    def select(self, results: ResultSet):
+        # positions in the result set grouped by resolution, in ranking order
+        if not self.filtered:
+            selected = range(len(results))
+        else:
+            remove_trash = self.remove_trash
+            max_size = self.max_size
+            all_resolutions = self.all_resolutions
+            resolution_mask = self.resolution_mask
+            all_languages = self.all_languages
+            language_mask = self.language_mask
+            language_flags = self.language_flags
+            selected = [
+                i
+                for i, (resolution, size, languages, flags) in enumerate(
+                    zip(
+                        results.resolutions,
+                        results.sizes,
+                        results.languages,
+                        results.flags,
+                    )
+                )
+                if (not remove_trash or flags & FETCH)
+                and (max_size == 0 or size <= max_size)
+                and (all_resolutions or resolution_mask >> resolution & 1)
+                and (
+                    all_languages
+                    or languages & language_mask
+                    or flags & language_flags
+                )
+            ]
+
+        hashes_by_resolution = {}
+        resolutions = results.resolutions
+        for i in selected:
+            resolution = resolution_names[resolutions[i]]
+            if resolution not in hashes_by_resolution:
+                hashes_by_resolution[resolution] = []
+            hashes_by_resolution[resolution].append(i)
+
+        return hashes_by_resolution
+
+
+def validate_config(b64config: str):
     try:
         config = orjson.loads(base64.b64decode(b64config).decode())
-        validated_config = ConfigModel(**config)
-        return validated_config.model_dump()
+        validated_config = ConfigModel(**config).model_dump()
+        validated_config["compiled"] = CompiledConfig(validated_config)
+        return validated_config
     except:
         return False
 
 
+# keyed by a digest so the cache doesn't keep a second copy of every debrid key
+config_cache = collections.OrderedDict()
+
+
+def config_check(b64config: str):
+    if b64config is None:  # /manifest.json
+        return False
+
+    if settings.CONFIG_CACHE_SIZE <= 0:
+        return validate_config(b64config)
+
+    key = hashlib.sha256(b64config.encode()).digest()
+    config = config_cache.get(key)
+    if config is None:
+        cache_requests.inc(cache="config", result="miss")
+        config = validate_config(b64config)
+        config_cache[key] = config
+        if len(config_cache) > settings.CONFIG_CACHE_SIZE:
+            config_cache.popitem(last=False)
+    else:
+        cache_requests.inc(cache="config", result="hit")
+        config_cache.move_to_end(key)
+
+    # stream() and playback() swap in the default debrid service and key
+    return config.copy() if config else False
+
+
 def get_debrid_extension(debridService: str, debridApiKey: str = None):
     if debridApiKey == "":
         return "TORRENT"
@@ -264,6 +382,10 @@ async def get_indexer_manager(
     indexers: list,
     query: str,
 ):
+    span = start_span(
+        f"scraper {indexer_manager_type}", scraper_seconds, scraper=indexer_manager_type
+    )
+    span.set(query=query)
     results = []
     try:
         indexers = [indexer.replace("_", " ") for indexer in indexers]
@@ -283,6 +405,7 @@ async def get_indexer_manager(
                         response_json = await response.json()
                         return response_json.get("Results", [])
                 except Exception as e:
+                    scraper_errors.inc(scraper="jackett")
                     logger.warning(
                         f"Exception while fetching Jackett results for indexer {indexer}: {e}"
                     )
@@ -330,17 +453,21 @@ async def get_indexer_manager(
 
                 results.append(result)
     except Exception as e:
+        scraper_errors.inc(scraper=indexer_manager_type)
+        span.fail(e)
         logger.warning(
             f"Exception while getting {indexer_manager_type} results for {query} with {indexers}: {e}"
         )
         pass
 
+    span.end()
     return results
 
 
 async def get_zilean(
     session: aiohttp.ClientSession, name: str, log_name: str, season: int, episode: int
 ):
+    span = start_span("scraper zilean", scraper_seconds, scraper="zilean")
     results = []
     try:
         show = f"&season={season}&episode={episode}"
@@ -363,24 +490,28 @@ async def get_zilean(
 
         logger.info(f"{len(results)} torrents found for {log_name} with Zilean")
     except Exception as e:
+        scraper_errors.inc(scraper="zilean")
+        span.fail(e)
         logger.warning(
             f"Exception while getting torrents for {log_name} with Zilean: {e}"
         )
         pass
 
+    span.end()
     return results
 
 
 async def get_torrentio(log_name: str, type: str, full_id: str):
+    span = start_span("scraper torrentio", scraper_seconds, scraper="torrentio")
     results = []
     try:
         try:
             get_torrentio = requests.get(
-                f"https://torrentio.strem.fun/stream/{type}/{full_id}.json"
+                f"{settings.TORRENTIO_URL}/stream/{type}/{full_id}.json"
             ).json()
         except:
             get_torrentio = requests.get(
-                f"https://torrentio.strem.fun/stream/{type}/{full_id}.json",
+                f"{settings.TORRENTIO_URL}/stream/{type}/{full_id}.json",
                 proxies={
                     "http": settings.DEBRID_PROXY_URL,
                     "https": settings.DEBRID_PROXY_URL,
@@ -403,15 +534,19 @@ async def get_torrentio(log_name: str, type: str, full_id: str):
 
         logger.info(f"{len(results)} torrents found for {log_name} with Torrentio")
     except Exception as e:
+        scraper_errors.inc(scraper="torrentio")
+        span.fail(e)
         logger.warning(
             f"Exception while getting torrents for {log_name} with Torrentio, your IP is most likely blacklisted (you should try proxying Comet): {e}"
         )
         pass
 
+    span.end()
     return results
 
 
 async def get_mediafusion(log_name: str, type: str, full_id: str):
+    span = start_span("scraper mediafusion", scraper_seconds, scraper="mediafusion")
     results = []
     try:
         try:
@@ -446,11 +581,14 @@ async def get_mediafusion(log_name: str, type: str, full_id: str):
         logger.info(f"{len(results)} torrents found for {log_name} with MediaFusion")
 
     except Exception as e:
+        scraper_errors.inc(scraper="mediafusion")
+        span.fail(e)
         logger.warning(
             f"Exception while getting torrents for {log_name} with MediaFusion, your IP is most likely blacklisted (you should try proxying Comet): {e}"
         )
         pass
 
+    span.end()
     return results
 
 
@@ -533,49 +671,12 @@ async def get_torrent_hash(session: aiohttp.ClientSession, torrent: tuple):
         return (index, None)
 
 
-def get_balanced_hashes(hashes: dict, config: dict):
+def get_balanced_hashes(results: ResultSet, config: dict):
+    # positions in results, not hashes
     max_results = config["maxResults"]
     max_results_per_resolution = config["maxResultsPerResolution"]
 
-    max_size = config["maxSize"]
-    config_resolutions = [resolution.lower() for resolution in config["resolutions"]]
-    include_all_resolutions = "all" in config_resolutions
-    remove_trash = config["removeTrash"]
-
-    languages = [language.lower() for language in config["languages"]]
-    include_all_languages = "all" in languages
-    if not include_all_languages:
-        config_languages = [
-            code
-            for code, name in PTT.parse.LANGUAGES_TRANSLATION_TABLE.items()
-            if name.lower() in languages
-        ]
-
-    hashes_by_resolution = {}
-    for hash, hash_data in hashes.items():
-        if remove_trash and not hash_data["fetch"]:
-            continue
-
-        hash_info = hash_data["data"]
-
-        if max_size != 0 and hash_info["size"] > max_size:
-            continue
-
-        if (
-            not include_all_languages
-            and not any(lang in hash_info["languages"] for lang in config_languages)
-            and ("multi" not in languages if hash_info["dubbed"] else True)
-            and not (len(hash_info["languages"]) == 0 and "unknown" in languages)
-        ):
-            continue
-
-        resolution = hash_info["resolution"]
-        if not include_all_resolutions and resolution not in config_resolutions:
-            continue
-
-        if resolution not in hashes_by_resolution:
-            hashes_by_resolution[resolution] = []
-        hashes_by_resolution[resolution].append(hash)
+    hashes_by_resolution = config["compiled"].select(results)
 
     if config["reverseResultOrder"]:
         hashes_by_resolution = {
@@ -702,47 +803,372 @@ async def get_aliases(session: aiohttp.ClientSession, media_type: str, media_id:
     return aliases
 
 
-async def add_torrent_to_cache(
-    config: dict, name: str, season: int, episode: int, sorted_ranked_files: dict
-):
-    # trace of which indexers were used when cache was created - not optimal
-    indexers = config["indexers"].copy()
+def get_search_indexers(config: dict):
+    # the sources a search with this config queries, the user's indexers are
+    # only searched when an indexer manager is configured
+    indexers = config["indexers"].copy() if settings.INDEXER_MANAGER_TYPE else []
     if settings.SCRAPE_TORRENTIO:
         indexers.append("torrentio")
     if settings.SCRAPE_MEDIAFUSION:
         indexers.append("mediafusion")
     if settings.ZILEAN_URL:
         indexers.append("dmm")
-    for indexer in indexers:
-        hash = f"searched-{indexer}-{name}-{season}-{episode}"
 
-        searched = copy.deepcopy(sorted_ranked_files[list(sorted_ranked_files.keys())[0]])
-        searched["infohash"] = hash
-        searched["data"]["tracker"] = indexer
+    return indexers
+
+
+def get_search_sources(indexers: list):
+    # a scrape only answers later requests searching the same sources
+    return ",".join(sorted(set(indexers)))
+
 
-        sorted_ranked_files[hash] = searched
+def get_search_id(full_id: str, indexers: list):
+    return f"{full_id}|{get_search_sources(indexers)}"
 
+
+async def add_torrent_to_cache(
+    config: dict,
+    name: str,
+    season: int,
+    episode: int,
+    results: ResultSet,
+    full_id: str,
+):
+    # trace of which indexers were used when cache was created - not optimal
+    indexers = get_search_indexers(config)
+
+    current_time = int(time.time())
+    expires_at = current_time + settings.CACHE_TTL
     values = [
         {
             "debridService": config["debridService"],
-            "info_hash": sorted_ranked_files[torrent]["infohash"],
+            "info_hash": results.hashes[i],
             "name": name,
             "season": season,
             "episode": episode,
-            "tracker": sorted_ranked_files[torrent]["data"]["tracker"]
-            .split("|")[0]
-            .lower(),
-            "data": orjson.dumps(sorted_ranked_files[torrent]).decode("utf-8"),
-            "timestamp": time.time(),
+            "tracker": results.tracker(i).split("|")[0].lower(),
+            "data": orjson.dumps(results.torrent(i)).decode("utf-8"),
+            "timestamp": current_time,
+            "expires_at": expires_at,
         }
-        for torrent in sorted_ranked_files
+        for i in range(len(results))
     ]
 
-    query = f"""
-        INSERT {'OR IGNORE ' if settings.DATABASE_TYPE == 'sqlite' else ''}
-        INTO cache (debridService, info_hash, name, season, episode, tracker, data, timestamp)
-        VALUES (:debridService, :info_hash, :name, :season, :episode, :tracker, :data, :timestamp)
-        {' ON CONFLICT DO NOTHING' if settings.DATABASE_TYPE == 'postgresql' else ''}
-    """
+    first_file = results.torrent(0)
+    for indexer in indexers:
+        searched = {
+            **first_file,
+            "infohash": f"searched-{indexer}-{name}-{season}-{episode}",
+            "data": {**first_file["data"], "tracker": indexer},
+        }
+        values.append(
+            {
+                "debridService": config["debridService"],
+                "info_hash": searched["infohash"],
+                "name": name,
+                "season": season,
+                "episode": episode,
+                "tracker": indexer.lower(),
+                "data": orjson.dumps(searched).decode("utf-8"),
+                "timestamp": current_time,
+                "expires_at": expires_at,
+            }
+        )
+
+    cache_writer.enqueue_upsert(
+        "cache",
+        (
+            "debridService",
+            "info_hash",
+            "name",
+            "season",
+            "episode",
+            "tracker",
+            "data",
+            "timestamp",
+            "expires_at",
+        ),
+        values,
+        f"""
+            ON CONFLICT {get_conflict_target("debridService, info_hash, name", season, episode)}
+            DO UPDATE SET tracker = excluded.tracker, data = excluded.data, timestamp = excluded.timestamp, expires_at = excluded.expires_at
+        """,
+        ("debridService", "info_hash", "name", "season", "episode"),
+    )
+
+    # rendered responses of the media are dropped once the new rows are readable,
+    # a request in between would otherwise cache the old results again
+    cache_writer.after_flush(stream_response_cache.invalidate, full_id)
+
+
+def get_conflict_target(columns: str, season: int, episode: int):
+    # torrents/debrid_availability/cache unique indexes are partial on season/episode nullness
+    if season is not None and episode is not None:
+        return f"({columns}, season, episode) WHERE season IS NOT NULL AND episode IS NOT NULL"
+    if season is not None:
+        return f"({columns}, season) WHERE season IS NOT NULL AND episode IS NULL"
+    if episode is not None:
+        return f"({columns}, episode) WHERE season IS NULL AND episode IS NOT NULL"
+    return f"({columns}) WHERE season IS NULL AND episode IS NULL"
+
+
+def get_nullable_filter(column: str, value):
+    # "IS NULL" / "= :value" instead of an OR over both keeps the lookup indexes usable
+    if value is None:
+        return f"{column} IS NULL", {}
+    return f"{column} = :{column}", {column: value}
+
+
+async def get_cached_availability(
+    debrid_service: str, info_hashes: list, season: int, episode: int
+):
+    season_filter, season_values = get_nullable_filter("season", season)
+    episode_filter, episode_values = get_nullable_filter("episode", episode)
+    rows = await read_database.fetch_all(
+        f"""
+            SELECT info_hash, file_index, title, size
+            FROM debrid_availability
+            WHERE debrid_service = :debrid_service
+            AND info_hash IN (SELECT cast(value as TEXT) FROM {'json_array_elements_text' if settings.DATABASE_TYPE == 'postgresql' else 'json_each'}(:info_hashes))
+            AND {season_filter}
+            AND {episode_filter}
+            AND expires_at >= :current_time
+        """,
+        {
+            "debrid_service": debrid_service,
+            "info_hashes": orjson.dumps(info_hashes).decode("utf-8"),
+            **season_values,
+            **episode_values,
+            "current_time": time.time(),
+        },
+    )
+
+    cache_requests.inc(len(rows), cache="availability", result="hit")
+    cache_requests.inc(len(info_hashes) - len(rows), cache="availability", result="miss")
 
-    await database.execute_many(query, values)
+    # None means the hash is known not to be cached for this episode
+    return {
+        row["info_hash"]: (
+            {"index": row["file_index"], "title": row["title"], "size": row["size"]}
+            if row["file_index"] is not None
+            else None
+        )
+        for row in rows
+    }
+
+
+async def cache_availability(debrid_service: str, availability: list):
+    # availability: (info_hash, season, episode, file or None, parsed or None) rows
+    current_time = int(time.time())
+    expires_at = current_time + settings.DEBRID_CACHE_TTL
+    values_by_target = {}
+    for info_hash, season, episode, file, parsed in availability:
+        conflict_target = get_conflict_target("debrid_service, info_hash", season, episode)
+        values_by_target.setdefault(conflict_target, []).append(
+            {
+                "debrid_service": debrid_service,
+                "info_hash": info_hash,
+                "file_index": str(file["index"]) if file else None,
+                "title": file["title"] if file else None,
+                "season": season,
+                "episode": episode,
+                "size": file["size"] if file else None,
+                "parsed": orjson.dumps(parsed).decode("utf-8") if parsed else None,
+                "timestamp": current_time,
+                "expires_at": expires_at,
+            }
+        )
+
+    for conflict_target, values in values_by_target.items():
+        cache_writer.enqueue_upsert(
+            "debrid_availability",
+            (
+                "debrid_service",
+                "info_hash",
+                "file_index",
+                "title",
+                "season",
+                "episode",
+                "size",
+                "parsed",
+                "timestamp",
+                "expires_at",
+            ),
+            values,
+            f"""
+                ON CONFLICT {conflict_target}
+                DO UPDATE SET file_index = excluded.file_index, title = excluded.title, size = excluded.size, parsed = excluded.parsed, timestamp = excluded.timestamp, expires_at = excluded.expires_at
+            """,
+            ("debrid_service", "info_hash", "season", "episode"),
+        )
+
+
+def format_cached_torrents(rows: list):
+    return [
+        {
+            "Title": row["title"],
+            "InfoHash": row["info_hash"],
+            "Size": row["size"],
+            "Tracker": row["tracker"],
+            "Seeders": row["seeders"],
+        }
+        for row in rows
+    ]
+
+
+async def get_cached_torrents(
+    media_id: str, search_id: str, sources: str, season: int, episode: int
+):
+    current_time = time.time()
+    first_search = await read_database.fetch_one(
+        """
+            SELECT timestamp FROM first_searches
+            WHERE media_id = :media_id
+            AND expires_at >= :current_time
+        """,
+        {"media_id": search_id, "current_time": current_time},
+    )
+    if first_search is None:
+        return None
+
+    season_filter, season_values = get_nullable_filter("season", season)
+    episode_filter, episode_values = get_nullable_filter("episode", episode)
+    if season is not None and episode is not None:
+        # season packs are stored without episode and match every episode of their season
+        episode_filter = f"({episode_filter} OR episode IS NULL)"
+
+    rows = await read_database.fetch_all(
+        f"""
+            SELECT info_hash, title, seeders, size, tracker
+            FROM torrents
+            WHERE media_id = :media_id
+            AND sources = :sources
+            AND {season_filter}
+            AND {episode_filter}
+            AND expires_at >= :current_time
+        """,
+        {
+            "media_id": media_id,
+            "sources": sources,
+            **season_values,
+            **episode_values,
+            "current_time": current_time,
+        },
+    )
+
+    return format_cached_torrents(rows)
+
+
+async def get_season_packs(media_id: str, sources: str, season: int):
+    rows = await read_database.fetch_all(
+        """
+            SELECT info_hash, title, seeders, size, tracker
+            FROM torrents
+            WHERE media_id = :media_id
+            AND sources = :sources
+            AND season = :season
+            AND episode IS NULL
+            AND expires_at >= :current_time
+        """,
+        {
+            "media_id": media_id,
+            "sources": sources,
+            "season": season,
+            "current_time": time.time(),
+        },
+    )
+
+    return format_cached_torrents(rows)
+
+
+async def wait_for_cached_torrents(
+    media_id: str, search_id: str, sources: str, season: int, episode: int
+):
+    # another request holds the search lease, wait for its results or for it to give up
+    deadline = time.time() + settings.SEARCH_LEASE_TTL
+    while time.time() < deadline and await shared_cache.is_leased(search_id):
+        await asyncio.sleep(0.5)
+
+        torrents = await get_cached_torrents(
+            media_id, search_id, sources, season, episode
+        )
+        if torrents is not None:
+            return torrents
+
+
+async def cache_torrents(
+    media_id: str,
+    search_id: str,
+    sources: str,
+    season: int,
+    episode: int,
+    torrents: list,
+):
+    if len(torrents) == 0:
+        return
+
+    current_time = int(time.time())
+    expires_at = current_time + settings.TORRENT_CACHE_TTL
+    values_by_target = {}
+    for torrent in torrents:
+        parsed = parse(torrent["Title"])
+
+        torrent_episode = episode
+        if episode is not None and len(parsed.episodes) == 0:  # season pack
+            torrent_episode = None
+
+        seeders = torrent.get("Seeders", torrent.get("seeders"))
+        conflict_target = get_conflict_target(
+            "media_id, info_hash, sources", season, torrent_episode
+        )
+        values_by_target.setdefault(conflict_target, []).append(
+            {
+                "media_id": media_id,
+                "info_hash": torrent["InfoHash"],
+                "file_index": None,
+                "season": season,
+                "episode": torrent_episode,
+                "title": torrent["Title"],
+                "seeders": int(seeders) if seeders is not None else None,
+                "size": torrent["Size"],
+                "tracker": torrent["Tracker"],
+                "sources": sources,
+                "parsed": orjson.dumps(parsed.model_dump()).decode("utf-8"),
+                "timestamp": current_time,
+                "expires_at": expires_at,
+            }
+        )
+
+    for conflict_target, values in values_by_target.items():
+        cache_writer.enqueue_upsert(
+            "torrents",
+            (
+                "media_id",
+                "info_hash",
+                "file_index",
+                "season",
+                "episode",
+                "title",
+                "seeders",
+                "size",
+                "tracker",
+                "sources",
+                "parsed",
+                "timestamp",
+                "expires_at",
+            ),
+            values,
+            f"""
+                ON CONFLICT {conflict_target}
+                DO UPDATE SET title = excluded.title, seeders = excluded.seeders, size = excluded.size, tracker = excluded.tracker, parsed = excluded.parsed, timestamp = excluded.timestamp, expires_at = excluded.expires_at
+            """,
+            ("media_id", "info_hash", "sources", "season", "episode"),
+        )
+
+    cache_writer.enqueue_upsert(
+        "first_searches",
+        ("media_id", "timestamp", "expires_at"),
+        [{"media_id": search_id, "timestamp": current_time, "expires_at": expires_at}],
+        "ON CONFLICT (media_id) DO UPDATE SET timestamp = excluded.timestamp, expires_at = excluded.expires_at",
+        ("media_id",),
+    )
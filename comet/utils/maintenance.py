@@ -0,0 +1,182 @@
+import asyncio
+import time
+import traceback
+import uuid
+
+from comet.utils.logger import logger
+from comet.utils.metrics import Gauge
+from comet.utils.models import database, settings
+
+# table -> ttl in seconds, expires_at is written as timestamp + ttl
+expiring_tables = {
+    "cache": settings.CACHE_TTL,
+    "first_searches": settings.TORRENT_CACHE_TTL,
+    "metadata_cache": settings.METADATA_CACHE_TTL,
+    "torrents": settings.TORRENT_CACHE_TTL,
+    "debrid_availability": settings.DEBRID_CACHE_TTL,
+    "download_links": settings.DOWNLOAD_LINK_CACHE_TTL,
+}
+
+maintenance_stats = {
+    "runs": 0,
+    "last_run_duration": 0.0,
+    "deleted_rows": {},
+    "table_sizes": {},
+}
+
+Gauge(
+    "comet_database_table_bytes",
+    "Table sizes measured by the last maintenance run",
+    ("table",),
+    collect=lambda: {
+        (table,): size for table, size in maintenance_stats["table_sizes"].items()
+    },
+)
+Gauge(
+    "comet_database_expired_rows_deleted",
+    "Expired rows deleted by the last maintenance run",
+    ("table",),
+    collect=lambda: {
+        (table,): deleted
+        for table, deleted in maintenance_stats["deleted_rows"].items()
+    },
+)
+
+
+async def acquire_database_lease(name: str, ttl: int):
+    # a row in the database itself, so with the memory cache backend the workers
+    # of a node still agree on a single holder, returns its token
+    token = uuid.uuid4().hex
+    current_time = int(time.time())
+    holder = await database.fetch_val(
+        """
+            INSERT INTO database_leases (name, token, expires_at)
+            VALUES (:name, :token, :expires_at)
+            ON CONFLICT (name) DO UPDATE SET token = excluded.token, expires_at = excluded.expires_at
+            WHERE database_leases.expires_at <= :current_time
+            RETURNING token
+        """,
+        {
+            "name": name,
+            "token": token,
+            "expires_at": current_time + ttl,
+            "current_time": current_time,
+        },
+    )
+    if holder == token:
+        return token
+
+
+async def release_database_lease(name: str, token: str):
+    if token is not None:
+        await database.execute(
+            "DELETE FROM database_leases WHERE name = :name AND token = :token",
+            {"name": name, "token": token},
+        )
+
+
+async def delete_expired_rows(table: str, current_time: float):
+    # bounded batches keep each write transaction short on SQLite and let
+    # PostgreSQL autovacuum keep up instead of one huge delete
+    row_id = "rowid" if settings.DATABASE_TYPE == "sqlite" else "ctid"
+    deleted = 0
+    while True:
+        rows = await database.fetch_all(
+            f"""
+                DELETE FROM {table}
+                WHERE {row_id} IN (
+                    SELECT {row_id} FROM {table}
+                    WHERE expires_at < :current_time
+                    LIMIT :batch_size
+                )
+                RETURNING 1
+            """,
+            {
+                "current_time": current_time,
+                "batch_size": settings.DATABASE_MAINTENANCE_BATCH_SIZE,
+            },
+        )
+        deleted += len(rows)
+        if len(rows) < settings.DATABASE_MAINTENANCE_BATCH_SIZE:
+            return deleted
+
+        await asyncio.sleep(0.1)
+
+
+async def get_table_sizes():
+    if settings.DATABASE_TYPE == "sqlite":
+        try:
+            rows = await database.fetch_all(
+                "SELECT name, SUM(pgsize) AS size FROM dbstat GROUP BY name"
+            )
+            return {
+                row["name"]: row["size"]
+                for row in rows
+                if row["name"] in expiring_tables
+            }
+        except Exception:  # dbstat is an optional SQLite extension
+            page_count = await database.fetch_val("PRAGMA page_count")
+            page_size = await database.fetch_val("PRAGMA page_size")
+            return {"database": page_count * page_size}
+
+    rows = await database.fetch_all(
+        """
+            SELECT relname AS name, pg_total_relation_size(relid) AS size
+            FROM pg_catalog.pg_statio_user_tables
+        """
+    )
+    return {
+        row["name"]: row["size"] for row in rows if row["name"] in expiring_tables
+    }
+
+
+async def compact_database(deleted_rows: dict):
+    if settings.DATABASE_TYPE == "sqlite":
+        # only effective on databases created with auto_vacuum=INCREMENTAL
+        if await database.fetch_val("PRAGMA auto_vacuum") == 2:
+            await database.execute("PRAGMA incremental_vacuum")
+        await database.execute("PRAGMA optimize")
+        await database.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return
+
+    # dead tuples are reclaimed by autovacuum, keep planner statistics fresh
+    for table, deleted in deleted_rows.items():
+        if deleted:
+            await database.execute(f"ANALYZE {table}")
+
+
+async def run_maintenance():
+    start_time = time.perf_counter()
+    current_time = time.time()
+
+    deleted_rows = {}
+    for table in expiring_tables:
+        deleted_rows[table] = await delete_expired_rows(table, current_time)
+
+    await compact_database(deleted_rows)
+    table_sizes = await get_table_sizes()
+
+    maintenance_stats["runs"] += 1
+    maintenance_stats["last_run_duration"] = time.perf_counter() - start_time
+    maintenance_stats["deleted_rows"] = deleted_rows
+    maintenance_stats["table_sizes"] = table_sizes
+
+    logger.log(
+        "COMET",
+        f"Database maintenance: {sum(deleted_rows.values())} expired rows deleted ({', '.join(f'{table}: {deleted}' for table, deleted in deleted_rows.items())}) in {maintenance_stats['last_run_duration']:.2f}s - Sizes: {', '.join(f'{table}: {size / 1048576:.1f}MB' for table, size in table_sizes.items())}",
+    )
+
+
+async def maintenance_loop():
+    while True:
+        try:
+            # a single worker of all the nodes sharing the database runs each pass
+            if await acquire_database_lease(
+                "maintenance", settings.DATABASE_MAINTENANCE_INTERVAL
+            ):
+                await run_maintenance()
+        except Exception as e:
+            logger.warning(f"Exception during database maintenance: {e}")
+            logger.exception(traceback.format_exc())
+
+        await asyncio.sleep(settings.DATABASE_MAINTENANCE_INTERVAL)
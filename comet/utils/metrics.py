@@ -0,0 +1,218 @@
+import bisect
+import contextlib
+import time
+
+# in-process metrics rendered in the Prometheus text format, every worker process
+# keeps its own values so scrape each worker (or run a single one per container)
+default_buckets = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple, values: tuple, le: str = None):
+    labels = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        labels.append(f'le="{le}"')
+
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def format_value(value: float):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}  # label values -> value
+        if not labels and self.type != "histogram":
+            self.values[()] = 0  # exported from the start, not after the first event
+
+        registry.register(self)
+
+    def key(self, labels: dict):
+        return tuple(labels[label] for label in self.labels)
+
+    def samples(self):
+        return self.values.items()
+
+    def render(self):
+        return [
+            f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+            for key, value in self.samples()
+        ]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(
+        self, name: str, description: str, labels: tuple = (), collect=None
+    ):
+        # collect() is called on every scrape and returns {label values: value}
+        super().__init__(name, description, labels)
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.collect is not None:
+            try:
+                return self.collect().items()
+            except Exception:
+                return ()
+
+        return self.values.items()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple = (),
+        buckets: tuple = default_buckets,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        series = self.values.get(key)
+        if series is None:
+            # per bucket counts (+Inf last), sum, count
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def render(self):
+        lines = []
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labels, key, format_value(bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+
+        return lines
+
+
+http_requests = Counter(
+    "comet_http_requests_total", "HTTP requests served", ("method", "status")
+)
+http_request_seconds = Histogram(
+    "comet_http_request_seconds", "HTTP request duration", ("method",)
+)
+stream_stage_seconds = Histogram(
+    "comet_stream_stage_seconds", "Duration of each stage of a stream request", ("stage",)
+)
+scraper_seconds = Histogram(
+    "comet_scraper_seconds", "Duration of each scraper call", ("scraper",)
+)
+scraper_errors = Counter(
+    "comet_scraper_errors_total", "Failed scraper calls", ("scraper",)
+)
+debrid_request_seconds = Histogram(
+    "comet_debrid_request_seconds",
+    "Duration of debrid API calls",
+    ("service", "operation"),
+)
+debrid_errors = Counter(
+    "comet_debrid_errors_total", "Failed debrid API calls", ("service", "operation")
+)
+cache_requests = Counter(
+    "comet_cache_requests_total",
+    "Cache lookups by result (hit or miss)",
+    ("cache", "result"),
+)
+proxy_bytes = Counter(
+    "comet_proxy_bytes_total", "Bytes streamed through the debrid stream proxy"
+)
+event_loop_lag = Histogram(
+    "comet_event_loop_lag_seconds",
+    "Delay of the event loop waking up a sleeping task",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+event_loop_blocked = Counter(
+    "comet_event_loop_blocked_total",
+    "Times the event loop was blocked beyond EVENT_LOOP_LAG_THRESHOLD",
+)
+proxy_connections = Gauge(
+    "comet_proxy_active_connections", "Streams currently proxied by this process"
+)
@@ -0,0 +1,83 @@
+import time
+
+from comet.utils.logger import logger
+from comet.utils.metrics import http_request_seconds, http_requests
+from comet.utils.models import settings
+from comet.utils.tracing import finish_trace, start_trace
+
+
+class LoguruMiddleware:
+    # pure ASGI: messages are passed straight through, no extra task or queue per
+    # response, which matters for the long proxied StreamingResponse byte streams
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        timing = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": 500,
+            "duration": 0.0,
+            "ttfb": None,
+            "bytes": 0,
+            "streaming": False,
+        }
+        trace = None
+        if settings.TRACING_ENABLED:
+            trace = start_trace(scope["method"], **{"http.method": scope["method"]})
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                timing["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                if timing["ttfb"] is None:
+                    timing["ttfb"] = time.perf_counter() - start_time
+                timing["bytes"] += len(message.get("body", b""))
+                if message.get("more_body", False):
+                    timing["streaming"] = True
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            logger.exception(f"Exception during request processing: {e}")
+            raise
+        finally:
+            timing["duration"] = time.perf_counter() - start_time
+            http_requests.inc(method=timing["method"], status=timing["status"])
+            http_request_seconds.observe(timing["duration"], method=timing["method"])
+            log_request(timing)
+
+            if trace is not None:
+                route = route_name(scope)
+                trace.name = f"{scope['method']} {route}"
+                trace.set(**{"http.route": route, "http.status_code": timing["status"]})
+                # a proxied stream lasts as long as the playback, its time to first byte is what counts
+                finish_trace(
+                    trace, timing["ttfb"] if timing["streaming"] else timing["duration"]
+                )
+
+
+def route_name(scope: dict):
+    # the route template keeps the user's config (and debrid API key) out of the traces
+    route = scope.get("route")
+    if route is not None and hasattr(route, "path"):
+        return route.path
+
+    path = scope["path"]
+    b64config = scope.get("path_params", {}).get("b64config")
+    return path.replace(b64config, "{b64config}") if b64config else path
+
+
+def log_request(timing: dict):
+    message = f"{timing['method']} {timing['path']} - {timing['status']} - {timing['duration']:.2f}s"
+    if timing["streaming"]:
+        message += f" - TTFB {timing['ttfb']:.2f}s - {timing['bytes'] / 1048576:.1f}MB ({timing['bytes'] / max(timing['duration'], 1e-6) / 1048576:.1f}MB/s)"
+
+    logger.bind(**timing).log("API", message)
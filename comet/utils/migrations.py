@@ -0,0 +1,503 @@
+import asyncio
+import asyncpg
+import traceback
+
+from comet.utils.logger import logger
+from comet.utils.maintenance import (
+    acquire_database_lease,
+    expiring_tables,
+    release_database_lease,
+)
+from comet.utils.models import database, settings
+
+# ordered (version, migrate, backfill) steps, every step must be idempotent
+migrations = []
+
+
+def migration(version: str, backfill=None):
+    def register(migrate):
+        migrations.append((version, migrate, backfill))
+        return migrate
+
+    return register
+
+
+def parse_version(version: str):
+    return tuple(int(part) for part in version.split("."))
+
+
+async def column_exists(table: str, column: str):
+    if settings.DATABASE_TYPE == "sqlite":
+        columns = await database.fetch_all(f"PRAGMA table_info({table})")
+        return any(row["name"] == column for row in columns)
+
+    return (
+        await database.fetch_val(
+            """
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column
+            """,
+            {"table": table, "column": column},
+        )
+        is not None
+    )
+
+
+async def add_column(table: str, column: str, definition: str):
+    if not await column_exists(table, column):
+        await database.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+async def backfill_column(
+    table: str, set_clause: str, where_clause: str, values: dict = None
+):
+    # bounded batches so the writer is never held for long on big tables
+    row_id = "rowid" if settings.DATABASE_TYPE == "sqlite" else "ctid"
+    total = 0
+    while True:
+        updated = await database.fetch_all(
+            f"""
+                UPDATE {table} SET {set_clause}
+                WHERE {row_id} IN (SELECT {row_id} FROM {table} WHERE {where_clause} LIMIT :batch_size)
+                RETURNING 1
+            """,
+            {**(values or {}), "batch_size": settings.DATABASE_BACKFILL_BATCH_SIZE},
+        )
+        total += len(updated)
+        if len(updated) < settings.DATABASE_BACKFILL_BATCH_SIZE:
+            return total
+
+        await asyncio.sleep(0)
+
+
+@migration("1.0")
+async def create_base_tables():
+    try:
+        await database.execute(
+            """
+                CREATE TABLE IF NOT EXISTS ongoing_searches (
+                    media_id TEXT PRIMARY KEY,
+                    timestamp INTEGER
+                )
+            """
+        )
+    except asyncpg.exceptions.UniqueViolationError:
+        logger.warning("Table 'ongoing_searches' or related type already exists, ignoring.")
+
+    await database.execute(
+        """
+            CREATE TABLE IF NOT EXISTS first_searches (
+                media_id TEXT PRIMARY KEY,
+                timestamp INTEGER
+            )
+        """
+    )
+
+    await database.execute(
+        """
+            CREATE TABLE IF NOT EXISTS metadata_cache (
+                media_id TEXT PRIMARY KEY,
+                title TEXT,
+                year INTEGER,
+                year_end INTEGER,
+                aliases TEXT,
+                timestamp INTEGER
+            )
+        """
+    )
+
+    await database.execute(
+        """
+            CREATE TABLE IF NOT EXISTS torrents (
+                media_id TEXT,
+                info_hash TEXT,
+                file_index INTEGER,
+                season INTEGER,
+                episode INTEGER,
+                title TEXT,
+                seeders INTEGER,
+                size BIGINT,
+                tracker TEXT,
+                sources TEXT,
+                parsed TEXT,
+                timestamp INTEGER
+            )
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS torrents_series_both_idx
+        ON torrents (media_id, info_hash, season, episode)
+        WHERE season IS NOT NULL AND episode IS NOT NULL
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS torrents_season_only_idx
+        ON torrents (media_id, info_hash, season)
+        WHERE season IS NOT NULL AND episode IS NULL
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS torrents_episode_only_idx
+        ON torrents (media_id, info_hash, episode)
+        WHERE season IS NULL AND episode IS NOT NULL
+        """
+    )
+
+    try:
+        await database.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS torrents_no_season_episode_idx
+            ON torrents (media_id, info_hash)
+            WHERE season IS NULL AND episode IS NULL
+            """
+        )
+    except asyncpg.exceptions.UniqueViolationError:
+        logger.warning("Index 'torrents_no_season_episode_idx' already exists, ignoring.")
+
+    await database.execute(
+        """
+            CREATE TABLE IF NOT EXISTS debrid_availability (
+                debrid_service TEXT,
+                info_hash TEXT,
+                file_index TEXT,
+                title TEXT,
+                season INTEGER,
+                episode INTEGER,
+                size BIGINT,
+                parsed TEXT,
+                timestamp INTEGER
+            )
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS debrid_series_both_idx
+        ON debrid_availability (debrid_service, info_hash, season, episode)
+        WHERE season IS NOT NULL AND episode IS NOT NULL
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS debrid_season_only_idx
+        ON debrid_availability (debrid_service, info_hash, season)
+        WHERE season IS NOT NULL AND episode IS NULL
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS debrid_episode_only_idx
+        ON debrid_availability (debrid_service, info_hash, episode)
+        WHERE season IS NULL AND episode IS NOT NULL
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS debrid_no_season_episode_idx
+        ON debrid_availability (debrid_service, info_hash)
+        WHERE season IS NULL AND episode IS NULL
+        """
+    )
+
+    await database.execute(
+        """
+            CREATE TABLE IF NOT EXISTS download_links_cache (
+                debrid_key TEXT,
+                info_hash TEXT,
+                season INTEGER,
+                episode INTEGER,
+                download_url TEXT,
+                timestamp INTEGER
+            )
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS download_links_series_both_idx
+        ON download_links_cache (debrid_key, info_hash, season, episode)
+        WHERE season IS NOT NULL AND episode IS NOT NULL
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS download_links_season_only_idx
+        ON download_links_cache (debrid_key, info_hash, season)
+        WHERE season IS NOT NULL AND episode IS NULL
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS download_links_episode_only_idx
+        ON download_links_cache (debrid_key, info_hash, episode)
+        WHERE season IS NULL AND episode IS NOT NULL
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS download_links_no_season_episode_idx
+        ON download_links_cache (debrid_key, info_hash)
+        WHERE season IS NULL AND episode IS NULL
+        """
+    )
+
+    await database.execute(
+        """
+            CREATE TABLE IF NOT EXISTS active_connections (
+                id TEXT PRIMARY KEY,
+                ip TEXT,
+                content TEXT,
+                timestamp INTEGER
+            )
+        """
+    )
+
+
+@migration("1.1")
+async def create_stream_cache_tables():
+    # tables used by stream() and playback() that were never created
+    await database.execute(
+        """
+            CREATE TABLE IF NOT EXISTS cache (
+                debridService TEXT,
+                info_hash TEXT,
+                name TEXT,
+                season INTEGER,
+                episode INTEGER,
+                tracker TEXT,
+                data TEXT,
+                timestamp INTEGER
+            )
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE INDEX IF NOT EXISTS cache_lookup_idx
+        ON cache (debridService, name, season, episode)
+        """
+    )
+
+    await database.execute(
+        """
+            CREATE TABLE IF NOT EXISTS download_links (
+                debrid_key TEXT,
+                hash TEXT,
+                file_index TEXT,
+                link TEXT,
+                timestamp INTEGER,
+                PRIMARY KEY (debrid_key, hash, file_index)
+            )
+        """
+    )
+
+
+async def backfill_expires_at():
+    total = 0
+    for table, ttl in expiring_tables.items():
+        total += await backfill_column(
+            table,
+            "expires_at = timestamp + :ttl",
+            "expires_at IS NULL AND timestamp IS NOT NULL",
+            {"ttl": ttl},
+        )
+
+    return total
+
+
+@migration("1.2", backfill=backfill_expires_at)
+async def add_expires_at():
+    # reads and purges compare expires_at directly instead of timestamp + ttl,
+    # which no index can serve
+    for table in expiring_tables:
+        await add_column(table, "expires_at", "BIGINT")
+        await database.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_expires_at_idx ON {table} (expires_at)"
+        )
+
+    await database.execute("DROP INDEX IF EXISTS cache_lookup_idx")
+    await database.execute(
+        """
+        CREATE INDEX IF NOT EXISTS cache_lookup_idx
+        ON cache (debridService, name, season, episode, expires_at)
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE INDEX IF NOT EXISTS torrents_lookup_idx
+        ON torrents (media_id, season, episode, expires_at)
+        """
+    )
+
+    await database.execute(
+        """
+        CREATE INDEX IF NOT EXISTS debrid_lookup_idx
+        ON debrid_availability (debrid_service, info_hash, season, episode, expires_at)
+        """
+    )
+
+
+@migration("1.3")
+async def create_database_leases():
+    # held by one worker of every node sharing the database, whatever the cache backend
+    await database.execute(
+        """
+            CREATE TABLE IF NOT EXISTS database_leases (
+                name TEXT PRIMARY KEY,
+                token TEXT,
+                expires_at BIGINT
+            )
+        """
+    )
+
+
+@migration("1.4")
+async def key_torrents_by_sources():
+    # scraped torrents only answer searches of the same sources, the rows written
+    # before have no sources and are left to expire
+    torrents_indexes = {
+        "torrents_series_both_idx": ("season, episode", "season IS NOT NULL AND episode IS NOT NULL"),
+        "torrents_season_only_idx": ("season", "season IS NOT NULL AND episode IS NULL"),
+        "torrents_episode_only_idx": ("episode", "season IS NULL AND episode IS NOT NULL"),
+        "torrents_no_season_episode_idx": (None, "season IS NULL AND episode IS NULL"),
+    }
+    for index, (columns, where_clause) in torrents_indexes.items():
+        await database.execute(f"DROP INDEX IF EXISTS {index}")
+        await database.execute(
+            f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS {index}
+            ON torrents (media_id, info_hash, sources{f', {columns}' if columns else ''})
+            WHERE {where_clause}
+            """
+        )
+
+    await database.execute("DROP INDEX IF EXISTS torrents_lookup_idx")
+    await database.execute(
+        """
+        CREATE INDEX IF NOT EXISTS torrents_lookup_idx
+        ON torrents (media_id, sources, season, episode, expires_at)
+        """
+    )
+
+
+@migration("1.5")
+async def key_cache_by_torrent():
+    # every search wrote its results again next to the previous ones, keep the
+    # latest row of each torrent before the unique indexes can be created
+    key_columns = ("debridService", "info_hash", "name", "season", "episode")
+    if settings.DATABASE_TYPE == "sqlite":
+        await database.execute(
+            f"""
+                DELETE FROM cache WHERE rowid NOT IN (
+                    SELECT MAX(rowid) FROM cache GROUP BY {', '.join(key_columns)}
+                )
+            """
+        )
+    else:
+        await database.execute(
+            f"""
+                DELETE FROM cache a USING cache b
+                WHERE a.ctid < b.ctid
+                AND {' AND '.join(f'a.{column} IS NOT DISTINCT FROM b.{column}' for column in key_columns)}
+            """
+        )
+
+    cache_indexes = {
+        "cache_series_both_idx": ("season, episode", "season IS NOT NULL AND episode IS NOT NULL"),
+        "cache_season_only_idx": ("season", "season IS NOT NULL AND episode IS NULL"),
+        "cache_episode_only_idx": ("episode", "season IS NULL AND episode IS NOT NULL"),
+        "cache_no_season_episode_idx": (None, "season IS NULL AND episode IS NULL"),
+    }
+    for index, (columns, where_clause) in cache_indexes.items():
+        await database.execute(
+            f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS {index}
+            ON cache (debridService, info_hash, name{f', {columns}' if columns else ''})
+            WHERE {where_clause}
+            """
+        )
+
+
+DATABASE_VERSION = migrations[-1][0]
+
+
+async def run_migrations():
+    await database.execute(
+        """
+            CREATE TABLE IF NOT EXISTS db_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version TEXT
+            )
+        """
+    )
+
+    current_version = await database.fetch_val(
+        """
+            SELECT version FROM db_version WHERE id = 1
+        """
+    )
+    if current_version is not None and parse_version(current_version) > parse_version(
+        DATABASE_VERSION
+    ):
+        logger.warning(
+            f"Database: version {current_version} is newer than {DATABASE_VERSION}, skipping migrations"
+        )
+        return
+
+    for version, migrate, _ in migrations:
+        if current_version is not None and parse_version(version) <= parse_version(
+            current_version
+        ):
+            continue
+
+        logger.log(
+            "COMET",
+            f"Database: Migration from {current_version} to {version} version",
+        )
+
+        await migrate()
+        await database.execute(
+            """
+                INSERT INTO db_version VALUES (1, :version)
+                ON CONFLICT (id) DO UPDATE SET version = :version
+            """,
+            {"version": version},
+        )
+        current_version = version
+
+        logger.log("COMET", f"Database: Migration to version {version} completed")
+
+
+async def run_backfills():
+    lease = await acquire_database_lease("backfill", 3600)
+    if lease is None:  # another worker or node is already backfilling
+        return
+
+    for version, _, backfill in migrations:
+        if backfill is None:
+            continue
+
+        try:
+            updated = await backfill()
+            if updated:
+                logger.log(
+                    "COMET", f"Database: Backfilled {updated} rows for version {version}"
+                )
+        except Exception as e:
+            logger.warning(f"Exception while backfilling version {version}: {e}")
+            logger.exception(traceback.format_exc())
+
+    await release_database_lease("backfill", lease)
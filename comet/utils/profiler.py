@@ -0,0 +1,128 @@
+import asyncio
+import collections
+import sys
+import threading
+import time
+import traceback
+
+from comet.utils.logger import logger
+from comet.utils.metrics import event_loop_blocked, event_loop_lag
+from comet.utils.models import settings
+
+# longest first so site-packages wins over the prefix it lives in
+path_prefixes = sorted(
+    {path.rstrip("/") + "/" for path in sys.path if path}, key=len, reverse=True
+)
+profile_lock = asyncio.Lock()
+
+
+def short_path(filename: str):
+    for prefix in path_prefixes:
+        if filename.startswith(prefix):
+            return filename[len(prefix) :]
+
+    return filename
+
+
+def collapse_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(
+            f"{code.co_name} ({short_path(code.co_filename)}:{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+
+    return ";".join(reversed(stack))
+
+
+def sample_stacks(thread_id: int, duration: float, interval: float):
+    # runs in its own thread, reading the other thread's frames doesn't stop it
+    samples = collections.Counter()
+    end_time = time.monotonic() + duration
+    while time.monotonic() < end_time:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            samples[collapse_stack(frame)] += 1
+        del frame
+
+        time.sleep(interval)
+
+    return samples
+
+
+async def profile_event_loop(duration: float, interval: float):
+    # folded stacks ("frame;frame;frame count"), the input of flamegraph.pl,
+    # inferno, speedscope...
+    samples = await asyncio.to_thread(
+        sample_stacks, threading.get_ident(), duration, interval
+    )
+
+    return "".join(
+        f"{stack} {count}\n" for stack, count in samples.most_common()
+    )
+
+
+class EventLoopMonitor:
+    def __init__(self, threshold: float, interval: float):
+        self.threshold = threshold
+        self.interval = interval
+
+        self.heartbeat = None
+        self.reported = None
+        self.loop_thread = None
+        self.task = None
+        self.watchdog = None
+        self.stopping = threading.Event()
+
+    async def run(self):
+        while True:
+            start_time = time.perf_counter()
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            event_loop_lag.observe(
+                max(time.perf_counter() - start_time - self.interval, 0)
+            )
+
+    def watch(self):
+        # a blocked loop can't report itself, this thread catches it in the act
+        while not self.stopping.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or self.reported == heartbeat:
+                continue
+
+            self.reported = heartbeat
+            event_loop_blocked.inc()
+
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = "".join(traceback.format_stack(frame, limit=8)) if frame else ""
+            del frame
+            logger.warning(
+                f"Event loop blocked for more than {blocked:.2f}s, currently in:\n{stack}"
+            )
+
+    def start(self):
+        if self.threshold <= 0:
+            return
+
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopping.clear()
+        self.task = asyncio.create_task(self.run())
+        self.watchdog = threading.Thread(
+            target=self.watch, name="event-loop-watchdog", daemon=True
+        )
+        self.watchdog.start()
+
+    async def stop(self):
+        if self.task is None:
+            return
+
+        self.stopping.set()
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+
+event_loop_monitor = EventLoopMonitor(settings.EVENT_LOOP_LAG_THRESHOLD, 0.1)
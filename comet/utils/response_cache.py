@@ -0,0 +1,205 @@
+import collections
+import hashlib
+import time
+
+import orjson
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from comet.utils.cache_backend import shared_cache
+from comet.utils.metrics import cache_requests
+from comet.utils.models import settings
+
+
+class StreamResponseCache:
+    # serialized /stream responses built from the torrents cache, so the same
+    # config asking for the same media skips metadata, the cache query and rendering
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+
+    def key(self, b64config: str, base_url: str, type: str, full_id: str):
+        # b64config is in every playback url, digested to not keep debrid keys around
+        return hashlib.sha256(
+            f"{b64config}|{base_url}|{type}|{full_id}".encode()
+        ).digest()
+
+    async def version(self, full_id: str):
+        # bumped once new results for the media are flushed to the database, read
+        # before the cache query so a response never outlives the rows it was built
+        # from. the version lives in shared_cache: with the memory backend a bump
+        # only reaches the worker that flushed the results
+        if self.max_size <= 0:
+            return None
+
+        return await shared_cache.get(f"stream-version:{full_id}") or "0"
+
+    async def invalidate(self, full_id: str):
+        if self.max_size > 0:
+            await shared_cache.incr(f"stream-version:{full_id}", 1, settings.CACHE_TTL)
+
+    def get(self, key: bytes, version: str):
+        # (body, etag, expiration of the results it was built from)
+        if self.max_size <= 0:
+            return None
+
+        entry = self.entries.get(key)
+        if entry is None:
+            cache_requests.inc(cache="stream_response", result="miss")
+            return None
+
+        body, etag, results_expires_at, entry_version, expires_at = entry
+        if entry_version != version or expires_at <= time.time():
+            del self.entries[key]
+            cache_requests.inc(cache="stream_response", result="miss")
+            return None
+
+        self.entries.move_to_end(key)
+        cache_requests.inc(cache="stream_response", result="hit")
+        return body, etag, results_expires_at
+
+    def set(
+        self,
+        key: bytes,
+        version: str,
+        body: bytes,
+        etag: str,
+        results_expires_at: float,
+    ):
+        # the ttl also bounds how long other workers serve old results when the
+        # version isn't shared (memory cache backend)
+        if self.max_size <= 0:
+            return
+
+        expires_at = min(results_expires_at, time.time() + self.ttl)
+        self.entries[key] = (body, etag, results_expires_at, version, expires_at)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+def compute_etag(body: bytes):
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+# the only settings streams are rendered from. the proxy password and default api
+# key change the output too, but only through the warning and render arguments
+# digested with each response, so no secret ends up in a header
+stream_settings = ("PROXY_DEBRID_STREAM", "PROXY_DEBRID_STREAM_DEBRID_DEFAULT_SERVICE")
+
+
+def get_settings_digest(app_settings):
+    return hashlib.sha256(
+        orjson.dumps([getattr(app_settings, name) for name in stream_settings])
+    ).digest()
+
+
+settings_digest = get_settings_digest(settings)
+
+
+def compute_stream_etag(
+    response_key: bytes, leading: list, results, balanced_hashes: dict, *render_args
+):
+    # digest of what the body is rendered from instead of the body itself, so a
+    # streamed response has it before its first byte, and buffered ones get the same
+    digest = hashlib.sha256(settings_digest + response_key)
+    digest.update(orjson.dumps([leading, *render_args]))
+    for positions in balanced_hashes.values():
+        for i in positions:
+            digest.update(results.fingerprint(i))
+
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def etag_matches(request: Request, etag: str):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    # weak comparison, a CDN may have recompressed the body and weakened the tag
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def cache_control(max_age: int, stale_while_revalidate: int = 0):
+    headers = {}
+    if max_age > 0:
+        cache_control = f"public, max-age={max_age}"
+        if stale_while_revalidate > 0:
+            cache_control += f", stale-while-revalidate={stale_while_revalidate}"
+        headers["Cache-Control"] = cache_control
+
+    return headers
+
+
+def stream_cache_control(results_expires_at: float):
+    # never tell a CDN to keep results longer than the torrents cache does
+    max_age = min(
+        settings.STREAM_CACHE_MAX_AGE, int(results_expires_at - time.time())
+    )
+    return cache_control(max_age, settings.STREAM_CACHE_STALE_WHILE_REVALIDATE)
+
+
+def not_modified_response(etag: str, headers: dict):
+    return Response(status_code=304, headers={"ETag": etag, **headers})
+
+
+def json_response(request: Request, body: bytes, etag: str, headers: dict):
+    if etag_matches(request, etag):
+        return not_modified_response(etag, headers)
+
+    return Response(
+        body, media_type="application/json", headers={"ETag": etag, **headers}
+    )
+
+
+def stream_json_response(
+    request: Request, body: bytes, etag: str, results_expires_at: float
+):
+    return json_response(request, body, etag, stream_cache_control(results_expires_at))
+
+
+async def iter_streams_json(streams, on_complete=None):
+    # the bytes of orjson.dumps({"streams": list(streams)}) in ~64KB chunks, each
+    # stream is rendered when its chunk is due; on_complete gets the whole body
+    chunk = bytearray(b'{"streams":[')
+    chunks = [] if on_complete is not None else None
+    separator = b""
+    for stream in streams:
+        chunk += separator
+        chunk += orjson.dumps(stream)
+        separator = b","
+        if len(chunk) >= 65536:
+            data = bytes(chunk)
+            chunk.clear()
+            if chunks is not None:
+                chunks.append(data)
+            yield data
+
+    chunk += b"]}"
+    data = bytes(chunk)
+    if chunks is not None:
+        chunks.append(data)
+    yield data
+
+    if on_complete is not None:
+        on_complete(b"".join(chunks))
+
+
+def streaming_json_response(
+    streams, etag: str, results_expires_at: float, on_complete=None
+):
+    # the etag can't be a digest of the body, see compute_stream_etag
+    return StreamingResponse(
+        iter_streams_json(streams, on_complete),
+        media_type="application/json",
+        headers={"ETag": etag, **stream_cache_control(results_expires_at)},
+    )
+
+
+stream_response_cache = StreamResponseCache(
+    settings.STREAM_RESPONSE_CACHE_SIZE, settings.STREAM_RESPONSE_CACHE_TTL
+)
@@ -0,0 +1,160 @@
+from array import array
+
+import orjson
+import PTT
+from RTN.models import Resolution
+
+FETCH = 1
+DUBBED = 2
+NO_LANGUAGES = 4
+
+language_bits = {
+    code: 1 << i for i, code in enumerate(PTT.parse.LANGUAGES_TRANSLATION_TABLE)
+}
+resolution_names = [resolution.value for resolution in Resolution]
+resolution_codes = {name: code for code, name in enumerate(resolution_names)}
+unknown_resolution = resolution_codes["unknown"]
+
+
+def get_language_mask(languages: list):
+    mask = 0
+    for language in languages:
+        mask |= language_bits.get(language, 0)
+
+    return mask
+
+
+class ResultSet:
+    # ranked results as columns between ranking, caching and get_balanced_hashes,
+    # the per-result dicts are only built for the streams returned and the cache rows
+    def __init__(self):
+        self.hashes = []
+        self.ranks = array("q")
+        self.resolutions = array("B")  # index in resolution_names
+        self.sizes = array("q")
+        self.languages = array("Q")  # language_bits
+        self.flags = array("B")  # FETCH, DUBBED, NO_LANGUAGES
+        self.trackers = array("H")  # index in tracker_names
+        self.tracker_names = []
+        self.tracker_ids = {}
+        self.file_indexes = []
+        self.rows = []  # (RTN Torrent, extra data) after ranking, the cached dict otherwise
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def append(
+        self,
+        hash: str,
+        rank: int,
+        fetch: bool,
+        resolution: str,
+        languages: list,
+        dubbed: bool,
+        size: int,
+        tracker: str,
+        file_index,
+        row,
+    ):
+        tracker_id = self.tracker_ids.get(tracker)
+        if tracker_id is None:
+            tracker_id = self.tracker_ids[tracker] = len(self.tracker_names)
+            self.tracker_names.append(tracker)
+
+        self.hashes.append(hash)
+        self.ranks.append(rank)
+        self.resolutions.append(resolution_codes.get(resolution, unknown_resolution))
+        self.sizes.append(size or 0)
+        self.languages.append(get_language_mask(languages))
+        self.flags.append(
+            (FETCH if fetch else 0)
+            | (DUBBED if dubbed else 0)
+            | (NO_LANGUAGES if len(languages) == 0 else 0)
+        )
+        self.trackers.append(tracker_id)
+        self.file_indexes.append(file_index)
+        self.rows.append(row)
+
+    @classmethod
+    def from_ranked(cls, sorted_ranked_files: dict, files: dict, torrents_by_hash: dict):
+        results = cls()
+        for hash, torrent in sorted_ranked_files.items():
+            file = files[hash]
+            scraped = torrents_by_hash[hash]
+            extra_data = {
+                "title": file["title"],
+                "torrent_title": scraped["Title"],
+                "tracker": scraped["Tracker"],
+                "size": file["size"],
+                "torrent_size": scraped["Size"] if scraped["Size"] else file["size"],
+                "index": file["index"],
+            }
+            data = torrent.data
+            results.append(
+                hash,
+                torrent.rank,
+                torrent.fetch,
+                data.resolution,
+                data.languages,
+                data.dubbed,
+                file["size"],
+                scraped["Tracker"],
+                file["index"],
+                (torrent, extra_data),
+            )
+
+        return results
+
+    @classmethod
+    def from_cached(cls, cached_files: dict):
+        results = cls()
+        for hash, torrent in cached_files.items():
+            data = torrent["data"]
+            results.append(
+                hash,
+                torrent["rank"],
+                torrent["fetch"],
+                data["resolution"],
+                data["languages"],
+                data["dubbed"],
+                data["size"],
+                data["tracker"],
+                data["index"],
+                torrent,
+            )
+
+        return results
+
+    def tracker(self, i: int):
+        return self.tracker_names[self.trackers[i]]
+
+    def torrent(self, i: int):
+        row = self.rows[i]
+        if isinstance(row, dict):
+            return row
+
+        torrent, extra_data = row
+        torrent = torrent.model_dump()
+        torrent["data"].update(extra_data)
+        return torrent
+
+    def fingerprint(self, i: int):
+        # changes whenever what is rendered for the result can
+        row = self.rows[i]
+        if isinstance(row, dict):
+            return orjson.dumps(row)
+
+        torrent, extra_data = row
+        return orjson.dumps(
+            [torrent.infohash, torrent.raw_title, torrent.rank, torrent.fetch, extra_data]
+        )
+
+    def data(self, i: int):
+        row = self.rows[i]
+        if isinstance(row, dict):
+            return row["data"]
+
+        torrent, extra_data = row
+        data = torrent.data.model_dump()
+        data.update(extra_data)
+        return data
@@ -0,0 +1,190 @@
+import asyncio
+import contextlib
+import sqlite3
+import time
+
+import aiosqlite
+
+# applied on every connection, SQLite PRAGMAs are per connection
+connection_pragmas = [
+    "PRAGMA busy_timeout=30000",  # 30 seconds timeout
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=30000000000",
+    "PRAGMA cache_size=-2000",
+    "PRAGMA foreign_keys=OFF",
+    "PRAGMA secure_delete=OFF",
+]
+writer_pragmas = [
+    "PRAGMA auto_vacuum=INCREMENTAL",  # new databases only
+    "PRAGMA page_size=4096",  # new databases only
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=OFF",
+]
+reader_pragmas = ["PRAGMA query_only=ON"]
+
+
+def dict_factory(cursor: sqlite3.Cursor, row: tuple):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class SQLiteDatabase:
+    # same interface as databases.Database for what Comet uses: reads run on a
+    # pool of read-only connections, writes are serialized on a single writer
+    def __init__(self, path: str, read_connections: int):
+        self.url = f"sqlite:///{path}"
+        self.path = path
+        self.read_connections = read_connections
+        self.is_connected = False
+
+        self.writer = None
+        self.readers = None
+        self.write_lock = None
+        # the task holding the writer, a context variable would also be inherited by
+        # the tasks it spawns, which then write without the lock
+        self.writer_owner = None
+
+        self.stats = {
+            "reads": 0,
+            "writes": 0,
+            "reader_wait": 0.0,
+            "writer_wait": 0.0,
+            "max_writer_wait": 0.0,
+            "busy_errors": 0,
+        }
+
+    async def open_connection(self, uri: str, pragmas: list):
+        connection = await aiosqlite.connect(uri, uri=True, isolation_level=None)
+        connection.row_factory = dict_factory
+        for pragma in pragmas:
+            await connection.execute(pragma)
+
+        return connection
+
+    async def connect(self):
+        # the writer goes first so WAL is enabled before readers open the file
+        self.writer = await self.open_connection(
+            f"file:{self.path}", writer_pragmas + connection_pragmas
+        )
+        self.readers = asyncio.Queue()
+        for _ in range(self.read_connections):
+            self.readers.put_nowait(
+                await self.open_connection(
+                    f"file:{self.path}?mode=ro", connection_pragmas + reader_pragmas
+                )
+            )
+
+        self.write_lock = asyncio.Lock()
+        self.is_connected = True
+
+    async def disconnect(self):
+        self.is_connected = False
+        while not self.readers.empty():
+            await self.readers.get_nowait().close()
+        await self.writer.close()
+
+    def holds_writer(self):
+        owner = self.writer_owner
+        return owner is not None and owner is asyncio.current_task()
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        if self.holds_writer():  # reentrant inside transaction()
+            yield self.writer
+            return
+
+        start_time = time.perf_counter()
+        async with self.write_lock:
+            wait = time.perf_counter() - start_time
+            self.stats["writer_wait"] += wait
+            self.stats["max_writer_wait"] = max(self.stats["max_writer_wait"], wait)
+
+            self.writer_owner = asyncio.current_task()
+            try:
+                yield self.writer
+            finally:
+                self.writer_owner = None
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        if self.holds_writer():  # see the uncommitted writes of the transaction
+            yield self.writer
+            return
+
+        start_time = time.perf_counter()
+        connection = await self.readers.get()
+        self.stats["reader_wait"] += time.perf_counter() - start_time
+        try:
+            yield connection
+        finally:
+            self.readers.put_nowait(connection)
+
+    def connection_for(self, query: str):
+        if query.lstrip()[:6].upper() == "SELECT":
+            self.stats["reads"] += 1
+            return self.read()
+
+        self.stats["writes"] += 1
+        return self.write()
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        if self.holds_writer():
+            yield
+            return
+
+        async with self.write() as connection:
+            await connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                await connection.execute("ROLLBACK")
+                raise
+
+            await connection.execute("COMMIT")
+
+    async def run(self, query: str, values: dict, fetch):
+        try:
+            async with self.connection_for(query) as connection:
+                async with connection.execute(query, values or {}) as cursor:
+                    return await fetch(cursor)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e):
+                self.stats["busy_errors"] += 1
+            raise
+
+    async def execute(self, query: str, values: dict = None):
+        async def lastrowid(cursor):
+            return cursor.lastrowid
+
+        return await self.run(query, values, lastrowid)
+
+    async def execute_many(self, query: str, values: list):
+        async with self.write() as connection:
+            await connection.executemany(query, values)
+
+    async def fetch_all(self, query: str, values: dict = None):
+        async def fetch(cursor):
+            return await cursor.fetchall()
+
+        return await self.run(query, values, fetch)
+
+    async def fetch_one(self, query: str, values: dict = None):
+        async def fetch(cursor):
+            return await cursor.fetchone()
+
+        return await self.run(query, values, fetch)
+
+    async def fetch_val(self, query: str, values: dict = None, column: int = 0):
+        row = await self.fetch_one(query, values)
+        if row is None:
+            return None
+
+        return list(row.values())[column]
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "read_connections": self.read_connections,
+            "idle_readers": self.readers.qsize() if self.readers else 0,
+            "writer_locked": bool(self.write_lock and self.write_lock.locked()),
+        }
@@ -0,0 +1,282 @@
+import asyncio
+import collections
+import contextvars
+import os
+import time
+
+import aiohttp
+import orjson
+
+from comet.utils.logger import logger
+from comet.utils.metrics import stream_stage_seconds
+from comet.utils.models import settings
+
+current_span = contextvars.ContextVar("current_span", default=None)
+slow_requests = collections.deque(maxlen=settings.TRACING_SLOW_REQUEST_BUFFER)
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+
+
+class Span:
+    # always measures its duration (and feeds the histogram if any), only records
+    # itself in a trace when started under a traced request
+    def __init__(self, name: str, histogram=None, parent=None, **attributes):
+        self.name = name
+        self.histogram = histogram
+        self.labels = attributes
+        self.attributes = attributes.copy()
+        self.error = None
+        self.start_time = time.perf_counter()
+        self.end_time = None
+
+        self.parent = parent
+        self.trace = None
+        if parent is not None:
+            self.trace = parent.trace
+            self.trace.spans.append(self)
+            self.span_id = os.urandom(8).hex()
+            self.start_unix_nano = time.time_ns()
+            current_span.set(self)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error):
+        self.error = str(error)
+
+    def end(self):
+        if self.end_time is not None:
+            return
+
+        self.end_time = time.perf_counter()
+        if self.histogram is not None:
+            self.histogram.observe(self.end_time - self.start_time, **self.labels)
+
+        if self.trace is not None and current_span.get() is self:
+            current_span.set(self.parent)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc is not None:
+            self.fail(exc)
+        self.end()
+
+    @property
+    def duration(self):
+        return (self.end_time or time.perf_counter()) - self.start_time
+
+
+def start_span(name: str, histogram=None, **attributes):
+    return Span(name, histogram, current_span.get(), **attributes)
+
+
+def start_stage(stage: str):
+    return start_span(stage, stream_stage_seconds, stage=stage)
+
+
+def start_trace(name: str, **attributes):
+    root = Span(name, **attributes)
+    root.trace = Trace()
+    root.trace.spans.append(root)
+    root.span_id = os.urandom(8).hex()
+    root.start_unix_nano = time.time_ns()
+    current_span.set(root)
+    return root
+
+
+def finish_trace(root: Span, duration: float):
+    root.end()
+    for span in root.trace.spans:  # early returns leave some stages open
+        if span.end_time is None:
+            span.end_time = root.end_time
+
+    if duration >= settings.TRACING_SLOW_REQUEST_THRESHOLD:
+        slow_requests.append(span_tree(root))
+
+    trace_exporter.enqueue(root.trace)
+
+
+def span_tree(root: Span):
+    children = collections.defaultdict(list)
+    for span in root.trace.spans:
+        if span.parent is not None:
+            children[span.parent.span_id].append(span)
+
+    def node(span: Span):
+        return {
+            "name": span.name,
+            "start": round((span.start_time - root.start_time) * 1000, 3),  # ms
+            "duration": round(span.duration * 1000, 3),  # ms
+            "attributes": span.attributes,
+            "error": span.error,
+            "children": [node(child) for child in children[span.span_id]],
+        }
+
+    return {
+        "trace_id": root.trace.trace_id,
+        "timestamp": root.start_unix_nano // 1_000_000_000,
+        **node(root),
+    }
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_span(trace: Trace, span: Span):
+    otlp = {
+        "traceId": trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 2 if span.parent is None else 1,  # SERVER for the request, INTERNAL below
+        "startTimeUnixNano": str(span.start_unix_nano),
+        "endTimeUnixNano": str(span.start_unix_nano + int(span.duration * 1e9)),
+        "attributes": [
+            {"key": key, "value": otlp_value(value)}
+            for key, value in span.attributes.items()
+            if value is not None
+        ],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent is not None:
+        otlp["parentSpanId"] = span.parent.span_id
+
+    return otlp
+
+
+def otlp_traces(traces: list):
+    # OTLP/JSON ExportTraceServiceRequest, accepted by any OpenTelemetry collector
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": "comet"}},
+                        {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "comet"},
+                        "spans": [
+                            otlp_span(trace, span)
+                            for trace in traces
+                            for span in trace.spans
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+class TraceExporter:
+    def __init__(self, file: str, collector_url: str, interval: float):
+        self.file = file
+        self.collector_url = collector_url
+        self.interval = interval
+        self.enabled = bool(file or collector_url)
+
+        self.pending = []
+        self.task = None
+
+    def enqueue(self, trace: Trace):
+        if self.enabled and len(self.pending) < 10000:
+            self.pending.append(trace)
+
+    def write_file(self, payload: bytes):
+        with open(self.file, "ab") as file:
+            file.write(payload + b"\n")
+
+    async def flush(self, session: aiohttp.ClientSession):
+        if len(self.pending) == 0:
+            return
+
+        traces = self.pending
+        self.pending = []
+        payload = orjson.dumps(otlp_traces(traces))
+        try:
+            if self.file:
+                await asyncio.to_thread(self.write_file, payload)
+
+            if self.collector_url:
+                async with session.post(
+                    self.collector_url,
+                    data=payload,
+                    headers={"Content-Type": "application/json"},
+                    timeout=aiohttp.ClientTimeout(total=10),
+                ):
+                    pass
+        except Exception as e:
+            logger.warning(f"Exception while exporting {len(traces)} traces: {e}")
+
+    async def run(self):
+        async with aiohttp.ClientSession(raise_for_status=True) as session:
+            try:
+                while True:
+                    await asyncio.sleep(self.interval)
+                    await self.flush(session)
+            except asyncio.CancelledError:
+                await self.flush(session)
+
+    def start(self):
+        if self.enabled and settings.TRACING_ENABLED:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+
+trace_exporter = TraceExporter(
+    settings.TRACING_EXPORT_FILE,
+    settings.TRACING_COLLECTOR_URL,
+    settings.TRACING_EXPORT_INTERVAL,
+)
+
+
+async def on_request_start(session, context, params):
+    # query strings are left out, they carry API keys
+    context.span = start_span(
+        f"HTTP {params.method}",
+        **{"http.method": params.method, "http.url": str(params.url.with_query(None))},
+    )
+
+
+async def on_request_end(session, context, params):
+    context.span.set(**{"http.status_code": params.response.status})
+    context.span.end()
+
+
+async def on_request_exception(session, context, params):
+    context.span.fail(params.exception)
+    context.span.end()
+
+
+def create_http_trace_configs():
+    # spans for every aiohttp request of a session: indexers, Zilean, metadata, debrid APIs
+    if not settings.TRACING_ENABLED:
+        return []
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return [trace_config]
+
+
+http_trace_configs = create_http_trace_configs()
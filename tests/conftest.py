@@ -0,0 +1,31 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+# settings and the database are created when comet is first imported
+os.environ["DATABASE_TYPE"] = "sqlite"
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "comet.db")
+os.environ["CACHE_BACKEND"] = "memory"
+
+
+@pytest.fixture
+def with_database():
+    # runs an async test against the migrated temporary database
+    from comet.utils.cache_writer import cache_writer
+    from comet.utils.db import setup_database, teardown_database
+
+    def run(test):
+        async def run_test():
+            await setup_database()
+            cache_writer.start()
+            try:
+                await test()
+            finally:
+                await cache_writer.stop()
+                await teardown_database()
+
+        asyncio.run(run_test())
+
+    return run
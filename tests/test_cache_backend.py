@@ -0,0 +1,124 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from comet.utils.cache_backend import MemoryCacheBackend, RedisCacheBackend
+
+
+async def create_backend(name: str):
+    if name == "memory":
+        return MemoryCacheBackend()
+
+    # a local stand-in speaking the Redis protocol, Lua scripts included
+    backend = RedisCacheBackend("redis://localhost")
+    backend.client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    return backend
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request):
+    def run(test):
+        async def run_test():
+            backend = await create_backend(request.param)
+            try:
+                await test(backend)
+            finally:
+                await backend.close()
+
+        asyncio.run(run_test())
+
+    return run
+
+
+def test_get_set_delete(backend):
+    async def test(cache):
+        assert await cache.get("key") is None
+
+        await cache.set("key", "value")
+        assert await cache.get("key") == "value"
+
+        await cache.set("key", "other")
+        assert await cache.get("key") == "other"
+
+        await cache.delete("key")
+        assert await cache.get("key") is None
+
+    backend(test)
+
+
+def test_ttl(backend):
+    async def test(cache):
+        await cache.set("expiring", "value", 1)
+        await cache.set("kept", "value")
+        assert await cache.get("expiring") == "value"
+
+        await asyncio.sleep(1.1)
+        assert await cache.get("expiring") is None
+        assert await cache.get("kept") == "value"
+
+    backend(test)
+
+
+def test_incr(backend):
+    async def test(cache):
+        assert await cache.incr("counter") == 1
+        assert await cache.incr("counter", 2) == 3
+        assert await cache.incr("counter", -1, 60) == 2
+        assert int(await cache.get("counter")) == 2
+
+        assert await cache.incr("expiring", 1, 1) == 1
+        await asyncio.sleep(1.1)
+        assert await cache.get("expiring") is None
+
+    backend(test)
+
+
+def test_set_if_absent(backend):
+    async def test(cache):
+        assert await cache.set_if_absent("key", "first", 60)
+        assert not await cache.set_if_absent("key", "second", 60)
+        assert await cache.get("key") == "first"
+
+        # an expired value is absent again
+        assert await cache.set_if_absent("expiring", "first", 1)
+        await asyncio.sleep(1.1)
+        assert await cache.set_if_absent("expiring", "second", 60)
+        assert await cache.get("expiring") == "second"
+
+    backend(test)
+
+
+def test_delete_if_equal(backend):
+    async def test(cache):
+        await cache.set("key", "value")
+        await cache.delete_if_equal("key", "other")
+        assert await cache.get("key") == "value"
+
+        await cache.delete_if_equal("key", "value")
+        assert await cache.get("key") is None
+
+        await cache.delete_if_equal("missing", "value")
+        assert await cache.get("missing") is None
+
+    backend(test)
+
+
+def test_leases(backend):
+    async def test(cache):
+        lease = await cache.acquire_lease("search", 60)
+        assert lease is not None
+        assert await cache.is_leased("search")
+        assert await cache.acquire_lease("search", 60) is None
+
+        # only the holder's token releases it
+        await cache.release_lease("search", "not-the-holder")
+        assert await cache.is_leased("search")
+        await cache.release_lease("search", None)
+        assert await cache.is_leased("search")
+
+        await cache.release_lease("search", lease)
+        assert not await cache.is_leased("search")
+        assert await cache.acquire_lease("search", 60) is not None
+
+    backend(test)
@@ -0,0 +1,23 @@
+from comet.utils.maintenance import acquire_database_lease, release_database_lease
+
+
+def test_database_lease_has_a_single_holder(with_database):
+    async def test():
+        lease = await acquire_database_lease("test", 60)
+        assert lease is not None
+
+        # another worker, with its own memory cache backend, sees the same row
+        assert await acquire_database_lease("test", 60) is None
+
+        await release_database_lease("test", lease)
+        assert await acquire_database_lease("test", 60) is not None
+
+    with_database(test)
+
+
+def test_expired_database_lease_is_taken_over(with_database):
+    async def test():
+        assert await acquire_database_lease("expired", 0) is not None
+        assert await acquire_database_lease("expired", 60) is not None
+
+    with_database(test)
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+import comet.debrid.base
+from comet.debrid.premiumize import Premiumize
+
+
+class Response:
+    def __init__(self, data: dict):
+        self.data = data
+
+    async def json(self):
+        return self.data
+
+
+class Session:
+    # answers cache/check with the files given as {hash: (filename, filesize) or None}
+    def __init__(self, files: dict):
+        self.files = files
+        self.urls = []
+
+    async def get(self, url: str, **kwargs):
+        self.urls.append(url)
+        hashes = [item.split("&")[0] for item in url.split("items[]=")[1:]]
+        files = [self.files.get(hash) for hash in hashes]
+        return Response(
+            {
+                "status": "success",
+                "response": [file is not None for file in files],
+                "filename": [file[0] if file else None for file in files],
+                "filesize": [file[1] if file else None for file in files],
+            }
+        )
+
+
+@pytest.fixture
+def cached(monkeypatch):
+    # no availability known yet, rows that would be cached are collected
+    rows = []
+
+    async def get_cached_availability(debrid_service, info_hashes, season, episode):
+        return {}
+
+    async def cache_availability(debrid_service, availability):
+        rows.extend(availability)
+
+    monkeypatch.setattr(comet.debrid.base, "get_cached_availability", get_cached_availability)
+    monkeypatch.setattr(comet.debrid.base, "cache_availability", cache_availability)
+    return rows
+
+
+def get_files(files: dict, type: str, season=None, episode=None):
+    premiumize = Premiumize(Session(files), "key")
+    return asyncio.run(
+        premiumize.get_files(list(files), type, season, episode, False)
+    )
+
+
+def test_movie_files_are_filtered_like_other_services(cached):
+    files = get_files(
+        {
+            "a" * 40: ("Movie.2020.1080p.WEB.mkv", 2000),
+            "b" * 40: ("Movie.2020.1080p.WEB.nfo", 10),  # kept before the shared filter
+            "c" * 40: ("Movie.2020.1080p.WEB.Sample.mkv", 50),
+            "d" * 40: None,
+            "e" * 40: ("Movie.2020.720p.WEB.mkv", 0),
+        },
+        "movie",
+    )
+
+    assert files == {
+        "a" * 40: {"index": 0, "title": "Movie.2020.1080p.WEB.mkv", "size": 2000}
+    }
+    # not cached and filtered hashes are remembered as unavailable
+    assert sorted(row[0] for row in cached if row[3] is None) == [
+        "b" * 40,
+        "c" * 40,
+        "d" * 40,
+        "e" * 40,
+    ]
+
+
+def test_episode_files_are_filtered_like_other_services(cached):
+    files = get_files(
+        {
+            "a" * 40: ("Show.S01E02.1080p.WEB.mkv", 1000),
+            "b" * 40: ("Show.S01E02.1080p.WEB.srt", 1),
+            "c" * 40: ("Show.S01E02.1080p.WEB.sample.mkv", 20),
+            "d" * 40: ("Show.S01E03.1080p.WEB.mkv", 1000),
+        },
+        "series",
+        1,
+        2,
+    )
+
+    assert files == {
+        "a" * 40: {"index": "1|2", "title": "Show.S01E02.1080p.WEB.mkv", "size": 1000}
+    }
@@ -0,0 +1,41 @@
+from comet.utils.cache_writer import cache_writer
+from comet.utils.general import add_torrent_to_cache
+from comet.utils.response_cache import stream_response_cache
+from comet.utils.results import ResultSet
+
+config = {"indexers": [], "debridService": "realdebrid"}
+
+
+def cached_results():
+    return ResultSet.from_cached(
+        {
+            "a" * 40: {
+                "infohash": "a" * 40,
+                "rank": 100,
+                "fetch": True,
+                "data": {
+                    "title": "Movie.2020.1080p.WEB.mkv",
+                    "resolution": "1080p",
+                    "languages": ["en"],
+                    "dubbed": False,
+                    "size": 2000,
+                    "tracker": "YTS",
+                    "index": 0,
+                },
+            }
+        }
+    )
+
+
+def test_stream_responses_are_invalidated_once_results_are_flushed(with_database):
+    async def test():
+        version = await stream_response_cache.version("tt2")
+        await add_torrent_to_cache(config, "Movie", None, None, cached_results(), "tt2")
+
+        # a response rendered now still reads the old rows and may be cached
+        assert await stream_response_cache.version("tt2") == version
+
+        await cache_writer.flush()
+        assert await stream_response_cache.version("tt2") != version
+
+    with_database(test)
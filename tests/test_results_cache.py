@@ -0,0 +1,77 @@
+import pytest
+
+from comet.utils.cache_writer import cache_writer
+from comet.utils.general import add_torrent_to_cache
+from comet.utils.migrations import key_cache_by_torrent
+from comet.utils.models import database, rtn, settings
+from comet.utils.results import ResultSet
+
+config = {"debridService": "torbox", "indexers": ["yts"]}
+torrents = {
+    info_hash: {"Title": title, "Tracker": "YTS", "Size": 2000}
+    for info_hash, title in (
+        ("a" * 40, "Movie.2020.1080p.WEB.x264"),
+        ("b" * 40, "Movie.2020.720p.WEB.x264"),
+    )
+}
+
+
+def results():
+    ranked_files = {
+        info_hash: rtn.rank(torrent["Title"], info_hash, remove_trash=False)
+        for info_hash, torrent in torrents.items()
+    }
+    files = {
+        info_hash: {"title": f"{torrent['Title']}.mkv", "size": 2000, "index": "1"}
+        for info_hash, torrent in torrents.items()
+    }
+    return ResultSet.from_ranked(ranked_files, files, torrents)
+
+
+async def cache_rows(name: str):
+    return await database.fetch_val(
+        "SELECT COUNT(*) FROM cache WHERE name = :name", {"name": name}
+    )
+
+
+@pytest.fixture(autouse=True)
+def indexers(monkeypatch):
+    monkeypatch.setattr(settings, "INDEXER_MANAGER_TYPE", "jackett")
+    monkeypatch.setattr(settings, "ZILEAN_URL", None)
+    monkeypatch.setattr(settings, "SCRAPE_TORRENTIO", False)
+    monkeypatch.setattr(settings, "SCRAPE_MEDIAFUSION", False)
+
+
+@pytest.mark.parametrize(
+    "name, season, episode",
+    [("Repeated Movie", None, None), ("Repeated Series", 1, 2)],
+)
+def test_repeated_searches_keep_one_row_per_torrent(name, season, episode, with_database):
+    async def test():
+        for _ in range(3):
+            await add_torrent_to_cache(config, name, season, episode, results(), "tt1")
+            await cache_writer.flush()
+
+        # both torrents and the searched marker of the indexer
+        assert await cache_rows(name) == 3
+
+    with_database(test)
+
+
+def test_migration_removes_duplicate_rows(with_database):
+    async def test():
+        name = "Migrated Show"
+        await add_torrent_to_cache(config, name, 1, None, results(), "tt2")
+        await cache_writer.flush()
+
+        # a database from before the unique indexes
+        await database.execute("DROP INDEX cache_season_only_idx")
+        await database.execute(
+            "INSERT INTO cache SELECT * FROM cache WHERE name = :name", {"name": name}
+        )
+        assert await cache_rows(name) == 6
+
+        await key_cache_by_torrent()
+        assert await cache_rows(name) == 3
+
+    with_database(test)
@@ -0,0 +1,45 @@
+import asyncio
+import contextlib
+import os
+import tempfile
+
+import pytest
+
+from comet.utils.sqlite import SQLiteDatabase
+
+
+async def values(database: SQLiteDatabase):
+    rows = await database.fetch_all("SELECT value FROM writes")
+    return [row["value"] for row in rows]
+
+
+@pytest.mark.parametrize("rollback", [False, True])
+def test_child_task_waits_for_the_transaction(rollback):
+    async def test():
+        database = SQLiteDatabase(os.path.join(tempfile.mkdtemp(), "comet.db"), 2)
+        await database.connect()
+        try:
+            await database.execute("CREATE TABLE writes (value TEXT)")
+
+            child = None
+            with contextlib.suppress(RuntimeError):
+                async with database.transaction():
+                    await database.execute("INSERT INTO writes VALUES ('parent')")
+                    child = asyncio.create_task(
+                        database.execute("INSERT INTO writes VALUES ('child')")
+                    )
+                    await asyncio.sleep(0.1)
+
+                    # the child isn't part of the transaction, it waits for the writer
+                    assert not child.done()
+                    if rollback:
+                        raise RuntimeError
+
+            await child
+            assert await values(database) == (
+                ["child"] if rollback else ["parent", "child"]
+            )
+        finally:
+            await database.disconnect()
+
+    asyncio.run(test())
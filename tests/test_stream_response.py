@@ -0,0 +1,188 @@
+import asyncio
+import base64
+import time
+
+import orjson
+import pytest
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from RTN import parse
+
+from comet.api.stream import (
+    render_cached_streams,
+    render_ranked_streams,
+    stream_results_response,
+)
+from comet.utils.general import config_check, get_balanced_hashes
+from comet.utils import response_cache
+from comet.utils.models import AppSettings, rtn, settings
+from comet.utils.response_cache import compute_stream_etag, get_settings_digest
+from comet.utils.results import ResultSet
+
+b64config = base64.b64encode(
+    orjson.dumps({"debridService": "torbox", "debridApiKey": "key"})
+).decode()
+playback_url = f"http://comet/{b64config}/playback"
+response_key = b"key"
+warning = {
+    "name": "[⚠️] Comet",
+    "description": "Debrid Stream Proxy Password incorrect.\nStreams will not be proxied.",
+    "url": "https://comet.fast",
+}
+
+# enough results for the streamed body to span several chunks
+titles = [
+    f"Silent.Harbor.2010.{resolution}.{source}.x264-GROUP{i}"
+    for i in range(20)
+    for resolution in ("2160p", "1080p", "720p", "480p")
+    for source in ("WEB-DL", "BluRay")
+]
+torrents = {
+    f"{i:040x}": {"Title": title, "Tracker": "YTS", "Size": 2000 + i}
+    for i, title in enumerate(titles)
+}
+files = {
+    hash: {"title": f"{torrent['Title']}.mkv", "size": torrent["Size"], "index": "1"}
+    for hash, torrent in torrents.items()
+}
+
+
+def ranked_results():
+    ranked_files = {
+        hash: rtn.rank(torrent["Title"], hash, remove_trash=False)
+        for hash, torrent in torrents.items()
+    }
+    return ResultSet.from_ranked(ranked_files, files, torrents)
+
+
+def cached_results():
+    rows = {}
+    for hash, torrent in torrents.items():
+        data = parse(torrent["Title"]).model_dump()
+        data.update(
+            title=files[hash]["title"],
+            torrent_title=torrent["Title"],
+            tracker=torrent["Tracker"],
+            size=torrent["Size"],
+            torrent_size=torrent["Size"],
+            index="1",
+        )
+        rows[hash] = {"infohash": hash, "rank": 100, "fetch": True, "data": data}
+
+    return ResultSet.from_cached(rows)
+
+
+renderers = {
+    "cached": (
+        cached_results,
+        lambda *args: render_cached_streams(*args, playback_url, "TB", "⚡"),
+    ),
+    "ranked": (
+        ranked_results,
+        lambda *args: render_ranked_streams(*args, playback_url, "TB"),
+    ),
+}
+
+
+def make_request(headers: dict = {}):
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/stream",
+            "headers": [
+                (name.encode(), value.encode()) for name, value in headers.items()
+            ],
+        }
+    )
+
+
+async def read_body(response):
+    if isinstance(response, StreamingResponse):
+        return b"".join([chunk async for chunk in response.body_iterator])
+
+    return response.body
+
+
+def render(renderer: str, headers: dict = {}):
+    # what stream() does once the results are known
+    results_factory, render_streams = renderers[renderer]
+    results = results_factory()  # format_title changes the rows it renders
+    config = config_check(b64config)
+    balanced_hashes = get_balanced_hashes(results, config)
+    completed = []
+    response = stream_results_response(
+        make_request(headers),
+        [warning],
+        render_streams(results, balanced_hashes, config),
+        balanced_hashes,
+        compute_stream_etag(response_key, [warning], results, balanced_hashes, "TB"),
+        time.time() + 86400,
+        completed.append,
+    )
+    body = asyncio.run(read_body(response))
+    return response, body, completed
+
+
+def stream_headers(response):
+    return {
+        name: response.headers.get(name)
+        for name in ("etag", "cache-control", "content-type")
+    }
+
+
+@pytest.mark.parametrize("renderer", renderers)
+def test_streamed_and_buffered_responses_are_identical(renderer, monkeypatch):
+    count = len(titles)
+
+    monkeypatch.setattr(settings, "STREAMING_RESPONSE_MIN_RESULTS", count + 1)
+    buffered, buffered_body, buffered_completed = render(renderer)
+
+    monkeypatch.setattr(settings, "STREAMING_RESPONSE_MIN_RESULTS", count)
+    streamed, streamed_body, streamed_completed = render(renderer)
+
+    assert not isinstance(buffered, StreamingResponse)
+    assert isinstance(streamed, StreamingResponse)
+    assert len(streamed_body) > 65536
+
+    assert streamed_body == buffered_body
+    assert len(orjson.loads(buffered_body)["streams"]) == count + 1
+    assert stream_headers(streamed) == stream_headers(buffered)
+    assert buffered.headers["etag"]
+    assert buffered.headers["cache-control"].startswith("public, max-age=")
+
+    # what the response cache keeps is the body that was sent
+    assert streamed_completed == buffered_completed == [buffered_body]
+
+
+@pytest.mark.parametrize("renderer", renderers)
+@pytest.mark.parametrize("min_results", [0, 1])
+def test_revalidation_is_not_modified_in_both_modes(renderer, min_results, monkeypatch):
+    monkeypatch.setattr(settings, "STREAMING_RESPONSE_MIN_RESULTS", min_results)
+    response, _, _ = render(renderer)
+
+    not_modified, body, completed = render(
+        renderer, {"if-none-match": response.headers["etag"]}
+    )
+    assert not_modified.status_code == 304
+    assert body == b""
+    assert completed == []
+    assert stream_headers(not_modified)["etag"] == response.headers["etag"]
+
+
+def test_etag_only_depends_on_stream_settings(monkeypatch):
+    def etag(**overrides):
+        digest = get_settings_digest(AppSettings(**overrides))
+        monkeypatch.setattr(response_cache, "settings_digest", digest)
+        response, _, _ = render("cached")
+        return response.headers["etag"]
+
+    # secrets and settings the streams aren't rendered from, e.g. the random
+    # dashboard password every worker generates, keep the etag the same
+    assert etag(DASHBOARD_ADMIN_PASSWORD="first", DATABASE_PATH="first.db") == etag(
+        DASHBOARD_ADMIN_PASSWORD="second",
+        DATABASE_PATH="second.db",
+        PROXY_DEBRID_STREAM_PASSWORD="second",
+        PROXY_DEBRID_STREAM_DEBRID_DEFAULT_APIKEY="second",
+    )
+    assert etag(PROXY_DEBRID_STREAM=False) != etag(PROXY_DEBRID_STREAM=True)
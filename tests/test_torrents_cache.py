@@ -0,0 +1,101 @@
+import pytest
+
+from comet.utils.cache_writer import cache_writer
+from comet.utils.general import (
+    cache_torrents,
+    get_cached_torrents,
+    get_search_id,
+    get_search_indexers,
+    get_search_sources,
+    get_season_packs,
+)
+from comet.utils.models import settings
+
+def make_torrent(title: str, info_hash: str, tracker: str):
+    return {
+        "Title": title,
+        "InfoHash": info_hash,
+        "Size": 2000,
+        "Tracker": tracker,
+        "Seeders": 10,
+    }
+
+
+torrent = make_torrent("Movie.2020.1080p.WEB.x264", "a" * 40, "YTS")
+
+
+def search(media_id: str, indexers: list):
+    # (search_id, sources) of a config searching these indexers
+    indexers = get_search_indexers({"indexers": indexers})
+    return get_search_id(media_id, indexers), get_search_sources(indexers)
+
+
+def info_hashes(torrents: list):
+    return sorted(torrent["InfoHash"] for torrent in torrents)
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    # only the user's indexers are searched
+    monkeypatch.setattr(settings, "INDEXER_MANAGER_TYPE", "jackett")
+    monkeypatch.setattr(settings, "ZILEAN_URL", None)
+    monkeypatch.setattr(settings, "SCRAPE_TORRENTIO", False)
+    monkeypatch.setattr(settings, "SCRAPE_MEDIAFUSION", False)
+
+
+def test_scrapes_are_not_shared_between_disjoint_indexers(sources, with_database):
+    search_a = search("tt1", ["yts"])
+    search_b = search("tt1", ["nyaa"])
+
+    async def test():
+        await cache_torrents("tt1", *search_a, None, None, [torrent])
+        await cache_writer.flush()
+
+        cached = await get_cached_torrents("tt1", *search_a, None, None)
+        assert info_hashes(cached) == ["a" * 40]
+
+        # the second config never searched its own indexers, it has to scrape them
+        assert await get_cached_torrents("tt1", *search_b, None, None) is None
+
+    with_database(test)
+
+
+def test_configs_only_get_torrents_of_their_own_sources(sources, with_database):
+    search_a = search("tt2", ["yts"])
+    search_b = search("tt2", ["nyaa"])
+    shared = make_torrent("Show.S01E02.1080p.WEB.x264", "c" * 40, "YTS")
+    a_only = make_torrent("Show.S01E02.720p.WEB.x264", "a" * 40, "YTS")
+    b_only = make_torrent("Show.S01E02.1080p.BluRay.x264", "b" * 40, "Nyaa")
+    a_pack = make_torrent("Show.S01.1080p.WEB.x264", "d" * 40, "YTS")
+    b_pack = make_torrent("Show.S01.720p.BluRay.x264", "e" * 40, "Nyaa")
+
+    async def test():
+        # A scrapes, then B, then A asks again
+        await cache_torrents("tt2", *search_a, 1, 2, [shared, a_only, a_pack])
+        await cache_writer.flush()
+        await cache_torrents("tt2", *search_b, 1, 2, [shared, b_only, b_pack])
+        await cache_writer.flush()
+
+        cached = await get_cached_torrents("tt2", *search_a, 1, 2)
+        assert info_hashes(cached) == ["a" * 40, "c" * 40, "d" * 40]
+        cached = await get_cached_torrents("tt2", *search_b, 1, 2)
+        assert info_hashes(cached) == ["b" * 40, "c" * 40, "e" * 40]
+
+        # season packs reused for the other episodes follow the same rule
+        assert info_hashes(await get_season_packs("tt2", search_a[1], 1)) == ["d" * 40]
+        assert info_hashes(await get_season_packs("tt2", search_b[1], 1)) == ["e" * 40]
+
+    with_database(test)
+
+
+def test_search_id_ignores_indexer_order(sources):
+    assert get_search_id(
+        "tt1", get_search_indexers({"indexers": ["yts", "nyaa"]})
+    ) == get_search_id("tt1", get_search_indexers({"indexers": ["nyaa", "yts"]}))
+
+
+def test_indexers_are_not_recorded_without_an_indexer_manager(sources, monkeypatch):
+    monkeypatch.setattr(settings, "INDEXER_MANAGER_TYPE", None)
+    monkeypatch.setattr(settings, "ZILEAN_URL", "http://zilean")
+
+    assert get_search_indexers({"indexers": ["yts"]}) == ["dmm"]